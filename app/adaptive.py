@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import typing
+from collections import deque
+from config import (
+    ADAPTIVE_RTT_WINDOW, ADAPTIVE_RTT_PERCENTILE, ADAPTIVE_MIN_SAMPLES, ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_MIN_TIMEOUT,
+    ADAPTIVE_MIN_CONCURRENCY, ADAPTIVE_WINDOW, ADAPTIVE_MAX_RESET_RATE, ADAPTIVE_TIMEOUT_RATE_SLACK, adaptive_logger,
+)
+from db.schemas import TIMEOUT, CONNECTION_RESET
+
+T = typing.TypeVar('T')
+
+class AdaptiveController():
+    def __init__(self, timeout: float, concurrency: int):
+        self.max_timeout = timeout
+        self.timeout = float(timeout)
+        self.max_limit = max(concurrency, 1)
+        self.min_limit = min(ADAPTIVE_MIN_CONCURRENCY, self.max_limit)
+        self.limit = self.max_limit
+        self.rtts: deque[float] = deque(maxlen=ADAPTIVE_RTT_WINDOW)
+        self.rtt_percentile: float | None = None
+        self.timeout_rate = 0.0
+        self.reset_rate = 0.0
+        self._baseline_timeout_rate: float | None = None
+        self._observed = 0
+        self._timeouts = 0
+        self._resets = 0
+        self._drained = False
+        self._cond = threading.Condition()
+        self._wake: asyncio.Event | None = None
+
+    def __str__(self):
+        rtt = f'{self.rtt_percentile:.2f}s' if self.rtt_percentile is not None else '-'
+        return f'timeout {self.timeout:.2f}s, concurrency {self.limit:_} / {self.max_limit:_}, p{ADAPTIVE_RTT_PERCENTILE * 100:g} rtt {rtt}, timeouts {self.timeout_rate:.1%}, resets {self.reset_rate:.1%}'
+
+    def observe_success(self, rtt: float):
+        with self._cond:
+            self.rtts.append(rtt)
+            self._observe()
+
+    def observe_failure(self, category: str):
+        with self._cond:
+            if category == TIMEOUT:
+                self._timeouts += 1
+            elif category == CONNECTION_RESET:
+                self._resets += 1
+            self._observe()
+
+    def _observe(self):
+        self._observed += 1
+        if self._observed >= max(ADAPTIVE_WINDOW, self.limit):
+            self._adjust()
+
+    def _adjust(self):
+        self.timeout_rate = self._timeouts / self._observed
+        self.reset_rate = self._resets / self._observed
+        self._observed = self._timeouts = self._resets = 0
+        if len(self.rtts) >= ADAPTIVE_MIN_SAMPLES:
+            rtts = sorted(self.rtts)
+            self.rtt_percentile = rtts[min(int(len(rtts) * ADAPTIVE_RTT_PERCENTILE), len(rtts) - 1)]
+            self.timeout = min(max(self.rtt_percentile * ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_MIN_TIMEOUT), self.max_timeout)
+        if self._baseline_timeout_rate is None or self.timeout_rate < self._baseline_timeout_rate:
+            self._baseline_timeout_rate = self.timeout_rate
+        limit = self.limit
+        if self.reset_rate > ADAPTIVE_MAX_RESET_RATE or self.timeout_rate > self._baseline_timeout_rate + ADAPTIVE_TIMEOUT_RATE_SLACK:
+            self.limit = max(self.limit // 2, self.min_limit)
+        else:
+            self.limit = min(self.limit + max(self.max_limit // 16, 1), self.max_limit)
+        if self.limit < limit:
+            adaptive_logger.info(f'backing off: {self}')
+        elif self.limit > limit:
+            self._notify()
+
+    def _notify(self):
+        self._cond.notify_all()
+        if self._wake:
+            wake, self._wake = self._wake, asyncio.Event()
+            wake.set()
+
+    def drain(self):
+        with self._cond:
+            self._drained = True
+            self._notify()
+
+    def gate(self, index: int, funcs: typing.Iterator[T]) -> typing.Iterator[T]:
+        while True:
+            with self._cond:
+                while index >= self.limit and not self._drained:
+                    self._cond.wait()
+            try:
+                func = next(funcs)
+            except StopIteration:
+                return self.drain()
+            yield func
+
+    async def wait_turn_a(self, index: int):
+        while index >= self.limit and not self._drained:
+            if not self._wake:
+                self._wake = asyncio.Event()
+            await self._wake.wait()
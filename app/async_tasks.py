@@ -0,0 +1,65 @@
+import asyncio
+import typing
+import time
+from config import THREADS_NOTIFY_PERIOD, ASYNC_CONCURRENCY, async_logger
+from threads import WorkQueue, report_tail, start_pool_thread, stop_pool_thread
+from utils import raise_open_files_limit, LazyIterable
+from adaptive import AdaptiveController
+from db.controller import DBPool
+
+class Progress():
+    def __init__(self):
+        self.completed = 0
+        self.results: list[typing.Any] = []
+
+async def worker(index: int, funcs: typing.Iterator[typing.Callable[..., typing.Awaitable[typing.Any]]], progress: Progress, adaptive: AdaptiveController | None = None, **kwargs):
+    while True:
+        if adaptive:
+            await adaptive.wait_turn_a(index)
+        try:
+            func = next(funcs)
+        except StopIteration:
+            if adaptive:
+                adaptive.drain()
+            return
+        result = await func(**kwargs)
+        progress.completed += 1
+        if result:
+            progress.results.append(result)
+
+async def watch_progress(funcs: typing.Sized, progress: Progress, adaptive: AdaptiveController | None = None):
+    while True:
+        await asyncio.sleep(THREADS_NOTIFY_PERIOD)
+        print(f'[async] completed {progress.completed:_} / {len(funcs):_} coroutine calls' + (f', {adaptive}' if adaptive else ''))
+
+async def _run_async(
+        funcs: typing.Sequence[typing.Callable[..., typing.Awaitable[typing.Any]]] | LazyIterable[typing.Callable[..., typing.Awaitable[typing.Any]]],
+        concurrency: int,
+        pool: DBPool | None = None,
+        adaptive: AdaptiveController | None = None,
+    ):
+    progress = Progress()
+    queue = WorkQueue(funcs)
+    watcher = asyncio.create_task(watch_progress(funcs, progress, adaptive))
+    workers = [asyncio.create_task(worker(i, queue, progress, adaptive, pool=pool)) for i in range(concurrency)]
+    await asyncio.gather(*workers)
+    watcher.cancel()
+    report_tail(queue, time.time(), async_logger)
+    return progress.results
+
+def run_async(
+        funcs: typing.Sequence[typing.Callable[..., typing.Awaitable[typing.Any]]] | LazyIterable[typing.Callable[..., typing.Awaitable[typing.Any]]],
+        concurrency: int = ASYNC_CONCURRENCY,
+        pool: DBPool | None = None,
+        adaptive: AdaptiveController | None = None,
+    ):
+    if len(funcs) < concurrency:
+        concurrency = len(funcs)
+    limit = raise_open_files_limit(concurrency + 64)
+    if limit < concurrency + 64:
+        async_logger.info(f'[warning] open files limit is {limit:_}, some probes will fail with OSError. consider lowering --concurrency')
+    pool_thread = start_pool_thread(pool)
+    print(f'[async] running {len(funcs):_} coroutines with {concurrency:_} in flight')
+    results = asyncio.run(_run_async(funcs, concurrency, pool, adaptive))
+    stop_pool_thread(pool, pool_thread, async_logger)
+    return results
@@ -0,0 +1,171 @@
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+from config import (
+    FARM_HOST, FARM_FIRST_PORT, BENCHMARK_PORTS, BENCHMARK_TIMEOUT, BENCHMARK_THREADS, BENCHMARK_CONCURRENCY, BENCHMARK_RESULTS, SLP_CLIENT, SLP_CLIENTS,
+    benchmark_logger, scanner_logger, db_logger, threads_logger, async_logger, prefilter_logger, resolver_logger,
+)
+from fake_farm import FarmConfig, run_farm
+from utils import load_lines
+
+PREFILTERED = '+prefilter'
+
+def engine_names():
+    from mine_scanner import ENGINES
+    return [*ENGINES, *[f'{name}{PREFILTERED}' for name in ENGINES]]
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+def run_engine(name: str, farm: FarmConfig, workers: int, timeout: float, db_path: str, results: typing.Any, verbose: bool, slp_client: str = SLP_CLIENT):
+    from db.controller import set_db_path
+    set_db_path(db_path)
+    from mine_scanner import ENGINES, set_slp_client
+    from tcp_prefilter import prefiltered
+    from metrics import PROBES, PROBE_LATENCY, CONNECT_LATENCY, STATUS_LATENCY, POOL_RECORDS, FLUSH_LATENCY
+    from db.controller import DBPool
+    from db.records import socket_record
+    if not verbose:
+        [logger.setLevel(logging.WARNING) for logger in (scanner_logger, db_logger, threads_logger, async_logger, prefilter_logger, resolver_logger)]
+        logging.getLogger('asyncio').setLevel(logging.ERROR) # writes to servers that already hung up
+    set_slp_client(slp_client)
+    _, check_target_sockets = ENGINES[name.removesuffix(PREFILTERED)]
+    if name.endswith(PREFILTERED):
+        _, check_target_sockets = prefiltered(check_target_sockets)
+    pool = DBPool()
+    sockets = [socket_record(FARM_HOST, port) for port in range(farm.first_port, farm.first_port + farm.ports)]
+    start = time.time()
+    servers = check_target_sockets(sockets, pool, workers, timeout)
+    elapsed = time.time() - start
+    flushes = FLUSH_LATENCY.snapshot()
+    flush_time = (flushes['mean'] or 0) * flushes['count']
+    results.put({
+        'engine': name,
+        'workers': workers,
+        'slp_client': slp_client,
+        'seconds': round(elapsed, 2),
+        'probes': PROBES.total(),
+        'probes_per_second': round(PROBES.total() / elapsed, 1) if elapsed else 0,
+        'servers': len(servers),
+        'probe_p50': PROBE_LATENCY.quantile(0.5),
+        'probe_p99': PROBE_LATENCY.quantile(0.99),
+        'connect_p50': CONNECT_LATENCY.quantile(0.5),
+        'status_p50': STATUS_LATENCY.quantile(0.5),
+        'status_p99': STATUS_LATENCY.quantile(0.99),
+        'peak_rss_mb': peak_rss_mb(),
+        'db_records_per_second': round(POOL_RECORDS.total() / flush_time, 1) if flush_time else None,
+    })
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+def previous_results(filepath: str, farm: dict[str, typing.Any], timeout: float, slp_client: str = SLP_CLIENT) -> dict[str, dict[str, typing.Any]]:
+    previous: dict[str, dict[str, typing.Any]] = {}
+    for line in load_lines(filepath):
+        run = json.loads(line)
+        if run['farm'] != farm or run['timeout'] != timeout: continue
+        for result in run['results']:
+            if result.get('slp_client', 'mcstatus') != slp_client: continue
+            previous[result['engine']] = {**result, 'version': run['version']}
+    return previous
+
+def change(current: float | None, previous: float | None):
+    if not current or not previous:
+        return ''
+    return f' ({(current - previous) / previous:+.1%})'
+
+def fmt(value: float | None, scale: float = 1, unit: str = ''):
+    return '-' if value is None else f'{value * scale:_.1f}{unit}'
+
+def report(results: list[dict[str, typing.Any]], previous: dict[str, dict[str, typing.Any]]):
+    for result in results:
+        prev = previous.get(result['engine'], {})
+        since = f" vs {prev['version'] or 'previous run'}" if prev else ''
+        benchmark_logger.info(
+            f"{result['engine']}{since}: {result['probes']:_.0f} probes in {result['seconds']} seconds, "
+            f"{fmt(result['probes_per_second'])} probes/s{change(result['probes_per_second'], prev.get('probes_per_second'))}, "
+            f"probe p50 {fmt(result['probe_p50'], 1000, 'ms')} p99 {fmt(result['probe_p99'], 1000, 'ms')}{change(result['probe_p99'], prev.get('probe_p99'))}, "
+            f"peak rss {fmt(result['peak_rss_mb'], 1, 'MB')}{change(result['peak_rss_mb'], prev.get('peak_rss_mb'))}, "
+            f"db {fmt(result['db_records_per_second'])} records/s, {result['servers']} servers found"
+        )
+
+def benchmark(farm: FarmConfig, engines: list[str], threads: int, concurrency: int, timeout: float, results_path: str, verbose: bool = False, slp_client: str = SLP_CLIENT):
+    ctx = multiprocessing.get_context('spawn')
+    started = ctx.Event()
+    farm_process = ctx.Process(target=run_farm, args=(farm, started), daemon=True)
+    farm_process.start()
+    if not started.wait(60):
+        farm_process.terminate()
+        raise Exception('Fake server farm did not start!')
+    results: list[dict[str, typing.Any]] = []
+    queue = ctx.Queue()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in engines:
+                workers = concurrency if name.startswith('async') else threads
+                benchmark_logger.info(f'running {name} engine with {workers:_} workers and {slp_client} status client against {farm.ports:_} ports')
+                process = ctx.Process(target=run_engine, args=(name, farm, workers, timeout, os.path.join(tmp, f'{name}.db'), queue, verbose, slp_client))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    benchmark_logger.info(f'[warning] {name} engine exited with code {process.exitcode}')
+                    continue
+                results.append(queue.get())
+    finally:
+        farm_process.terminate()
+    previous = previous_results(results_path, farm.as_dict(), timeout, slp_client)
+    report(results, previous)
+    run = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'version': git_version(),
+        'python': sys.version.split()[0],
+        'timeout': timeout,
+        'farm': farm.as_dict(),
+        'results': results,
+    }
+    with open(results_path, 'at') as f:
+        f.write(json.dumps(run) + '\n')
+    benchmark_logger.info(f'results appended to {results_path}')
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark scan engines against a local fake minecraft server farm')
+    parser._optionals.title = "OPTIONS"
+    parser.add_argument('-e', '--engines', help=f'Engines to benchmark (default - all)', nargs='+', choices=engine_names(), default=engine_names())
+    parser.add_argument('-n', '--ports', help=f'Number of farm ports to scan (default - {BENCHMARK_PORTS})', type=int, default=BENCHMARK_PORTS)
+    parser.add_argument('--first_port', help=f'First farm port (default - {FARM_FIRST_PORT})', type=int, default=FARM_FIRST_PORT)
+    parser.add_argument('--servers', help='Share of ports answering the status request (default - 0.1)', type=float, default=0.1)
+    parser.add_argument('--drop', help='Share of ports accepting connections and never answering (default - 0.1)', type=float, default=0.1)
+    parser.add_argument('--slow', help='Share of ports answering after --slow_latency (default - 0.05)', type=float, default=0.05)
+    parser.add_argument('--garbage', help='Share of ports answering with random bytes (default - 0.05)', type=float, default=0.05)
+    parser.add_argument('--latency', help='Mean response delay of servers in seconds (default - 0.05)', type=float, default=0.05)
+    parser.add_argument('--slow_latency', help='Mean response delay of slow servers in seconds (default - 0.5)', type=float, default=0.5)
+    parser.add_argument('--seed', help='Seed for the port layout (default - 0)', type=int, default=0)
+    parser.add_argument('-t', '--threads', help=f'Threads for threads engines (default - {BENCHMARK_THREADS})', type=int, default=BENCHMARK_THREADS)
+    parser.add_argument('-c', '--concurrency', help=f'Sockets in flight for async engines (default - {BENCHMARK_CONCURRENCY})', type=int, default=BENCHMARK_CONCURRENCY)
+    parser.add_argument('-tm', '--timeout', help=f'Timeout in seconds for socket response (default - {BENCHMARK_TIMEOUT})', type=float, default=BENCHMARK_TIMEOUT)
+    parser.add_argument('-sl', '--slp_client', help=f'Minecraft status client: builtin or mcstatus (default - {SLP_CLIENT})', type=str, choices=SLP_CLIENTS, default=SLP_CLIENT)
+    parser.add_argument('-r', '--results', help=f'Json lines file to append results to (default - {BENCHMARK_RESULTS})', type=str, default=BENCHMARK_RESULTS)
+    parser.add_argument('-v', '--verbose', help='Keep scanner and db logs', action='store_true')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    farm = FarmConfig(args.ports, args.first_port, args.servers, args.drop, args.slow, args.garbage, args.latency, args.slow_latency, args.seed)
+    benchmark(farm, args.engines, args.threads, args.concurrency, args.timeout, args.results, args.verbose, args.slp_client)
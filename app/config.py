@@ -16,9 +16,78 @@ db_logger = gen_logger('db')
 scanner_logger = gen_logger('scanner')
 threads_logger = gen_logger('threads')
 main_logger = gen_logger('main')
+async_logger = gen_logger('async')
+prefilter_logger = gen_logger('prefilter')
+resolver_logger = gen_logger('resolver')
+adaptive_logger = gen_logger('adaptive')
+metrics_logger = gen_logger('metrics')
+benchmark_logger = gen_logger('benchmark')
+limiter_logger = gen_logger('limiter')
+profile_logger = gen_logger('profile')
+targets_logger = gen_logger('targets')
+enrich_logger = gen_logger('enrich')
 
 THREADS=2048
+ASYNC_CONCURRENCY=20_000
+ENGINE='threads'
+PREFILTER_THREADS=4
+PREFILTER_IN_FLIGHT=4096
 THREADS_NOTIFY_PERIOD=15
-DB_POOL_RELEASE_PERIOD=60
+DB_POOL_RELEASE_PERIOD=10
+DB_POOL_FLUSH_SIZE=20_000
+DB_POOL_QUEUE_SIZE=100_000
 SOCKET_RESPONSE_TIMEOUT=10
+DNS_CACHE_TTL=300
+DNS_NEGATIVE_CACHE_TTL=30
+NGROK_HOSTS=[f'{i}.tcp.eu.ngrok.io' for i in range(10)]
+NGROK_PORTS=65_535
 DB_PATH='mservers.db'
+DB_BUSY_TIMEOUT=60
+DB_BULK_CHUNK=50_000
+DB_PAGE_SIZE=10_000
+ADAPTIVE_RTT_WINDOW=2048
+ADAPTIVE_RTT_PERCENTILE=0.99
+ADAPTIVE_MIN_SAMPLES=50
+ADAPTIVE_TIMEOUT_FACTOR=2
+ADAPTIVE_MIN_TIMEOUT=0.5
+ADAPTIVE_MIN_CONCURRENCY=16
+ADAPTIVE_WINDOW=1000
+ADAPTIVE_MAX_RESET_RATE=0.05
+ADAPTIVE_TIMEOUT_RATE_SLACK=0.1
+RESCAN_BUCKET_SIZE=256
+RESCAN_PRIOR_WEIGHT=100
+METRICS_HOST='127.0.0.1'
+METRICS_JSON_PERIOD=15
+LATENCY_BUCKETS=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FLUSH_BUCKETS=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FARM_HOST='127.0.0.1'
+FARM_FIRST_PORT=30_000
+BENCHMARK_PORTS=2_000
+BENCHMARK_TIMEOUT=1
+BENCHMARK_THREADS=256
+BENCHMARK_CONCURRENCY=2_000
+BENCHMARK_RESULTS='benchmarks.jsonl'
+SINK_BUFFER_SIZE=65_536
+SINK_FLUSH_PERIOD=1
+JOURNAL_BUFFER_SIZE=65_536
+JOURNAL_FLUSH_PERIOD=1
+TARGETS_DEDUP_MB=64
+TARGETS_DEDUP_FP_RATE=0.0001
+TARGETS_WINDOW=10_000
+TARGETS_SAMPLE_BYTES=1_048_576
+ENRICH_CONCURRENCY=64
+ENRICH_QUEUE_SIZE=10_000
+ENRICH_TIMEOUT=5
+ENRICH_FLUSH_SIZE=500
+ENRICH_FLUSH_PERIOD=5
+SLP_CLIENTS=('builtin', 'mcstatus')
+SLP_CLIENT='builtin'
+SLP_PROTOCOL_VERSION=47
+SLP_BUFFER_SIZE=65_536
+SLP_MAX_RESPONSE=2_097_152
+HOST_RATE=0
+HOST_BURST=10
+NEGATIVE_TTLS={'refused': 6 * 3600, 'timeout': 600, 'reset': 1800, 'unreachable': 3600, 'dns': 600, 'protocol': 86400, 'os': 1800}
+PROFILE_NAME='profile'
+PROFILE_INTERVAL=0.01
+PROFILE_TOP=30
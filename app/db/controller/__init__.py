@@ -1,2 +1,2 @@
 from .dbcontoller import DBController, DBPool, DBBaseController
-from .engine import Session
\ No newline at end of file
+from .engine import Session, set_db_path, db_path
\ No newline at end of file
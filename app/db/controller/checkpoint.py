@@ -0,0 +1,40 @@
+from bisect import bisect_left
+import threading
+
+class Page():
+    def __init__(self, first_id: int, last_id: int, size: int):
+        self.first_id = first_id
+        self.last_id = last_id
+        self.pending = size
+
+class PageCheckpoint():
+    def __init__(self, name: str, last_id: int = 0):
+        self.name = name
+        self.last_id = last_id
+        self.saved_id = last_id
+        self.exhausted = False
+        self._pages: list[Page] = []
+        self._last_ids: list[int] = []
+        self._lock = threading.Lock()
+
+    def add_page(self, ids: list[int]):
+        with self._lock:
+            self._pages.append(Page(ids[0], ids[-1], len(ids)))
+            self._last_ids.append(ids[-1])
+
+    def finish(self):
+        self.exhausted = True
+
+    def done(self, ids: list[int]):
+        with self._lock:
+            for id in ids:
+                i = bisect_left(self._last_ids, id)
+                if i < len(self._pages) and self._pages[i].first_id <= id:
+                    self._pages[i].pending -= 1
+            while self._pages and self._pages[0].pending <= 0:
+                self.last_id = self._pages.pop(0).last_id
+                self._last_ids.pop(0)
+
+    @property
+    def complete(self):
+        return self.exhausted and not self._pages
@@ -1,28 +1,97 @@
 from .engine import session_factory, scoped_session
-from .models import StatusDB, SocketDB, HostDB, MServerDB, BaseDB, create_all
-from ..schemas import Status, Socket, Host, MServer, Base as BaseModel
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import text, update, select, bindparam, func
+from .models import StatusDB, SocketDB, HostDB, MServerDB, ScanStateDB, FailureTimesDB, EnrichmentDB, CheckpointDB, BaseDB, create_all
+from .checkpoint import PageCheckpoint
+from .scan_state import ScanStates, HostState, encode_ports, decode_ports, decode_times, empty_times, in_shard, host_key, PORTS
+from .negative_cache import NegativeCache, skip_map
+from .rescan import rank_buckets, bucket_sockets
+from .journal import Journal, read_segment, segment_paths, SERVER_RECORD, SOCKET_UPDATE_RECORD, SOCKET_ADD_RECORD
+from ..schemas import Status, Socket, Host, MServer, Base as BaseModel, MINECRAFT_SERVER, STATUS_DESCRIPTIONS
+from ..records import HostRecord, StatusRecord, SocketRecord, ServerRecord, EnrichmentRecord, host_record, status_record, socket_record
 from config import db_logger
-from config import DB_POOL_RELEASE_PERIOD, DB_PATH
-from threading import Lock
-from utils import read, load, split_by_n, write
+from config import DB_POOL_RELEASE_PERIOD, DB_POOL_FLUSH_SIZE, DB_POOL_QUEUE_SIZE, DB_BULK_CHUNK, DB_PAGE_SIZE, NGROK_HOSTS, NGROK_PORTS
+from threading import Lock, Event
+from utils import load, split_by_n, interleave, interleave_by, permuted, LazyIterable
+from sinks import Sinks
+from metrics import POOL_BACKLOG, POOL_BLOCKED, POOL_RECORDS, FLUSH_LATENCY
+from profiling import timed
+from itertools import chain, islice
+import asyncio
 import typing
+import queue
 import time
+import os
+
+MERGE_STATEMENTS = [
+    'INSERT OR IGNORE INTO hosts (name) SELECT name FROM shard.hosts',
+    'INSERT OR IGNORE INTO statuses (name, details) SELECT name, details FROM shard.statuses',
+    """INSERT INTO sockets (hostId, port, statusId)
+        SELECT h.id, s.port, st.id FROM shard.sockets s
+        JOIN shard.hosts sh ON sh.id = s.hostId JOIN hosts h ON h.name = sh.name
+        LEFT JOIN shard.statuses sst ON sst.id = s.statusId LEFT JOIN statuses st ON st.name = sst.name
+        WHERE true
+        ON CONFLICT (hostId, port) DO UPDATE SET statusId = coalesce(excluded.statusId, sockets.statusId)""",
+    """INSERT OR IGNORE INTO mservers (socketId, version, description, max_players)
+        SELECT s.id, m.version, m.description, m.max_players FROM shard.mservers m
+        JOIN shard.sockets ss ON ss.id = m.socketId JOIN shard.hosts sh ON sh.id = ss.hostId
+        JOIN hosts h ON h.name = sh.name JOIN sockets s ON s.hostId = h.id AND s.port = ss.port""",
+]
+
+SHARD_SOCKETS_JOIN = """JOIN shard.sockets ss ON ss.id = x.socketId JOIN shard.hosts sh ON sh.id = ss.hostId
+        JOIN hosts h ON h.name = sh.name JOIN sockets s ON s.hostId = h.id AND s.port = ss.port"""
+
+MERGE_ENRICHMENT_STATEMENTS = [
+    f"""INSERT INTO enrichments (socketId, online_players, protocol, latency_ms, favicon_hash, mod_loader, enriched_at)
+        SELECT s.id, x.online_players, x.protocol, x.latency_ms, x.favicon_hash, x.mod_loader, x.enriched_at FROM shard.enrichments x
+        {SHARD_SOCKETS_JOIN} WHERE true
+        ON CONFLICT (socketId) DO UPDATE SET online_players = excluded.online_players, protocol = excluded.protocol, latency_ms = excluded.latency_ms,
+            favicon_hash = excluded.favicon_hash, mod_loader = excluded.mod_loader, enriched_at = excluded.enriched_at
+        WHERE excluded.enriched_at > enrichments.enriched_at""",
+    f"""INSERT INTO player_samples (socketId, uuid, name, seen_at)
+        SELECT s.id, x.uuid, x.name, x.seen_at FROM shard.player_samples x {SHARD_SOCKETS_JOIN} WHERE true
+        ON CONFLICT (socketId, uuid) DO UPDATE SET name = excluded.name, seen_at = excluded.seen_at WHERE excluded.seen_at > player_samples.seen_at""",
+    f"""INSERT OR IGNORE INTO server_mods (socketId, mod_id, version)
+        SELECT s.id, x.mod_id, x.version FROM shard.server_mods x {SHARD_SOCKETS_JOIN}""",
+]
+
+FOLDED_SOCKETS_DELETE = """DELETE FROM sockets WHERE hostId = :hostId AND id NOT IN (SELECT socketId FROM mservers)
+    AND (statusId IS NULL OR statusId IN ({categories}))"""
+
+INSERT_SERVERS_STATEMENT = """INSERT OR IGNORE INTO mservers (socketId, version, description, max_players)
+    SELECT id, :version, :description, :max_players FROM sockets WHERE hostId = :hostId AND port = :port"""
+
+UPSERT_ENRICHMENTS_STATEMENT = """INSERT INTO enrichments (socketId, online_players, protocol, latency_ms, favicon_hash, mod_loader, enriched_at)
+    SELECT id, :online_players, :protocol, :latency_ms, :favicon_hash, :mod_loader, :enriched_at FROM sockets WHERE hostId = :hostId AND port = :port
+    ON CONFLICT (socketId) DO UPDATE SET online_players = excluded.online_players, protocol = excluded.protocol, latency_ms = excluded.latency_ms,
+        favicon_hash = excluded.favicon_hash, mod_loader = excluded.mod_loader, enriched_at = excluded.enriched_at"""
+
+UPSERT_PLAYERS_STATEMENT = """INSERT INTO player_samples (socketId, uuid, name, seen_at)
+    SELECT id, :uuid, :name, :seen_at FROM sockets WHERE hostId = :hostId AND port = :port
+    ON CONFLICT (socketId, uuid) DO UPDATE SET name = excluded.name, seen_at = excluded.seen_at"""
+
+UPSERT_MODS_STATEMENT = """INSERT INTO server_mods (socketId, mod_id, version)
+    SELECT id, :mod_id, :version FROM sockets WHERE hostId = :hostId AND port = :port
+    ON CONFLICT (socketId, mod_id) DO UPDATE SET version = excluded.version"""
 
 class DBBaseController():
     def __init__(self):
         self.Session = scoped_session(session_factory)
         self._conn = self.Session()
+        self._status_ids: dict[str, int] = {}
         create_all()
         self._init_sql()
-        self.MINECRAFT_SERVER_STATUS: Status = [stat for stat in self.get_statuses() if stat.name == 'Minecraft Server'][0]
+        self.MINECRAFT_SERVER_STATUS = status_record(MINECRAFT_SERVER)
 
     def __del__(self):
         self.Session.remove()
         db_logger.info('connection closed')
 
     def _init_sql(self):
-        status = Status(name='Minecraft Server')
-        self.safe_add_all_statuses([status])
+        self._conn.execute(text('CREATE INDEX IF NOT EXISTS ix_sockets_statusId ON sockets (statusId)'))
+        self._conn.commit()
+        self.safe_add_all_statuses([status_record(name) for name in STATUS_DESCRIPTIONS])
+        self._status_ids.update(self.status_ids(list(STATUS_DESCRIPTIONS))) # records are interned per process, another controller may have set their ids
 
     def get_statuses(self, status_in: list[str] = [], limit: int | None = None):
         q = self._conn.query(StatusDB)
@@ -84,100 +153,228 @@ class DBBaseController():
             return []
         return [Entity_type.from_orm(rec) for rec in entities_db]
 
-    def safe_add_all_hosts(self, hosts: list[Host]):
-        hosts_to_add: list[Host] = []
-        hostnames: list[str] = [h.name for h in hosts]
-        hosts_from_db = self.get_hosts(hostname_in=hostnames, limit=len(hostnames))
-        hosts_map = { host.name: host for host in hosts_from_db }
-        for host in hosts:
-            if host.name in hosts_map:
-                host.id = hosts_map[host.name].id
-                continue
-            if host.name in [h.name for h in hosts_to_add]:
-                continue
-            hosts_to_add.append(host)
-        self.add_all(hosts_to_add) #type: ignore
-        hosts_map = { host.name: host.id for host in hosts if host.id > 0 }
+    def insert_or_ignore(self, DB_type: typing.Type[BaseDB], rows: list[dict[str, typing.Any]]) -> int:
+        if not rows: return 0
+        res = self._conn.connection().execute(sqlite_insert(DB_type).on_conflict_do_nothing(), rows)
+        self._conn.commit()
+        return res.rowcount
+
+    def host_ids(self, names: list[str]) -> dict[str, int]:
+        return dict(self._conn.execute(select(HostDB.name, HostDB.id).where(HostDB.name.in_(names))).all()) #type: ignore
+
+    @timed('db.add_hosts')
+    def safe_add_all_hosts(self, hosts: list[HostRecord]):
+        hosts = [h for h in hosts if not h.id]
+        hostnames: list[str] = list({h.name: None for h in hosts})
+        hosts_map: dict[str, int] = {}
+        new_hosts_c = 0
+        for names in split_by_n(hostnames, 900): # sqlite has parameter limit of 999
+            if not names: continue
+            chunk_map = self.host_ids(names)
+            new_c = self.insert_or_ignore(HostDB, [{'name': name} for name in names if name not in chunk_map])
+            if new_c or len(chunk_map) < len(names):
+                chunk_map = self.host_ids(names)
+            hosts_map.update(chunk_map)
+            new_hosts_c += new_c
         for host in hosts:
             host.id = hosts_map[host.name]
-        return len(hosts_to_add)
-    
-    def safe_add_all_sockets(self, sockets: list[Socket], notify=False, commit=True):
-        sockets_splitted = split_by_n(sockets, 333) # slqlite has parameter limit of 999
+        return new_hosts_c
+
+    def _socket_rows(self, sockets: list[SocketRecord]):
+        new_hosts_c = self.safe_add_all_hosts([s.host for s in sockets])
+        statuses = [s.status for s in sockets if s.status and not s.status.id]
+        if statuses:
+            self.safe_add_all_statuses(statuses)
+        rows = [{'hostId': s.host.id, 'port': s.port, 'statusId': s.status.id if s.status else None} for s in sockets]
+        return new_hosts_c, rows
+
+    @timed('db.add_sockets')
+    def safe_add_all_sockets(self, sockets: typing.Sequence[SocketRecord], notify=False, commit=True):
+        stmt = sqlite_insert(SocketDB).on_conflict_do_nothing(index_elements=['hostId', 'port'])
         new_hosts_c = 0
         total_socks_to_add = 0
         total_to_load = len(sockets)
         total_passed = 0
-        for sockets in sockets_splitted:
-            socks_to_add: list[Socket] = []
-            hosts: list[Host] = [s.host for s in sockets]
-            new_hosts_c += self.safe_add_all_hosts(hosts)
-            host_ids: list[int] = [h.id for h in hosts]
-            ports: list[int] = [s.port for s in sockets]
-            socks_from_db = self.get_sockets(host_id_in=host_ids, port_in=ports, limit=len(host_ids)*len(ports))
-            socks_map = { (sock.host.id, sock.port): sock for sock in socks_from_db }        
-            for sock in sockets:
-                socks_map_key = (sock.host.id, sock.port)
-                if socks_map_key in socks_map:
-                    sock.id = socks_map[socks_map_key].id
-                    continue
-                if socks_map_key in [(s.host.id, s.port) for s in socks_to_add]:
-                    continue
-                socks_to_add.append(sock)
-            self.add_all(socks_to_add, commit=commit) #type: ignore
-            if notify and total_passed % 50_000 < 333 and total_passed > 50_000:
+        for chunk in split_by_n(sockets, DB_BULK_CHUNK):
+            if not chunk: continue
+            hosts_c, rows = self._socket_rows(chunk)
+            new_hosts_c += hosts_c
+            total_socks_to_add += self._conn.connection().execute(stmt, rows).rowcount
+            if commit:
+                self._conn.commit()
+            total_passed += len(chunk)
+            if notify:
                 db_logger.info(f'{total_passed:_} / {total_to_load:_} sockets added to db')
-            total_socks_to_add += len(socks_to_add)
-            total_passed += len(sockets)
         if not commit:
             self._conn.commit()
         return (new_hosts_c, total_socks_to_add)
 
-    def safe_add_all_servers(self, servers: list[MServer], output_to: str = ''):
-        servers_to_add: list[MServer] = []
-        socks: list[Socket] = [s.socket for s in servers]
-        new_ips_c, new_socks_c = self.safe_add_all_sockets(socks)
-        servers_from_db = self.get_servers(socket_id_in=[s.id for s in socks], limit=len(socks))
-        servers_map = { s.socket.id: s for s in servers_from_db }
-        for server in servers:
-            if server.socket.id in servers_map:
-                server.id = servers_map[server.socket.id].id
-                continue
-            if server.socket.id in [s.socket.id for s in servers_to_add]:
-                continue
-            servers_to_add.append(server)
-        self.add_all(servers_to_add) #type: ignore
-        if output_to and len(servers) > 0:
-            write(output_to, '\n'.join([s.printable for s in servers])+'\n' ,'at')
-            db_logger.info(f'dumped found servers to {output_to}')
-        return (new_ips_c, new_socks_c, len(servers_to_add))
-
-    def safe_add_all_statuses(self, statuses: list[Status]):
-        to_add: list[Status] = []
-        from_db = self.get_statuses(status_in=[stat.name for stat in statuses], limit=len(statuses))
-        mapping = { x.name: x for x in from_db }
-        for a in statuses:
-            if a.name in mapping:
-                a.id = mapping[a.name].id
-                continue
-            if a.name in [x.name for x in to_add]:
-                continue
-            db_logger.info(f'new status: {a.name}')
-            to_add.append(a)
-        self.add_all(to_add) #type: ignore
-        return len(to_add)
-
-    def safe_update_all_sockets(self, sockets: list[Socket]):
-        statuses = [socket.status for socket in sockets]
-        new_statuses_c = self.safe_add_all_statuses([stat for stat in statuses if stat])
-        non_db_sockets = [socket for socket in sockets if socket.id == 0]
-        if non_db_sockets:
-            self.safe_add_all_sockets(non_db_sockets)
-        for sock in sockets:
-            sock.update_db(self, commit=False)
+    @timed('db.add_servers')
+    def safe_add_all_servers(self, servers: list[ServerRecord]):
+        if not servers: return (0, 0, 0)
+        new_ips_c, new_socks_c = self.safe_add_all_sockets([s.socket for s in servers])
+        rows = [{'hostId': s.socket.host.id, 'port': s.socket.port, 'version': s.version, 'description': s.description, 'max_players': s.max_players} for s in servers]
+        new_servers_c = self._conn.connection().execute(text(INSERT_SERVERS_STATEMENT), rows).rowcount
+        self._conn.commit()
+        return (new_ips_c, new_socks_c, new_servers_c)
+
+    def status_ids(self, names: list[str]) -> dict[str, int]:
+        return dict(self._conn.execute(select(StatusDB.name, StatusDB.id).where(StatusDB.name.in_(names))).all()) #type: ignore
+
+    @timed('db.add_statuses')
+    def safe_add_all_statuses(self, statuses: list[StatusRecord]):
+        new_statuses_c = 0
+        statuses = [stat for stat in statuses if not stat.id]
+        names = list({stat.name for stat in statuses if stat.name not in self._status_ids})
+        if names:
+            self._status_ids.update(self.status_ids(names))
+            to_add = [{'name': name, 'details': STATUS_DESCRIPTIONS.get(name)} for name in names if name not in self._status_ids]
+            for row in to_add:
+                db_logger.info(f'new status: {row["name"]}')
+            new_statuses_c = self.insert_or_ignore(StatusDB, to_add)
+            if to_add:
+                self._status_ids.update(self.status_ids(names))
+        for stat in statuses:
+            stat.id = self._status_ids[stat.name]
+        return new_statuses_c
+
+    @timed('db.update_sockets')
+    def safe_update_all_sockets(self, sockets: list[SocketRecord]):
+        new_statuses_c = self.safe_add_all_statuses([socket.status for socket in sockets if socket.status])
+        by_id = [{'b_id': s.id, 'b_statusId': s.status.id if s.status else None} for s in sockets if s.id]
+        if by_id:
+            stmt = update(SocketDB).where(SocketDB.id == bindparam('b_id')).values(statusId=bindparam('b_statusId'))
+            self._conn.connection().execute(stmt, by_id)
+        non_db_sockets = [socket for socket in sockets if not socket.id]
+        for chunk in split_by_n(non_db_sockets, DB_BULK_CHUNK):
+            if not chunk: continue
+            _, rows = self._socket_rows(chunk)
+            stmt = sqlite_insert(SocketDB)
+            stmt = stmt.on_conflict_do_update(index_elements=['hostId', 'port'], set_={'statusId': stmt.excluded.statusId})
+            self._conn.connection().execute(stmt, rows)
         self._conn.commit()
         return new_statuses_c
 
+    def get_scan_states(self, loaded: ScanStates | None = None) -> ScanStates:
+        states = loaded or ScanStates()
+        q = select(ScanStateDB.hostId, HostDB.name).join(HostDB, HostDB.id == ScanStateDB.hostId)
+        for host_id, name in self._conn.execute(q).all():
+            if name in states: continue
+            blob = self._conn.execute(select(ScanStateDB.ports).where(ScanStateDB.hostId == host_id)).scalar_one()
+            states.add(HostState(host_id, name, decode_ports(blob)))
+        return states
+
+    def fold_sockets_into_state(self, state: HostState) -> tuple[int, int]:
+        rows = self._conn.execute(select(SocketDB.port, SocketDB.statusId).where(SocketDB.hostId == state.host_id).where(SocketDB.statusId != None)).all()
+        for port, status_id in rows:
+            if not state.status(port):
+                state.mark(port, status_id)
+        deleted = self._conn.execute(text(FOLDED_SOCKETS_DELETE.format(categories=', '.join(str(self._status_ids[name]) for name in STATUS_DESCRIPTIONS))), {'hostId': state.host_id}).rowcount
+        return (len(rows), deleted)
+
+    @timed('db.track_hosts')
+    def track_hosts(self, hostnames: list[str]):
+        hosts = [host_record(name) for name in hostnames]
+        self.safe_add_all_hosts(hosts)
+        states = self.get_scan_states()
+        new_states = [HostState(h.id, h.name) for h in hosts if h.name not in states]
+        if not new_states: return 0
+        self.insert_or_ignore(ScanStateDB, [{'hostId': state.host_id, 'ports': encode_ports(state.ports)} for state in new_states])
+        folded, deleted = 0, 0
+        for state in new_states:
+            folded_c, deleted_c = self.fold_sockets_into_state(state)
+            folded += folded_c
+            deleted += deleted_c
+            states.add(state)
+        self.save_scan_states(states)
+        self._conn.commit()
+        if folded: db_logger.info(f'{folded:_} scanned sockets moved into scan state')
+        if deleted: db_logger.info(f'{deleted:_} socket rows without a server deleted, their status is kept in scan state. rows with statuses from older versions are kept')
+        return len(new_states)
+
+    @timed('db.save_scan_states')
+    def save_scan_states(self, states: ScanStates):
+        dirty = states.dirty()
+        if not dirty: return 0
+        self._conn.commit()
+        conn = self._conn.connection()
+        for state in dirty:
+            conn.execute(text('UPDATE scan_states SET hostId = hostId WHERE hostId = :hostId'), {'hostId': state.host_id}) # takes the write lock before reading
+            if state.changes:
+                blob = conn.execute(select(ScanStateDB.ports).where(ScanStateDB.hostId == state.host_id)).scalar_one()
+                ports = state.apply_to(decode_ports(blob))
+                conn.execute(update(ScanStateDB).where(ScanStateDB.hostId == state.host_id).values(ports=encode_ports(ports)))
+                state.changes = {}
+            if state.failure_changes:
+                blob = conn.execute(select(FailureTimesDB.times).where(FailureTimesDB.hostId == state.host_id)).scalar()
+                times = state.apply_failures_to(decode_times(blob) if blob else empty_times())
+                stmt = sqlite_insert(FailureTimesDB).values(hostId=state.host_id, times=encode_ports(times))
+                conn.execute(stmt.on_conflict_do_update(index_elements=['hostId'], set_={'times': stmt.excluded.times}))
+                state.failure_changes = {}
+        self._conn.commit()
+        return len(dirty)
+
+    def get_negative_cache(self, ttls: dict[str, float], now: float | None = None) -> NegativeCache:
+        now = now or time.time()
+        status_ids = self.status_ids(list(ttls))
+        ttl_by_id = {status_ids[name]: ttl for name, ttl in ttls.items() if name in status_ids}
+        states = self.get_scan_states()
+        rows = self._conn.execute(select(HostDB.name, FailureTimesDB.times).join(HostDB, HostDB.id == FailureTimesDB.hostId)).all()
+        self._conn.commit()
+        cache = NegativeCache(states.hosts)
+        evicted = 0
+        for name, blob in rows:
+            state = states.get(name)
+            if not state: continue
+            skip = skip_map()
+            for port, failed_at in enumerate(decode_times(blob)):
+                if not failed_at: continue
+                ttl = ttl_by_id.get(state.ports[port])
+                if not ttl: continue
+                if failed_at + ttl > now:
+                    skip[port] = 1
+                else:
+                    state.evict(port)
+                    evicted += 1
+            cache.add(name, skip)
+        self.save_scan_states(states)
+        db_logger.info(f'negative cache: {len(cache):_} recently failed sockets will be skipped, {evicted:_} expired entries evicted')
+        return cache
+
+    @timed('db.save_enrichments')
+    def save_enrichments(self, enrichments: list[EnrichmentRecord]):
+        if not enrichments: return
+        keys = [{'hostId': e.host_id, 'port': e.port} for e in enrichments]
+        rows = [{**key, 'online_players': e.online_players, 'protocol': e.protocol, 'latency_ms': e.latency * 1000 if e.latency is not None else None,
+            'favicon_hash': e.favicon_hash, 'mod_loader': e.mod_loader, 'enriched_at': e.enriched_at} for key, e in zip(keys, enrichments)]
+        players = [{**key, 'uuid': uuid, 'name': name, 'seen_at': e.enriched_at} for key, e in zip(keys, enrichments) for name, uuid in e.players]
+        mods = [{**key, 'mod_id': mod_id, 'version': version} for key, e in zip(keys, enrichments) for mod_id, version in e.mods]
+        conn = self._conn.connection()
+        conn.execute(text(UPSERT_ENRICHMENTS_STATEMENT), rows)
+        if players: conn.execute(text(UPSERT_PLAYERS_STATEMENT), players)
+        if mods: conn.execute(text(UPSERT_MODS_STATEMENT), mods)
+        self._conn.commit()
+
+    def get_unenriched_servers(self) -> list[tuple[int, str, int]]:
+        q = (select(SocketDB.hostId, HostDB.name, SocketDB.port)
+            .join(MServerDB, MServerDB.socketId == SocketDB.id).join(HostDB, HostDB.id == SocketDB.hostId)
+            .outerjoin(EnrichmentDB, EnrichmentDB.socketId == SocketDB.id).where(EnrichmentDB.id == None))
+        return [tuple(row) for row in self._conn.execute(q).all()] #type: ignore
+
+    def get_checkpoint(self, name: str):
+        last_id = self._conn.execute(select(CheckpointDB.lastId).where(CheckpointDB.name == name)).scalar()
+        return PageCheckpoint(name, last_id or 0)
+
+    @timed('db.save_checkpoint')
+    def save_checkpoint(self, checkpoint: PageCheckpoint):
+        last_id = 0 if checkpoint.complete else checkpoint.last_id
+        if last_id == checkpoint.saved_id: return
+        stmt = sqlite_insert(CheckpointDB).values(name=checkpoint.name, lastId=last_id)
+        stmt = stmt.on_conflict_do_update(index_elements=['name'], set_={'lastId': last_id})
+        self._conn.execute(stmt)
+        self._conn.commit()
+        checkpoint.saved_id = last_id
+
 class DBController(DBBaseController):
     def __init__(self):
         DBBaseController.__init__(self)
@@ -194,37 +391,108 @@ class DBController(DBBaseController):
         self._conn.commit()
         return MServer.from_orm(server_db)
 
-    def get_target_sockets(self):
-        res = self._conn.query(SocketDB).filter(SocketDB.statusId == None).all()
-        if len(res) == 0:
-            db_logger.info(f'[warning] no target hosts was found in database. if it is your first launch, run it with --gen_sockets, otherwise consider adjusting database file {DB_PATH}')
-        return [Socket.from_orm(rec) for rec in res]
+    def get_target_sockets(self, shard: tuple[int, int] = (0, 1), pool: 'DBPool | None' = None, port_seed: int | None = None) -> LazyIterable[SocketRecord]:
+        shard_k, shard_n = shard
+        checkpoint = self.get_checkpoint(f'db_sockets {shard_k}/{shard_n}')
+        if checkpoint.last_id:
+            db_logger.info(f'resuming from socket id {checkpoint.last_id:_}')
+        if pool:
+            pool.checkpoints.append(checkpoint)
+        q = select(SocketDB.id, SocketDB.hostId, SocketDB.port, HostDB.name).join(HostDB, HostDB.id == SocketDB.hostId)
+        q = q.where(SocketDB.statusId == None).where(SocketDB.hostId.not_in(select(ScanStateDB.hostId)))
+        if shard_n > 1:
+            q = q.where((func.host_key(HostDB.name) * PORTS + SocketDB.port) % shard_n == shard_k) # in_shard in sql
+        total = self._conn.execute(select(func.count()).select_from(q.where(SocketDB.id > checkpoint.last_id).subquery())).scalar_one()
+        states = self.get_scan_states()
+        for state in states.hosts.values():
+            if shard_n == 1:
+                total += state.unscanned_count()
+                continue
+            total += sum(1 for port in state.unscanned() if in_shard(state.key, port, shard))
+        self._conn.commit()
+        if total == 0:
+            db_logger.info(f'[warning] no target hosts was found in database. if it is your first launch, run it with --gen_sockets, otherwise consider adjusting database file {self._conn.get_bind().url.database}')
+        return LazyIterable(total, lambda: self.iter_target_sockets(q, states, checkpoint, shard, port_seed))
+
+    def iter_target_sockets(self, q, states: ScanStates, checkpoint: PageCheckpoint, shard: tuple[int, int], port_seed: int | None = None):
+        last_id = checkpoint.last_id
+        while True:
+            rows = self._conn.execute(q.where(SocketDB.id > last_id).order_by(SocketDB.id).limit(DB_PAGE_SIZE)).all()
+            self._conn.commit()
+            if not rows: break
+            checkpoint.add_page([row[0] for row in rows])
+            yield from interleave_by((socket_record(name, port, id, host_id) for id, host_id, port, name in rows), lambda s: s.host.name, port_seed)
+            last_id = rows[-1][0]
+        checkpoint.finish()
+        yield from interleave(self.iter_unscanned_sockets(state, shard, port_seed) for state in states.hosts.values())
+
+    def iter_unscanned_sockets(self, state: HostState, shard: tuple[int, int], port_seed: int | None = None):
+        host = host_record(state.name, state.host_id)
+        ports, key = state.ports, state.key
+        for port in permuted(range(1, PORTS), port_seed):
+            if not ports[port] and in_shard(key, port, shard):
+                yield SocketRecord(host, port)
+
+    def get_rescan_sockets(self, shard: tuple[int, int] = (0, 1), probes: int | None = None, seconds: float | None = None, negative: NegativeCache | None = None) -> LazyIterable[SocketRecord]:
+        q = select(SocketDB.id, SocketDB.hostId, SocketDB.port, HostDB.name).join(MServerDB, MServerDB.socketId == SocketDB.id).join(HostDB, HostDB.id == SocketDB.hostId)
+        rows = self._conn.execute(q.order_by(SocketDB.id)).all()
+        states = self.get_scan_states()
+        self._conn.commit()
+        hits: dict[int, list[int]] = {}
+        for _, host_id, port, _ in rows:
+            hits.setdefault(host_id, []).append(port)
+        [ports.sort() for ports in hits.values()]
+        buckets = rank_buckets(states.hosts.values(), hits)
+        known = [socket_record(name, port, id, host_id) for id, host_id, port, name in rows if in_shard(host_key(name), port, shard)]
+        skip = {(host_id, port) for _, host_id, port, _ in rows}
+        hot = [b for b in buckets if b.hits]
+        db_logger.info(f'rescan order: {len(known):_} known servers, then {len(hot):_} port buckets with hits ({sum(b.hits for b in hot):_} hits in {sum(b.scanned for b in hot):_} scanned ports), then {len(buckets) - len(hot):_} colder buckets')
+        total = len(known) - sum(1 for s in known if s.host.name in states)
+        for bucket in buckets:
+            ports = bucket.shard_ports(shard)
+            total += len(ports) - (negative.count(bucket.state.name, ports) if negative else 0)
+        if probes is not None:
+            total = min(total, probes)
+        return LazyIterable(total, lambda: self.iter_rescan_sockets(chain(known, bucket_sockets(buckets, skip, shard, negative)), probes, seconds))
+
+    def iter_rescan_sockets(self, sockets: typing.Iterator[SocketRecord], probes: int | None = None, seconds: float | None = None):
+        deadline = time.monotonic() + seconds if seconds else None
+        for sock in islice(sockets, probes):
+            if deadline and time.monotonic() > deadline:
+                return db_logger.info('rescan time budget spent')
+            yield sock
 
     def load_sockets_txt(self, filepath: str):
         db_logger.info(f'loading sockets from {filepath}')
-        if not filepath.endswith('.txt'):
-            raise Exception(f'Non txt file specified for sockets load!')
-        lines = list(set(read(filepath).split()))
-        sockets = [Socket(host=Host(name=line.split(':')[0]), port=int(line.split(':')[-1])) for line in lines]
-        new_sockets = self.safe_add_all_sockets(sockets)
-        db_logger.info(f'{new_sockets} hosts loaded to database')
-        return sockets
+        from targets import TargetFile
+        targets = TargetFile(filepath, dedup_mb=0).targets()
+        loaded, new_hosts, new_sockets = 0, 0, 0
+        while True:
+            chunk = list(islice(targets, DB_BULK_CHUNK))
+            if not chunk: break
+            hosts_c, sockets_c = self.safe_add_all_sockets(chunk)
+            loaded += len(chunk)
+            new_hosts += hosts_c
+            new_sockets += sockets_c
+            db_logger.info(f'{loaded:_} sockets read, {new_sockets:_} new sockets and {new_hosts:_} new hosts loaded to database')
+        return new_sockets
 
     def load_servers_json(self, filepath: str):
         db_logger.info(f'loading servers from {filepath}')
         if not filepath.endswith('.json'):
             return db_logger.info(f'Non json file specified for servers load!')
         data = load(filepath)
-        servers_from_file: list[MServer] = []
+        servers_from_file: list[ServerRecord] = []
         for record in data:
             if any([key not in ['connect', 'connection', 'max_players', 'version', 'description'] for key in record]): continue
             socket_key = 'connect' if 'connect' in record else 'connection'
             socket_rec = record[socket_key].split(':')
-            socket = Socket(host=Host(name=socket_rec[0]), port=int(socket_rec[1]), status=self.MINECRAFT_SERVER_STATUS)
-            server = MServer(
+            socket = socket_record(socket_rec[0], int(socket_rec[1]))
+            socket.status = self.MINECRAFT_SERVER_STATUS
+            server = ServerRecord(
                 socket=socket,
-                version=record['version'],
-                description=record['description'],
+                version=str(record['version']),
+                description=str(record['description']),
                 max_players=int(record['max_players'])
             )
             servers_from_file.append(server)
@@ -232,76 +500,256 @@ class DBController(DBBaseController):
         db_logger.info(f'{new_servers} servers loaded to database')
 
     def load_ngrok_sockets(self):
-        db_logger.info('loading ngrok host:port to database. this may take some time...')
-        sockets = [Socket(host=Host(name=f'{i}.tcp.eu.ngrok.io'), port=p) for i in range(10) for p in range(1, 65536)]
-        new_hosts, new_sockets = self.safe_add_all_sockets(sockets, notify=True)
-        if new_hosts > 0: db_logger.info(f'{new_hosts} hosts added')
-        if new_sockets > 0: db_logger.info(f'{new_sockets} sockets added')
-        db_logger.info('ngrok host:port loaded to database')
+        db_logger.info('loading ngrok host:port to database...')
+        start = time.time()
+        new_states = self.track_hosts(NGROK_HOSTS)
+        elapsed = time.time() - start
+        if new_states > 0: db_logger.info(f'{new_states} hosts added to scan state')
+        total = len(NGROK_HOSTS) * NGROK_PORTS
+        db_logger.info(f'ngrok host:port loaded to database: {total:_} sockets tracked in {elapsed:.2f} seconds')
+
+    def merge_db(self, filepath: str):
+        db_logger.info(f'merging {filepath} into database')
+        if not os.path.exists(filepath):
+            raise Exception(f'No database file {filepath} to merge!')
+        self._conn.commit()
+        with self._conn.get_bind().connect() as conn:
+            conn.execute(text('ATTACH DATABASE :path AS shard'), {'path': filepath})
+            for statement in MERGE_STATEMENTS:
+                conn.execute(text(statement))
+            conn.commit()
+            shard_statuses = dict(conn.execute(text('SELECT id, name FROM shard.statuses')).all())
+            shard_states = []
+            if conn.execute(text("SELECT 1 FROM shard.sqlite_master WHERE type = 'table' AND name = 'scan_states'")).first():
+                shard_states = conn.execute(text('SELECT h.name, s.ports FROM shard.scan_states s JOIN shard.hosts h ON h.id = s.hostId')).all()
+            shard_failures = {}
+            if conn.execute(text("SELECT 1 FROM shard.sqlite_master WHERE type = 'table' AND name = 'failure_times'")).first():
+                shard_failures = dict(conn.execute(text('SELECT h.name, f.times FROM shard.failure_times f JOIN shard.hosts h ON h.id = f.hostId')).all())
+            if conn.execute(text("SELECT 1 FROM shard.sqlite_master WHERE type = 'table' AND name = 'enrichments'")).first():
+                for statement in MERGE_ENRICHMENT_STATEMENTS:
+                    conn.execute(text(statement))
+                conn.commit()
+            conn.execute(text('DETACH DATABASE shard'))
+        self.merge_scan_states(shard_statuses, shard_states, shard_failures)
+        db_logger.info(f'{filepath} merged into database')
+
+    def merge_scan_states(self, shard_statuses: dict[int, str], shard_states: list[tuple[str, bytes]], shard_failures: dict[str, bytes] = {}):
+        statuses = [status_record(name) for name in shard_statuses.values()]
+        self.safe_add_all_statuses(statuses)
+        status_map = { shard_id: status.id for shard_id, status in zip(shard_statuses, statuses) }
+        self.track_hosts([name for name, _ in shard_states])
+        states = self.get_scan_states()
+        for name, blob in shard_states:
+            state = states.get(name)
+            if not state: continue
+            times = decode_times(shard_failures[name]) if name in shard_failures else None
+            for port, status_id in enumerate(decode_ports(blob)):
+                if port and status_id and not state.status(port):
+                    state.mark(port, status_map[status_id], times[port] if times and times[port] else None)
+        for state in states.hosts.values():
+            self.fold_sockets_into_state(state)
+        self.save_scan_states(states)
+        self._conn.commit()
 
 class DBPool(DBBaseController):
-    def __init__(self, output_path: str = ''):
+    def __init__(self, output_paths: list[str] = [], journal_path: str = '', enricher: typing.Any = None):
         DBBaseController.__init__(self)
-        self._servers_add: list[MServer] = []
-        self._sockets_update: list[Socket] = []
-        self._sockets_add: list[Socket] = []
-        self._stop_loop = False
-        self._output_path = output_path
-        if output_path and not output_path.endswith('.txt'):
-            raise Exception('Non txt file for output specified!')
+        self.sinks = Sinks(output_paths)
+        self.enricher = enricher
+        self._queue: queue.Queue[tuple[int, typing.Any, int]] = queue.Queue(maxsize=DB_POOL_QUEUE_SIZE)
+        self._stop_loop = Event()
+        self._stats_lock = Lock()
+        self.scan_states = ScanStates()
+        self.checkpoints: list[PageCheckpoint] = []
+        self.blocked_for = 0.0
+        self.flushes = 0
+        self.flushed_records = 0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.max_queue_depth = 0
+        POOL_BACKLOG.set_function(self._queue.qsize)
         db_logger.info('pool init')
+        if journal_path:
+            self.replay(segment_paths(journal_path))
+        self.journal = Journal(journal_path) if journal_path else None
 
     def stop(self):
-        self._stop_loop = True
-
-    def add_server(self, server: MServer):
-        with Lock():
-            self._servers_add.append(server)
-            self._sockets_update.append(server.socket)
-
-    def update_socket(self, socket: Socket):
-        with Lock():
-            self._sockets_update.append(socket)
-
-    def add_socket(self, socket: Socket):
-        with Lock():
-            self._sockets_add.append(socket)
+        self._stop_loop.set()
+
+    def close_sinks(self):
+        if self.sinks:
+            db_logger.info(f'{self.sinks.written:_} servers written to {", ".join(s.path for s in self.sinks.sinks)}')
+        self.sinks.close()
+
+    def resume(self):
+        self._stop_loop.clear()
+
+    def flush(self):
+        if self.journal:
+            self.journal.flush()
+        self.sinks.flush()
+
+    def flush_due(self):
+        if self.journal:
+            self.journal.flush_due()
+        self.sinks.flush_due()
+
+    def replay(self, paths: list[str]):
+        for path in paths:
+            records = [(kind, item, -1) for kind, item in read_segment(path)]
+            for chunk in split_by_n(records, DB_POOL_FLUSH_SIZE):
+                if chunk: self.release(chunk)
+            os.remove(path)
+            db_logger.info(f'replayed {len(records):_} journaled records from {path}')
+
+    def _record(self, kind: int, item: typing.Any) -> tuple[int, typing.Any, int]:
+        if kind == SERVER_RECORD and self.sinks:
+            self.sinks.write(item)
+        return (kind, item, self.journal.append(kind, item) if self.journal else -1)
+
+    def _blocked(self, start: float):
+        blocked_for = time.monotonic() - start
+        POOL_BLOCKED.inc(amount=blocked_for)
+        with self._stats_lock:
+            self.blocked_for += blocked_for
+
+    @timed('pool.put')
+    def _put(self, kind: int, item: typing.Any):
+        record = self._record(kind, item)
+        try:
+            return self._queue.put_nowait(record)
+        except queue.Full:
+            start = time.monotonic()
+            self._queue.put(record)
+            self._blocked(start)
+
+    @timed('pool.put')
+    async def _put_a(self, kind: int, item: typing.Any):
+        record = self._record(kind, item)
+        try:
+            return self._queue.put_nowait(record)
+        except queue.Full:
+            start = time.monotonic()
+            await asyncio.get_running_loop().run_in_executor(None, self._queue.put, record)
+            self._blocked(start)
+
+    def add_server(self, server: ServerRecord):
+        self._put(SERVER_RECORD, server)
+
+    def update_socket(self, socket: SocketRecord):
+        self._put(SOCKET_UPDATE_RECORD, socket)
+
+    async def add_server_a(self, server: ServerRecord):
+        await self._put_a(SERVER_RECORD, server)
+
+    async def update_socket_a(self, socket: SocketRecord):
+        await self._put_a(SOCKET_UPDATE_RECORD, socket)
+
+    def add_socket(self, socket: SocketRecord):
+        self._put(SOCKET_ADD_RECORD, socket)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @timed('pool.mark_scan_states')
+    def mark_scan_states(self, sockets: list[SocketRecord]) -> tuple[int, list[SocketRecord]]:
+        self.get_scan_states(self.scan_states)
+        tracked = [s for s in sockets if s.host.name in self.scan_states]
+        if not tracked: return (0, sockets)
+        new_statuses_c = self.safe_add_all_statuses([s.status for s in tracked if s.status])
+        now = int(time.time())
+        for sock in tracked:
+            if sock.status:
+                self.scan_states.hosts[sock.host.name].mark(sock.port, sock.status.id, 0 if sock.status.id == self.MINECRAFT_SERVER_STATUS.id else now)
+        self.save_scan_states(self.scan_states)
+        return (new_statuses_c, [s for s in sockets if s.host.name not in self.scan_states])
+
+    def collect_records(self) -> tuple[list[tuple[int, typing.Any, int]], bool]:
+        records: list[tuple[int, typing.Any, int]] = []
+        deadline = time.monotonic() + DB_POOL_RELEASE_PERIOD
+        while len(records) < DB_POOL_FLUSH_SIZE:
+            self.flush_due()
+            stopping = self._stop_loop.is_set()
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 and not stopping:
+                break
+            try:
+                records.append(self._queue.get(block=not stopping, timeout=min(timeout, 1)))
+            except queue.Empty:
+                if stopping:
+                    return (records, True)
+        return (records, False)
 
     def release_pool_loop(self):
         db_logger.info('started pool loop')
-        while not self._stop_loop:
-            time.sleep(DB_POOL_RELEASE_PERIOD)
-            db_logger.info(f'releasing pool...')
-
-            with Lock():
-                servers_add = [*self._servers_add]
-                self._servers_add = []
-                sockets_upd = [*self._sockets_update]
-                self._sockets_update = []
-                sockets_add = [*self._sockets_add]
-                self._sockets_add = []                
-
-            new_statuses = 0
-            new_hosts = 0
-            new_servers = 0
-            new_sockets = 0
-            
-            new_statuses_c = self.safe_update_all_sockets(sockets_upd)
-            new_statuses += new_statuses_c
-
-            new_hosts_c, new_sockets_c = self.safe_add_all_sockets(sockets_add)
-            new_hosts += new_hosts_c
-            new_sockets += new_sockets_c
-
-            new_hosts_c, new_sockets_c, new_servers_c = self.safe_add_all_servers(servers_add, self._output_path)
-            new_hosts += new_hosts_c
-            new_sockets += new_sockets_c
-            new_servers += new_servers_c
-
-            db_logger.info(f'pool released')
-            if new_statuses > 0: db_logger.info(f'{new_statuses} statuses added')
-            if len(sockets_upd) > 0: db_logger.info(f'{len(sockets_upd)} sockets updated')
-            if new_sockets > 0: db_logger.info(f'{new_sockets} sockets added')
-            if new_hosts > 0: db_logger.info(f'{new_hosts} hosts added')
-            if new_servers > 0: db_logger.info(f'{new_servers} servers added')
-
+        while True:
+            records, stopping = self.collect_records()
+            self.flush()
+            depth = self._queue.qsize()
+            self.max_queue_depth = max(self.max_queue_depth, depth + len(records))
+            if records or stopping:
+                start = time.monotonic()
+                self.release(records)
+                if self.journal:
+                    self.journal.applied(segment for _, _, segment in records)
+                    self.journal.rotate()
+                latency = time.monotonic() - start
+                self.flushes += 1
+                self.flushed_records += len(records)
+                self.total_flush_latency += latency
+                self.max_flush_latency = max(self.max_flush_latency, latency)
+                FLUSH_LATENCY.observe(latency)
+                POOL_RECORDS.inc(amount=len(records))
+                db_logger.info(f'pool released {len(records):_} records in {latency:.2f} seconds, queue depth {depth:_} / {DB_POOL_QUEUE_SIZE:_}, scanners blocked for {self.blocked_for:.1f} seconds in total')
+            if stopping:
+                break
+        if self.journal:
+            self.journal.close()
+        mean_latency = self.total_flush_latency / self.flushes if self.flushes else 0
+        db_logger.info(f'pool loop stopped: {self.flushed_records:_} records in {self.flushes:_} flushes, flush latency {mean_latency:.2f} seconds mean / {self.max_flush_latency:.2f} max, queue depth peaked at {self.max_queue_depth:_}')
+
+    @timed('pool.release')
+    def release(self, records: list[tuple[int, typing.Any, int]]):
+        servers_add: list[ServerRecord] = []
+        sockets_upd: list[SocketRecord] = []
+        sockets_add: list[SocketRecord] = []
+        for kind, item, _ in records:
+            if kind == SERVER_RECORD:
+                servers_add.append(item)
+                sockets_upd.append(item.socket)
+            elif kind == SOCKET_UPDATE_RECORD:
+                sockets_upd.append(item)
+            else:
+                sockets_add.append(item)
+
+        new_statuses = 0
+        new_hosts = 0
+        new_servers = 0
+        new_sockets = 0
+
+        new_statuses_c, sockets_upd_rows = self.mark_scan_states(sockets_upd)
+        new_statuses += new_statuses_c
+        new_statuses_c = self.safe_update_all_sockets(sockets_upd_rows)
+        new_statuses += new_statuses_c
+        released_ids = [s.id for s in sockets_upd if s.id]
+        for checkpoint in self.checkpoints:
+            checkpoint.done(released_ids)
+            self.save_checkpoint(checkpoint)
+
+        new_hosts_c, new_sockets_c = self.safe_add_all_sockets(sockets_add)
+        new_hosts += new_hosts_c
+        new_sockets += new_sockets_c
+
+        new_hosts_c, new_sockets_c, new_servers_c = self.safe_add_all_servers(servers_add)
+        new_hosts += new_hosts_c
+        new_sockets += new_sockets_c
+        new_servers += new_servers_c
+        if self.enricher and servers_add:
+            self.enricher.submit([(s.socket.host.id, s.socket.host.name, s.socket.port) for s in servers_add])
+
+        if new_statuses > 0: db_logger.info(f'{new_statuses} statuses added')
+        if len(sockets_upd) > 0: db_logger.info(f'{len(sockets_upd)} sockets updated')
+        if new_sockets > 0: db_logger.info(f'{new_sockets} sockets added')
+        if new_hosts > 0: db_logger.info(f'{new_hosts} hosts added')
+        if new_servers > 0: db_logger.info(f'{new_servers} servers added')
@@ -1,8 +1,36 @@
 from sqlalchemy.engine import create_engine
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import scoped_session
-from config import DB_PATH, THREADS
+from ..records import forget_ids
+from .scan_state import host_key
+from config import DB_PATH, THREADS, DB_BUSY_TIMEOUT
 
-engine = create_engine(f"sqlite:///{DB_PATH}", pool_size=THREADS, max_overflow=0)
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+def add_functions(dbapi_connection, connection_record):
+    dbapi_connection.create_function('host_key', 1, host_key, deterministic=True)
+
+def build_engine(db_path: str):
+    engine = create_engine(f"sqlite:///{db_path}", pool_size=THREADS, max_overflow=0, connect_args={'timeout': DB_BUSY_TIMEOUT})
+    event.listen(engine, 'connect', set_pragmas)
+    event.listen(engine, 'connect', add_functions)
+    return engine
+
+engine = build_engine(DB_PATH)
 session_factory  = sessionmaker(bind=engine)
 Session = scoped_session(session_factory)
+
+def db_path() -> str:
+    return str(engine.url.database)
+
+def set_db_path(db_path: str):
+    global engine
+    engine.dispose()
+    engine = build_engine(db_path)
+    session_factory.configure(bind=engine)
+    forget_ids()
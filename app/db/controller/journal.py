@@ -0,0 +1,112 @@
+import glob
+import json
+import os
+import threading
+import time
+import typing
+from config import JOURNAL_BUFFER_SIZE, JOURNAL_FLUSH_PERIOD, db_logger
+from ..records import ServerRecord, SocketRecord, host_record, status_record
+from ..schemas import MINECRAFT_SERVER
+
+SERVER_RECORD, SOCKET_UPDATE_RECORD, SOCKET_ADD_RECORD = range(3)
+JOURNAL_SUFFIX = '.journal'
+
+def encode(kind: int, item: typing.Any) -> bytes:
+    if kind == SERVER_RECORD:
+        row = [kind, item.socket.host.name, item.socket.port, item.version, item.description, item.max_players]
+    elif item.status:
+        row = [kind, item.host.name, item.port, item.status.name]
+    else:
+        row = [kind, item.host.name, item.port]
+    return (json.dumps(row, separators=(',', ':')) + '\n').encode()
+
+def decode(line: bytes) -> tuple[int, typing.Any]:
+    kind, host, port, *rest = json.loads(line)
+    socket = SocketRecord(host_record(host), port)
+    if kind == SERVER_RECORD:
+        socket.status = status_record(MINECRAFT_SERVER)
+        return (kind, ServerRecord(socket, *rest))
+    if rest:
+        socket.status = status_record(rest[0])
+    return (kind, socket)
+
+def read_segment(filepath: str) -> typing.Iterator[tuple[int, typing.Any]]:
+    with open(filepath, 'rb') as f:
+        for n, line in enumerate(f):
+            try:
+                yield decode(line)
+            except (ValueError, TypeError):
+                db_logger.info(f'[warning] {filepath} is cut at line {n + 1:_}, the rest is skipped')
+                return
+
+def segment_paths(path: str) -> list[str]:
+    paths = glob.glob(glob.escape(path) + '.*')
+    return sorted((p for p in paths if p.rsplit('.', 1)[1].isdigit()), key=lambda p: int(p.rsplit('.', 1)[1]))
+
+def journal_paths(db_path: str) -> list[str]:
+    directory, name = os.path.split(db_path)
+    base, dot, extensions = name.partition('.')
+    sharded = glob.glob(os.path.join(glob.escape(directory), f'{glob.escape(base)}.shard*of*{glob.escape(dot + extensions)}{JOURNAL_SUFFIX}.*'))
+    return sorted({*segment_paths(db_path + JOURNAL_SUFFIX), *(p for p in sharded if p.rsplit('.', 1)[1].isdigit())})
+
+class Journal():
+    def __init__(self, path: str):
+        self.path = path
+        self.written = 0
+        self._file: typing.BinaryIO | None = None
+        self._segment = max([int(p.rsplit('.', 1)[1]) for p in segment_paths(path)], default=-1) + 1
+        self._pending: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def segment_path(self, segment: int):
+        return f'{self.path}.{segment}'
+
+    def append(self, kind: int, item: typing.Any) -> int:
+        line = encode(kind, item)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.segment_path(self._segment), 'ab', buffering=JOURNAL_BUFFER_SIZE)
+                self._pending[self._segment] = 0
+            self._file.write(line)
+            self._pending[self._segment] += 1
+            self.written += 1
+            return self._segment
+
+    def _flush(self):
+        if self._file:
+            self._file.flush()
+        self._flushed_at = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def flush_due(self):
+        if time.monotonic() - self._flushed_at >= JOURNAL_FLUSH_PERIOD:
+            self.flush()
+
+    def rotate(self):
+        with self._lock:
+            if self._file is None: return
+            self._file.close()
+            self._file = None
+            self._segment += 1
+            self._drop_applied()
+
+    def applied(self, segments: typing.Iterable[int]):
+        with self._lock:
+            for segment in segments:
+                self._pending[segment] -= 1
+            self._drop_applied()
+
+    def _drop_applied(self):
+        for segment, pending in list(self._pending.items()):
+            if pending or segment == self._segment and self._file: continue
+            os.remove(self.segment_path(segment))
+            del self._pending[segment]
+
+    def close(self):
+        self.rotate()
+        if self._pending:
+            db_logger.info(f'[warning] {sum(self._pending.values()):_} journaled records were not released and will be replayed on next start')
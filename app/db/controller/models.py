@@ -1,7 +1,7 @@
-from sqlalchemy import ForeignKey, Column, Integer, String, UniqueConstraint
+from sqlalchemy import ForeignKey, Column, Integer, Float, String, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from .engine import engine
+from . import engine
 
 Base = declarative_base()
 
@@ -24,7 +24,7 @@ class SocketDB(BaseDB, Base):
 
     hostId = Column(Integer, ForeignKey(HostDB.id), nullable=False)
     port = Column(Integer, nullable=False)
-    statusId = Column(Integer, ForeignKey(StatusDB.id))
+    statusId = Column(Integer, ForeignKey(StatusDB.id), index=True)
 
     host = relationship(HostDB)
     status = relationship(StatusDB)
@@ -41,8 +41,66 @@ class MServerDB(BaseDB, Base):
 
     socket = relationship(SocketDB)
 
+class ScanStateDB(BaseDB, Base):
+    __tablename__ = 'scan_states'
+
+    hostId = Column(ForeignKey(HostDB.id), nullable=False, unique=True)
+    ports = Column(LargeBinary, nullable=False)
+
+    host = relationship(HostDB)
+
+class FailureTimesDB(BaseDB, Base):
+    __tablename__ = 'failure_times'
+
+    hostId = Column(ForeignKey(HostDB.id), nullable=False, unique=True)
+    times = Column(LargeBinary, nullable=False)
+
+    host = relationship(HostDB)
+
+class EnrichmentDB(BaseDB, Base):
+    __tablename__ = 'enrichments'
+
+    socketId = Column(ForeignKey(SocketDB.id), nullable=False, unique=True)
+    online_players = Column(Integer)
+    protocol = Column(Integer)
+    latency_ms = Column(Float)
+    favicon_hash = Column(String)
+    mod_loader = Column(String)
+    enriched_at = Column(Integer, nullable=False)
+
+    socket = relationship(SocketDB)
+
+class PlayerSampleDB(BaseDB, Base):
+    __tablename__ = 'player_samples'
+
+    socketId = Column(ForeignKey(SocketDB.id), nullable=False)
+    uuid = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    seen_at = Column(Integer, nullable=False)
+
+    socket = relationship(SocketDB)
+
+    __table_args__ = (UniqueConstraint('socketId', 'uuid', name='_socket_uuid_uc'), )
+
+class ServerModDB(BaseDB, Base):
+    __tablename__ = 'server_mods'
+
+    socketId = Column(ForeignKey(SocketDB.id), nullable=False)
+    mod_id = Column(String, nullable=False)
+    version = Column(String, nullable=False)
+
+    socket = relationship(SocketDB)
+
+    __table_args__ = (UniqueConstraint('socketId', 'mod_id', name='_socket_mod_uc'), )
+
+class CheckpointDB(BaseDB, Base):
+    __tablename__ = 'scan_checkpoints'
+
+    name = Column(String, nullable=False, unique=True)
+    lastId = Column(Integer, nullable=False)
+
 def create_all():
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(engine.engine)
 
 def drop_all():
-    Base.metadata.drop_all(engine)
+    Base.metadata.drop_all(engine.engine)
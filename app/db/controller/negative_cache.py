@@ -0,0 +1,68 @@
+import typing
+from .scan_state import PORTS
+from ..records import SocketRecord
+from ..schemas import CONNECTION_REFUSED, TIMEOUT, CONNECTION_RESET, UNREACHABLE, DNS_FAILURE, PROTOCOL_ERROR, OS_ERROR
+from config import NEGATIVE_TTLS, db_logger
+from utils import parse_duration, LazyIterable
+
+NEGATIVE_TTL_STATUSES: dict[str, str] = {
+    'refused': CONNECTION_REFUSED,
+    'timeout': TIMEOUT,
+    'reset': CONNECTION_RESET,
+    'unreachable': UNREACHABLE,
+    'dns': DNS_FAILURE,
+    'protocol': PROTOCOL_ERROR,
+    'os': OS_ERROR,
+}
+
+def parse_ttls(spec: str | None) -> dict[str, float]:
+    ttls = {key: float(ttl) for key, ttl in NEGATIVE_TTLS.items()}
+    for part in (spec or '').split(','):
+        if not part: continue
+        key, eq, value = part.rpartition('=')
+        if not eq:
+            ttls = {key: parse_duration(value) for key in ttls}
+            continue
+        if key not in NEGATIVE_TTL_STATUSES:
+            raise ValueError(f'Unknown status {key} in negative ttl {spec}, expected one of {", ".join(NEGATIVE_TTL_STATUSES)}')
+        ttls[key] = parse_duration(value)
+    return {NEGATIVE_TTL_STATUSES[key]: ttl for key, ttl in ttls.items() if ttl > 0}
+
+class NegativeCache():
+    def __init__(self, tracked: typing.Iterable[str] = ()):
+        self.hosts: dict[str, bytearray] = {}
+        self.tracked = set(tracked)
+
+    def __len__(self):
+        return sum(skip.count(1) for skip in self.hosts.values())
+
+    def add(self, name: str, skip: bytearray):
+        self.hosts[name] = skip
+
+    def fresh(self, host: str, port: int) -> bool:
+        skip = self.hosts.get(host)
+        return skip is not None and skip[port] == 1
+
+    def count(self, host: str, ports: range) -> int:
+        skip = self.hosts.get(host)
+        if skip is None: return 0
+        return skip[ports.start:ports.stop:ports.step].count(1)
+
+    def skip_fresh(self, sockets: typing.Iterable[SocketRecord], total: LazyIterable | None = None) -> typing.Iterator[SocketRecord]:
+        hosts, tracked = self.hosts, self.tracked
+        skipped, untracked = 0, 0
+        for sock in sockets:
+            skip = hosts.get(sock.host.name)
+            if skip is None or not skip[sock.port]:
+                if sock.host.name not in tracked:
+                    if not untracked:
+                        db_logger.info(f'[warning] {sock.host.name} is not tracked, failures are only remembered for tracked hosts, so its sockets are never skipped')
+                    untracked += 1
+                yield sock
+                continue
+            skipped += 1
+            if total is not None: total.length -= 1
+        db_logger.info(f'negative cache: {skipped:_} recently failed sockets skipped' + (f', {untracked:_} sockets of untracked hosts could not be checked' if untracked else ''))
+
+def skip_map() -> bytearray:
+    return bytearray(PORTS)
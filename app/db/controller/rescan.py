@@ -0,0 +1,44 @@
+import typing
+from bisect import bisect_left
+from .scan_state import HostState, PORTS, shard_ports
+from ..records import SocketRecord, host_record
+from .negative_cache import NegativeCache
+from config import RESCAN_BUCKET_SIZE, RESCAN_PRIOR_WEIGHT
+
+class Bucket():
+    def __init__(self, state: HostState, start: int, end: int, hits: int):
+        self.state = state
+        self.start = start
+        self.end = end
+        self.hits = hits
+        self.scanned = end - start - state.ports[start:end].count(0)
+        self.score = 0.0
+
+    def ports(self) -> range:
+        return range(self.start, self.end)
+
+    def shard_ports(self, shard: tuple[int, int] = (0, 1)) -> range:
+        return shard_ports(self.state.key, self.ports(), shard)
+
+def rank_buckets(states: typing.Iterable[HostState], hits: dict[int, list[int]], bucket_size: int = RESCAN_BUCKET_SIZE, prior_weight: float = RESCAN_PRIOR_WEIGHT) -> list[Bucket]:
+    buckets: list[Bucket] = []
+    for state in states:
+        host_hits = hits.get(state.host_id, [])
+        for start in range(1, PORTS, bucket_size): # port 0 is never scanned
+            end = min(start + bucket_size, PORTS)
+            buckets.append(Bucket(state, start, end, bisect_left(host_hits, end) - bisect_left(host_hits, start)))
+    total_hits = sum(b.hits for b in buckets)
+    total_scanned = sum(b.scanned for b in buckets)
+    hit_rate = total_hits / total_scanned if total_scanned else 0
+    for bucket in buckets:
+        bucket.score = (bucket.hits + prior_weight * hit_rate) / (bucket.scanned + prior_weight)
+    buckets.sort(key=lambda b: (-b.score, b.start))
+    return buckets
+
+def bucket_sockets(buckets: list[Bucket], skip: set[tuple[int, int]], shard: tuple[int, int] = (0, 1), negative: NegativeCache | None = None) -> typing.Iterator[SocketRecord]:
+    for bucket in buckets:
+        host_id = bucket.state.host_id
+        host = host_record(bucket.state.name, host_id)
+        for port in bucket.shard_ports(shard):
+            if (host_id, port) not in skip and not (negative and negative.fresh(host.name, port)):
+                yield SocketRecord(host, port)
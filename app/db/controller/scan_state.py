@@ -0,0 +1,96 @@
+from array import array
+import sys
+import typing
+import zlib
+
+PORTS = 65_536
+RESERVED = 0xFFFF # port 0 is never scanned
+
+def host_key(name: str) -> int:
+    return zlib.crc32(name.encode()) # the same in every database, unlike host ids
+
+def in_shard(key: int, port: int, shard: tuple[int, int]) -> bool:
+    k, n = shard
+    return (key * PORTS + port) % n == k
+
+def shard_ports(key: int, ports: range, shard: tuple[int, int]) -> range:
+    k, n = shard
+    return range(ports.start + (k - key * PORTS - ports.start) % n, ports.stop, n)
+
+def encode_ports(ports: array) -> bytes:
+    if sys.byteorder == 'big':
+        ports = array(ports.typecode, ports)
+        ports.byteswap()
+    return ports.tobytes()
+
+def decode_ports(blob: bytes, typecode: str = 'H') -> array:
+    ports = array(typecode)
+    ports.frombytes(blob)
+    if sys.byteorder == 'big':
+        ports.byteswap()
+    return ports
+
+def decode_times(blob: bytes) -> array:
+    return decode_ports(blob, 'I')
+
+def empty_times() -> array:
+    return array('I', bytes(4 * PORTS))
+
+def empty_ports() -> array:
+    ports = array('H', bytes(2 * PORTS))
+    ports[0] = RESERVED
+    return ports
+
+class HostState():
+    def __init__(self, host_id: int, name: str, ports: array | None = None):
+        self.host_id = host_id
+        self.name = name
+        self.key = host_key(name)
+        self.ports = ports if ports is not None else empty_ports()
+        self.changes: dict[int, int] = {}
+        self.failure_changes: dict[int, int] = {}
+
+    def mark(self, port: int, status_id: int, failed_at: int | None = None):
+        self.ports[port] = status_id
+        self.changes[port] = status_id
+        if failed_at is not None:
+            self.failure_changes[port] = failed_at
+
+    def evict(self, port: int):
+        self.failure_changes[port] = 0
+
+    def status(self, port: int) -> int:
+        return self.ports[port]
+
+    def unscanned_count(self) -> int:
+        return self.ports.count(0)
+
+    def unscanned(self) -> typing.Iterator[int]:
+        ports = self.ports
+        return (p for p in range(1, PORTS) if not ports[p])
+
+    def apply_to(self, ports: array) -> array:
+        for port, status_id in self.changes.items():
+            ports[port] = status_id
+        return ports
+
+    def apply_failures_to(self, times: array) -> array:
+        for port, failed_at in self.failure_changes.items():
+            times[port] = failed_at
+        return times
+
+class ScanStates():
+    def __init__(self):
+        self.hosts: dict[str, HostState] = {}
+
+    def __contains__(self, name: str):
+        return name in self.hosts
+
+    def get(self, name: str) -> HostState | None:
+        return self.hosts.get(name)
+
+    def add(self, state: HostState):
+        self.hosts[state.name] = state
+
+    def dirty(self) -> list[HostState]:
+        return [state for state in self.hosts.values() if state.changes or state.failure_changes]
@@ -0,0 +1,78 @@
+import threading
+
+class HostRecord():
+    __slots__ = ('id', 'name')
+
+    def __init__(self, name: str, id: int = 0):
+        self.id = id
+        self.name = name
+
+class StatusRecord():
+    __slots__ = ('id', 'name')
+
+    def __init__(self, name: str, id: int = 0):
+        self.id = id
+        self.name = name
+
+class SocketRecord():
+    __slots__ = ('id', 'host', 'port', 'status')
+
+    def __init__(self, host: HostRecord, port: int, id: int = 0, status: StatusRecord | None = None):
+        self.id = id
+        self.host = host
+        self.port = port
+        self.status = status
+
+class ServerRecord():
+    __slots__ = ('socket', 'version', 'description', 'max_players')
+
+    def __init__(self, socket: SocketRecord, version: str, description: str, max_players: int):
+        self.socket = socket
+        self.version = version
+        self.description = description
+        self.max_players = max_players
+
+class EnrichmentRecord():
+    __slots__ = ('host_id', 'port', 'online_players', 'protocol', 'latency', 'favicon_hash', 'mod_loader', 'players', 'mods', 'enriched_at')
+
+    def __init__(self, host_id: int, port: int, online_players: int | None, protocol: int | None, latency: float | None, favicon_hash: str | None, mod_loader: str | None, players: list[tuple[str, str]], mods: list[tuple[str, str]], enriched_at: int):
+        self.host_id = host_id
+        self.port = port
+        self.online_players = online_players
+        self.protocol = protocol
+        self.latency = latency
+        self.favicon_hash = favicon_hash
+        self.mod_loader = mod_loader
+        self.players = players
+        self.mods = mods
+        self.enriched_at = enriched_at
+
+_hosts: dict[str, HostRecord] = {}
+_statuses: dict[str, StatusRecord] = {}
+_lock = threading.Lock()
+
+def host_record(name: str, id: int = 0) -> HostRecord:
+    host = _hosts.get(name)
+    if host is None:
+        with _lock:
+            host = _hosts.setdefault(name, HostRecord(name))
+    if id and not host.id:
+        host.id = id
+    return host
+
+def status_record(name: str) -> StatusRecord:
+    status = _statuses.get(name)
+    if status is None:
+        with _lock:
+            status = _statuses.setdefault(name, StatusRecord(name))
+    return status
+
+def socket_record(host: str, port: int, id: int = 0, host_id: int = 0) -> SocketRecord:
+    return SocketRecord(host_record(host, host_id), port, id)
+
+def forget_ids():
+    with _lock:
+        for host in _hosts.values():
+            host.id = 0
+        for status in _statuses.values():
+            status.id = 0
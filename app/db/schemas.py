@@ -10,6 +10,26 @@ import json
 
 DBT = TypeVar('DBT')
 
+MINECRAFT_SERVER = 'Minecraft Server'
+CONNECTION_REFUSED = 'Connection Refused'
+TIMEOUT = 'Timeout'
+CONNECTION_RESET = 'Connection Reset'
+UNREACHABLE = 'Unreachable'
+DNS_FAILURE = 'DNS Failure'
+PROTOCOL_ERROR = 'Protocol Error'
+OS_ERROR = 'OS Error'
+
+STATUS_DESCRIPTIONS: dict[str, str] = {
+    MINECRAFT_SERVER: 'answered the server list ping',
+    CONNECTION_REFUSED: 'tcp connection was refused',
+    TIMEOUT: 'no response before the timeout',
+    CONNECTION_RESET: 'connection was reset, aborted or closed by the peer',
+    UNREACHABLE: 'host or network is unreachable',
+    DNS_FAILURE: 'host name could not be resolved',
+    PROTOCOL_ERROR: 'connected but the response was not a valid status response',
+    OS_ERROR: 'other socket error',
+}
+
 class Base(BaseModel, Generic[DBT]):
     id: int = 0
    
@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from config import ENRICH_CONCURRENCY, ENRICH_QUEUE_SIZE, ENRICH_TIMEOUT, ENRICH_FLUSH_SIZE, ENRICH_FLUSH_PERIOD, enrich_logger
+from db.controller import DBBaseController
+from db.records import EnrichmentRecord
+from metrics import ENRICHMENTS
+from resolver import DNS_CACHE
+from slp import query_full_status_a
+
+def favicon_hash(favicon: typing.Any) -> str | None:
+    if not isinstance(favicon, str) or ',' not in favicon:
+        return None
+    try:
+        data = base64.b64decode(favicon.partition(',')[2])
+    except (binascii.Error, ValueError):
+        return None
+    return hashlib.sha256(data).hexdigest() if data else None
+
+def mod_info(raw: dict[str, typing.Any]) -> tuple[str | None, list[tuple[str, str]]]:
+    forge = raw.get('forgeData')
+    if isinstance(forge, dict):
+        return 'forge', [(str(m.get('modId', '')), str(m.get('modmarker', ''))) for m in forge.get('mods') or [] if isinstance(m, dict)]
+    modinfo = raw.get('modinfo')
+    if isinstance(modinfo, dict):
+        return str(modinfo.get('type', 'FML')).lower(), [(str(m.get('modid', '')), str(m.get('version', ''))) for m in modinfo.get('modList') or [] if isinstance(m, dict)]
+    if raw.get('isModded'):
+        return 'modded', []
+    return None, []
+
+def optional_int(value: typing.Any) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def enrichment_record(host_id: int, port: int, raw: typing.Any, latency: float | None) -> EnrichmentRecord:
+    if not isinstance(raw, dict):
+        raise OSError('Received invalid status response')
+    players = raw.get('players') if isinstance(raw.get('players'), dict) else {}
+    version = raw.get('version') if isinstance(raw.get('version'), dict) else {}
+    sample = [(str(p.get('name', '')), str(p['id'])) for p in players.get('sample') or [] if isinstance(p, dict) and p.get('id')]
+    mod_loader, mods = mod_info(raw)
+    return EnrichmentRecord(host_id, port, optional_int(players.get('online')), optional_int(version.get('protocol')), latency, favicon_hash(raw.get('favicon')), mod_loader, sample, mods, int(time.time()))
+
+class Enricher():
+    def __init__(self, concurrency: int = ENRICH_CONCURRENCY, timeout: float = ENRICH_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.enriched = 0
+        self.failed = 0
+        self.dropped = 0
+        self._pending = 0
+        self._room = threading.Condition()
+        self._results: list[EnrichmentRecord] = []
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='enrich-db')
+        self._db = self._writer.submit(DBBaseController).result()
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='enricher')
+        self._thread.start()
+        self._ready.wait()
+        enrich_logger.info(f'found servers will be queried again for players, mods, latency and favicon with {concurrency} in flight')
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue: asyncio.Queue[tuple[int, str, int]] = asyncio.Queue()
+        self._tasks = [self._loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._tasks.append(self._loop.create_task(self._flush_periodically()))
+        self._ready.set()
+        self._loop.run_forever()
+
+    def submit(self, targets: list[tuple[int, str, int]], wait: bool = False):
+        accepted: list[tuple[int, str, int]] = []
+        with self._room:
+            for target in targets:
+                if self._pending >= ENRICH_QUEUE_SIZE:
+                    if not wait:
+                        self.dropped += 1
+                        ENRICHMENTS.inc('dropped')
+                        continue
+                    self._loop.call_soon_threadsafe(self._enqueue, accepted)
+                    accepted = []
+                    self._room.wait_for(lambda: self._pending < ENRICH_QUEUE_SIZE)
+                self._pending += 1
+                accepted.append(target)
+        if accepted:
+            self._loop.call_soon_threadsafe(self._enqueue, accepted)
+
+    def _enqueue(self, targets: list[tuple[int, str, int]]):
+        for target in targets:
+            self._queue.put_nowait(target)
+
+    async def _worker(self):
+        while True:
+            host_id, host, port = await self._queue.get()
+            try:
+                ip = await DNS_CACHE.ip_a(host)
+                raw, latency = await query_full_status_a(ip, host, port, self.timeout)
+                self._results.append(enrichment_record(host_id, port, raw, latency))
+                self.enriched += 1
+                ENRICHMENTS.inc('ok')
+            except (OSError, asyncio.TimeoutError):
+                self.failed += 1
+                ENRICHMENTS.inc('failed')
+            except Exception as ex:
+                enrich_logger.exception(f'unexpected {ex.__class__.__name__} while enriching {host}:{port}')
+                self.failed += 1
+                ENRICHMENTS.inc('failed')
+            finally:
+                self._queue.task_done()
+                with self._room:
+                    self._pending -= 1
+                    self._room.notify()
+            if len(self._results) >= ENRICH_FLUSH_SIZE:
+                self._flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(ENRICH_FLUSH_PERIOD)
+            self._flush()
+
+    def _flush(self):
+        if not self._results: return
+        results, self._results = self._results, []
+        self._writer.submit(self._db.save_enrichments, results).add_done_callback(self._check_write)
+
+    def _check_write(self, future):
+        if future.exception():
+            enrich_logger.error(f'failed to save enrichments: {future.exception()}')
+
+    async def _drain(self):
+        await self._queue.join()
+        [task.cancel() for task in self._tasks]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._flush()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._writer.shutdown(wait=True)
+        enrich_logger.info(f'enriched {self.enriched:_} servers, {self.failed:_} failed to answer again' + (f', {self.dropped:_} dropped on a full queue' if self.dropped else ''))
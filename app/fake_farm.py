@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import random
+import typing
+from config import FARM_HOST, benchmark_logger
+from utils import raise_open_files_limit
+
+SERVER, DROP, SLOW, GARBAGE, REFUSED = 'server', 'drop', 'slow', 'garbage', 'refused'
+
+class FarmConfig():
+    def __init__(
+            self,
+            ports: int,
+            first_port: int,
+            servers: float,
+            drop: float,
+            slow: float,
+            garbage: float,
+            latency: float,
+            slow_latency: float,
+            seed: int,
+        ):
+        self.ports = ports
+        self.first_port = first_port
+        self.servers = servers
+        self.drop = drop
+        self.slow = slow
+        self.garbage = garbage
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.seed = seed
+        if servers + drop + slow + garbage > 1:
+            raise ValueError('Shares of servers, dropping, slow and garbage ports add up to more than 1')
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def layout(self) -> dict[int, str]:
+        rnd = random.Random(self.seed)
+        kinds: list[str] = []
+        for kind, share in ((SERVER, self.servers), (DROP, self.drop), (SLOW, self.slow), (GARBAGE, self.garbage)):
+            kinds += [kind] * round(share * self.ports)
+        kinds += [REFUSED] * (self.ports - len(kinds))
+        rnd.shuffle(kinds)
+        return {self.first_port + i: kind for i, kind in enumerate(kinds)}
+
+def varint(n: int):
+    out = b''
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n:
+            out += bytes([b | 0x80])
+        else:
+            return out + bytes([b])
+
+async def read_varint(reader: asyncio.StreamReader):
+    n = 0
+    for i in range(5):
+        b = (await reader.readexactly(1))[0]
+        n |= (b & 0x7f) << (7 * i)
+        if not b & 0x80:
+            return n
+    raise ValueError('varint too long')
+
+async def read_packet(reader: asyncio.StreamReader):
+    return await reader.readexactly(await read_varint(reader))
+
+def status_packet(port: int):
+    body = json.dumps({
+        'version': {'name': '1.20.1', 'protocol': 763},
+        'players': {'max': 20, 'online': port % 20},
+        'description': {'text': f'§afake server {port}'},
+    }).encode()
+    packet = b'\x00' + varint(len(body)) + body
+    return varint(len(packet)) + packet
+
+class Farm():
+    def __init__(self, config: FarmConfig):
+        self.config = config
+        self.layout = config.layout()
+        self.rnd = random.Random(config.seed)
+
+    def delay(self, latency: float):
+        return latency * self.rnd.uniform(0.5, 1.5)
+
+    async def handle(self, kind: str, port: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            if kind == DROP:
+                await reader.read() # hold the connection until the scanner gives up
+                return
+            await read_packet(reader) # handshake
+            await read_packet(reader) # status request
+            if kind == GARBAGE:
+                writer.write(os.urandom(self.rnd.randint(1, 64)))
+                await writer.drain()
+                return
+            await asyncio.sleep(self.delay(self.config.slow_latency if kind == SLOW else self.config.latency))
+            writer.write(status_packet(port))
+            await writer.drain()
+            ping = await read_packet(reader)
+            writer.write(varint(len(ping)) + ping)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, started: typing.Any = None):
+        for port, kind in self.layout.items():
+            if kind == REFUSED: continue
+            await asyncio.start_server(lambda r, w, kind=kind, port=port: self.handle(kind, port, r, w), FARM_HOST, port, backlog=1024)
+        if started is not None:
+            started.set()
+        await asyncio.Event().wait()
+
+def run_farm(config: FarmConfig, started: typing.Any = None):
+    raise_open_files_limit(config.ports * 2 + 1024)
+    farm = Farm(config)
+    counts = {kind: list(farm.layout.values()).count(kind) for kind in (SERVER, DROP, SLOW, GARBAGE, REFUSED)}
+    benchmark_logger.info(f'fake farm on {FARM_HOST}:{config.first_port}-{config.first_port + config.ports - 1}: {counts}')
+    asyncio.run(farm.serve(started))
@@ -1,32 +1,135 @@
 import config
-from config import THREADS, SOCKET_RESPONSE_TIMEOUT, main_logger, DB_POOL_RELEASE_PERIOD
-from utils import measure_execution_time
-from mine_scanner import  check_target_sockets_t, check_ngrok_sockets_t
-from db.controller import DBController, DBPool
+from config import THREADS, SOCKET_RESPONSE_TIMEOUT, main_logger, ASYNC_CONCURRENCY, ENGINE, DB_PATH, NGROK_HOSTS, METRICS_JSON_PERIOD, SLP_CLIENT, SLP_CLIENTS, HOST_RATE, HOST_BURST, NEGATIVE_TTLS, PROFILE_NAME, PROFILE_INTERVAL, TARGETS_DEDUP_MB, ENRICH_CONCURRENCY
+from utils import measure_execution_time, parse_shard, parse_budget, shard_path, LazyIterable
+from mine_scanner import ENGINES, set_slp_client, set_port_seed, ngrok_sockets
+from rate_limit import HOST_LIMITER
+from tcp_prefilter import prefiltered
+from metrics import INFO, serve_metrics, JsonLinesWriter
+from profiling import Profile
+from enrichment import Enricher
+from sinks import check_output_path
+from targets import file_sockets, check_target_path
+from db.controller import DBController, DBPool, set_db_path, db_path
+from db.controller.journal import journal_paths, JOURNAL_SUFFIX
+from db.controller.negative_cache import parse_ttls
+import multiprocessing
 import argparse
 import sys
 
 @measure_execution_time
-def main(threads: int, load_from: str, timeout: int, gen_sockets: bool, output: str, pre_load_sockets: bool, db_sockets: bool):
+def main(threads: int, load_from: str, timeout: int, gen_sockets: bool, output: list[str], pre_load_sockets: bool, db_sockets: bool, engine: str = ENGINE, concurrency: int = ASYNC_CONCURRENCY, prefilter: bool = False, shard: tuple[int, int] = (0, 1), adaptive: bool = False, rescan: bool = False, budget: tuple[int | None, float | None] = (None, None), metrics_port: int = 0, metrics_json: str = '', slp_client: str = SLP_CLIENT, port_seed: int | None = None, host_rate: float = HOST_RATE, host_burst: float = HOST_BURST, negative_ttls: dict[str, float] = {}, profile: str = '', profile_interval: float = 0, journal: bool = True, dedup_mb: float = TARGETS_DEDUP_MB, enrich: bool = False, enrich_concurrency: int = ENRICH_CONCURRENCY):
+    profiler = Profile(shard_path(profile, shard) if shard[1] > 1 else profile, profile_interval / 1000).start() if profile else None
+    pool: DBPool | None = None
+    try:
+        check_ngrok_sockets, check_target_sockets = ENGINES[engine]
+        set_slp_client(slp_client)
+        set_port_seed(port_seed)
+        HOST_LIMITER.configure(host_rate, host_burst)
+        if prefilter:
+            main_logger.info('only sockets accepting tcp connections will get minecraft status requests')
+            check_ngrok_sockets, check_target_sockets = prefiltered(check_target_sockets)
+        workers = concurrency if engine == 'async' else threads
+        main_logger.info(f'using {engine} scan engine with {slp_client} status client')
+        if adaptive:
+            main_logger.info(f'timeout and concurrency will adapt to observed response times, up to {timeout} seconds and {workers:_} in flight')
+        if host_rate:
+            main_logger.info(f'probes to every host are limited to {host_rate:g} per second with bursts of {host_burst:g}')
+        if port_seed is not None:
+            main_logger.info(f'ports of every host are visited in an order seeded with {port_seed}')
+        if negative_ttls:
+            main_logger.info(f'skipping sockets that failed recently: {", ".join(f"{name} for {ttl:g} seconds" for name, ttl in negative_ttls.items())}')
+        if shard[1] > 1:
+            main_logger.info(f'scanning shard {shard[0]}/{shard[1]}')
+        INFO.set(1, engine, f'{shard[0]}/{shard[1]}')
+        metrics_server = serve_metrics(metrics_port) if metrics_port else None
+        metrics_writer = JsonLinesWriter(metrics_json, engine=engine, shard=f'{shard[0]}/{shard[1]}') if metrics_json else None
+        if metrics_writer:
+            main_logger.info(f'metrics will be appended to {metrics_json} every {metrics_writer.period} seconds')
+            metrics_writer.start()
+        db = DBController()
+        journal_path = db_path() + JOURNAL_SUFFIX if journal else ''
+        enricher = Enricher(enrich_concurrency) if enrich else None
+        pool = DBPool(output_paths=output, journal_path=shard_path(journal_path, shard) if journal and shard[1] > 1 else journal_path, enricher=enricher)
+        if not journal:
+            main_logger.info('results are not journaled, up to a pool release period of them is lost if the scan crashes')
+        if output:
+            main_logger.info(f'found servers will be written to {", ".join(output)} as they are found')
+        if rescan:
+            main_logger.info('rescanning known servers first, then ports of tracked hosts by historical hit rate')
+            if gen_sockets:
+                main_logger.info('ngrok hosts are tracked and their ports are ranked too')
+                db.track_hosts(NGROK_HOSTS)
+            target_sockets = db.get_rescan_sockets(shard, *budget, negative=db.get_negative_cache(negative_ttls) if negative_ttls else None)
+            check_target_sockets(target_sockets, pool, workers, timeout, adaptive)
+        elif pre_load_sockets:
+            db.load_ngrok_sockets()
+            target_sockets = db.get_target_sockets(shard, pool, port_seed)
+            check_target_sockets(target_sockets, pool, workers, timeout, adaptive)
+        elif db_sockets:
+            main_logger.info(f'using host:port from database where status is set to null')
+            target_sockets = db.get_target_sockets(shard, pool, port_seed)
+            check_target_sockets(target_sockets, pool, workers, timeout, adaptive)
+        elif load_from:
+            main_logger.info(f'using host:port from file {load_from}')
+            target_sockets = file_sockets(load_from, shard, dedup_mb, port_seed)
+            if negative_ttls:
+                negative, loaded = db.get_negative_cache(negative_ttls), target_sockets
+                target_sockets = LazyIterable(loaded, lambda: negative.skip_fresh(loaded, loaded))
+            check_target_sockets(target_sockets, pool, workers, timeout, adaptive)
+        elif gen_sockets:
+            main_logger.info(f'using autogenerated ngrok host:port')
+            db.track_hosts(NGROK_HOSTS)
+            if negative_ttls:
+                check_target_sockets(ngrok_sockets(shard, db.get_negative_cache(negative_ttls)), pool, workers, timeout, adaptive)
+            else:
+                check_ngrok_sockets(pool, workers, timeout, shard, adaptive)
+        if enricher:
+            enricher.close()
+        if metrics_writer:
+            metrics_writer.stop()
+        if metrics_server:
+            metrics_server.shutdown()
+    finally:
+        if pool is not None:
+            pool.close_sinks() # compressed files are unreadable without their trailer
+        if profiler:
+            profiler.stop()
+
+@measure_execution_time
+def enrich_known_servers(concurrency: int):
+    servers = DBController().get_unenriched_servers()
+    main_logger.info(f'enriching {len(servers):_} known servers')
+    enricher = Enricher(concurrency)
+    enricher.submit(servers, wait=True)
+    enricher.close()
+
+def run_shard(db_path: str, **kwargs):
+    set_db_path(db_path)
+    main(**kwargs)
+
+def run_workers(workers: int, db_path: str, shard: tuple[int, int] = (0, 1), **kwargs):
     db = DBController()
-    pool = DBPool(output_path=output)
-    if output:
-        main_logger.info(f'found servers will be dumped to {output} every {DB_POOL_RELEASE_PERIOD} seconds')
-    if pre_load_sockets:
+    if kwargs['pre_load_sockets']:
         db.load_ngrok_sockets()
-        target_sockets = db.get_target_sockets()
-        check_target_sockets_t(target_sockets, pool, threads, timeout)
-    elif db_sockets:
-        main_logger.info(f'using host:port from database where status is set to null')
-        target_sockets = db.get_target_sockets()
-        check_target_sockets_t(target_sockets, pool, threads, timeout)
-    elif load_from:
-        target_sockets = db.load_sockets_txt(load_from)
-        main_logger.info(f'using host:port from file {load_from}')
-        check_target_sockets_t(target_sockets, pool, threads, timeout)
-    elif gen_sockets:
-        main_logger.info(f'using autogenerated ngrok host:port')
-        check_ngrok_sockets_t(pool, threads, timeout)
+        kwargs.update(pre_load_sockets=False, db_sockets=True)
+    elif kwargs['gen_sockets']:
+        db.track_hosts(NGROK_HOSTS)
+    del db
+    probes, seconds = kwargs['budget']
+    if probes is not None:
+        kwargs['budget'] = (max(probes // workers, 1), seconds)
+    kwargs['host_rate'] = kwargs['host_rate'] / workers
+    main_logger.info(f'starting {workers} worker processes')
+    ctx = multiprocessing.get_context('spawn')
+    metrics_port = kwargs.pop('metrics_port', 0)
+    output = kwargs.pop('output', [])
+    shards = [(shard[0] + shard[1]*k, shard[1]*workers) for k in range(workers)]
+    processes = [ctx.Process(target=run_shard, args=(db_path, ), kwargs={**kwargs, 'shard': shards[k], 'metrics_port': metrics_port + k if metrics_port else 0, 'output': [shard_path(path, shards[k]) for path in output]}) for k in range(workers)]
+    [p.start() for p in processes]
+    [p.join() for p in processes]
+    failed = [k for k, p in enumerate(processes) if p.exitcode != 0]
+    if failed:
+        main_logger.info(f'[warning] worker processes for shards {failed} exited with errors')
 
 def parser_error(errmsg):
     print("Usage: python " + sys.argv[0] + " [Options] use -h for help")
@@ -41,23 +144,102 @@ def parse_args():
     parser.add_argument('-d', '--db_sockets', help=f'Take host:port from database where status set to null', nargs='?', default=False)
     parser.add_argument('-p', '--pre_load_sockets', help=f'Generate host:port for ngrok.io automatically and load it to db with status is set to null', nargs='?', default=False)
     parser.add_argument('-t', '--threads', help=f'Number of threads to use for scanning (default - {THREADS})', type=int, default=THREADS, required=False)
-    parser.add_argument('-l', '--load', help=f"Load host:port from txt file", type=str, default='', required=False)
-    parser.add_argument('-o', '--output', help=f'Output result to txt file', type=str, default='', required=False)
+    parser.add_argument('-l', '--load', help=f"Scan host:port from txt file as it is read, optionally .gz, with port ranges like host:25565-25575,30000 and cidr blocks like 10.0.0.0/16:25565", type=str, default='', required=False)
+    parser.add_argument('-i', '--import_sockets', help=f"Add host:port from txt files to database with status set to null, same formats as --load", type=str, nargs='+', default=[], required=False)
+    parser.add_argument('-dm', '--dedup_mb', help=f'Memory for skipping duplicate --load targets, 0 turns it off (default - up to {TARGETS_DEDUP_MB} MB)', type=float, default=TARGETS_DEDUP_MB, required=False)
+    parser.add_argument('-o', '--output', help=f'Write found servers to files as they are found: .txt or .jsonl for json lines, .csv, optionally compressed with .gz or .zst', type=str, nargs='+', default=[], required=False)
     parser.add_argument('-tm', '--timeout', help=f'Timeout in seconds for socket response (default - {SOCKET_RESPONSE_TIMEOUT})', type=int, default=SOCKET_RESPONSE_TIMEOUT, required=False)
+    parser.add_argument('-e', '--engine', help=f'Scan engine to use: threads or async (default - {ENGINE})', type=str, choices=list(ENGINES), default=ENGINE, required=False)
+    parser.add_argument('-c', '--concurrency', help=f'Number of sockets in flight for async engine (default - {ASYNC_CONCURRENCY})', type=int, default=ASYNC_CONCURRENCY, required=False)
+    parser.add_argument('-sl', '--slp_client', help=f'Minecraft status client: builtin or mcstatus (default - {SLP_CLIENT})', type=str, choices=SLP_CLIENTS, default=SLP_CLIENT, required=False)
+    parser.add_argument('-hr', '--host_rate', help=f'Limit probes to every target host to this many per second, --workers share the limit (default - no limit)', type=float, default=HOST_RATE, required=False)
+    parser.add_argument('-hb', '--host_burst', help=f'Probes a host may get at once before --host_rate applies (default - {HOST_BURST})', type=float, default=HOST_BURST, required=False)
+    parser.add_argument('-ps', '--port_seed', help=f'Visit the ports of every host in a pseudo-random order seeded with this number instead of ascending', type=int, default=None, required=False)
+    parser.add_argument('-nt', '--negative_ttl', help=f'Skip sockets that failed recently, optionally with ttls per status like refused=6h,timeout=10m or one ttl for all (default ttls - {", ".join(f"{k}={v}s" for k, v in NEGATIVE_TTLS.items())})', nargs='?', default=False)
+    parser.add_argument('-f', '--prefilter', help=f'Check sockets with non-blocking tcp connects first and request minecraft status only from open ones', nargs='?', default=False)
+    parser.add_argument('-a', '--adaptive', help=f'Lower timeout to a high percentile of observed response times and back off concurrency on timeouts and resets, --timeout and --threads/--concurrency become upper bounds', nargs='?', default=False)
+    parser.add_argument('-r', '--rescan', help=f'Probe known servers first, then ports ranked by historical hit rate, then the rest of tracked host:port, with --gen_sockets the ngrok hosts are tracked first', nargs='?', default=False)
+    parser.add_argument('-b', '--budget', help=f'Stop --rescan after a number of probes (50000) or a duration (30s, 10m, 2h)', type=str, default='', required=False)
+    parser.add_argument('-mp', '--metrics_port', help=f'Serve prometheus metrics on localhost at this port, --workers use consecutive ports (default - off)', type=int, default=0, required=False)
+    parser.add_argument('-mj', '--metrics_json', help=f'Append metrics as json lines to this file every {METRICS_JSON_PERIOD} seconds', type=str, default='', required=False)
+    parser.add_argument('-nj', '--no_journal', help=f'Do not append results to DATABASE{JOURNAL_SUFFIX}.N before they are written to the database, leftover journals are replayed on every start', nargs='?', default=False)
+    parser.add_argument('-en', '--enrich', help=f'Query found servers again in the background for player samples, mods, latency and favicon, without a scan mode enrich known servers that were not enriched yet', nargs='?', default=False)
+    parser.add_argument('-ec', '--enrich_concurrency', help=f'Number of enrichment queries in flight (default - {ENRICH_CONCURRENCY})', type=int, default=ENRICH_CONCURRENCY, required=False)
+    parser.add_argument('-pr', '--profile', help=f'Time scan stages and write a report to NAME.txt, --workers and --shard add the shard to NAME (default name - {PROFILE_NAME})', type=str, nargs='?', default=False, metavar='NAME')
+    parser.add_argument('-pi', '--profile_interval', help=f'With --profile also sample stacks of all threads every MS milliseconds and write them to NAME.folded for flamegraphs (default - off, {PROFILE_INTERVAL * 1000:g} ms without a value)', type=float, nargs='?', const=PROFILE_INTERVAL * 1000, default=0, metavar='MS')
+    parser.add_argument('-s', '--shard', help=f'Scan only shard K of N of the target sockets, written as K/N with 0 <= K < N', type=str, default='0/1', required=False)
+    parser.add_argument('-w', '--workers', help=f'Number of local processes to split the scan between (default - 1)', type=int, default=1, required=False)
+    parser.add_argument('-db', '--database', help=f'Sqlite database file to use (default - {DB_PATH})', type=str, default=DB_PATH, required=False)
+    parser.add_argument('-m', '--merge', help=f'Merge hosts, sockets and servers from other database files into --database', type=str, nargs='+', default=[], required=False)
     return parser.parse_args()
 
 def interactive():
     args = parse_args()
     threads: int = args.threads
     load_from: str = args.load
+    import_sockets: list[str] = args.import_sockets
+    dedup_mb: float = args.dedup_mb
     timeout: int = args.timeout
     gen_sockets: bool = True if args.gen_sockets is None else False
     pre_load_sockets: bool = True if args.pre_load_sockets is None else False
     db_sockets: bool = True if args.db_sockets is None else False
-    output: str = args.output
-    if not gen_sockets and not load_from and not pre_load_sockets and not db_sockets:
+    output: list[str] = args.output
+    engine: str = args.engine
+    concurrency: int = args.concurrency
+    slp_client: str = args.slp_client
+    host_rate: float = args.host_rate
+    host_burst: float = args.host_burst
+    port_seed: int | None = args.port_seed
+    prefilter: bool = True if args.prefilter is None else False
+    adaptive: bool = True if args.adaptive is None else False
+    rescan: bool = True if args.rescan is None else False
+    profile: str = '' if args.profile is False else args.profile or PROFILE_NAME
+    profile_interval: float = args.profile_interval
+    journal: bool = False if args.no_journal is None else True
+    enrich: bool = True if args.enrich is None else False
+    enrich_concurrency: int = args.enrich_concurrency
+    try:
+        shard: tuple[int, int] = parse_shard(args.shard)
+        budget: tuple[int | None, float | None] = parse_budget(args.budget)
+        [check_output_path(path) for path in output]
+        [check_target_path(path) for path in [load_from, *import_sockets] if path]
+        if dedup_mb < 0:
+            raise ValueError(f'Invalid dedup memory {dedup_mb:g} MB, expected 0 or more')
+        if enrich_concurrency < 1:
+            raise ValueError(f'Invalid enrichment concurrency {enrich_concurrency}, expected 1 or more')
+        negative_ttls: dict[str, float] = {} if args.negative_ttl is False else parse_ttls(args.negative_ttl)
+        if profile_interval < 0:
+            raise ValueError(f'Invalid profile interval {profile_interval:g}, expected milliseconds above 0')
+        if host_rate < 0 or host_burst < 1:
+            raise ValueError(f'Invalid host rate {host_rate:g} with burst {host_burst:g}, expected a rate of at least 0 and a burst of at least 1')
+    except ValueError as ex:
+        return parser_error(str(ex))
+    workers: int = args.workers
+    metrics_port: int = args.metrics_port
+    metrics_json: str = args.metrics_json
+    database: str = args.database
+    merge: list[str] = args.merge
+    if database != DB_PATH:
+        set_db_path(database)
+    journals = journal_paths(database)
+    if journals:
+        main_logger.info(f'replaying {len(journals)} journals left by an interrupted scan')
+        DBPool().replay(journals)
+    if merge:
+        db = DBController()
+        [db.merge_db(filepath) for filepath in merge]
+    if import_sockets:
+        db = DBController()
+        [db.load_sockets_txt(filepath) for filepath in import_sockets]
+    if not gen_sockets and not load_from and not pre_load_sockets and not db_sockets and not rescan:
+        if enrich:
+            return enrich_known_servers(enrich_concurrency)
+        if merge or import_sockets: return
         return main_logger.info('use python main.py -h to see help')
-    main(threads, load_from, timeout, gen_sockets, output, pre_load_sockets, db_sockets)
+    kwargs = dict(threads=threads, load_from=load_from, timeout=timeout, gen_sockets=gen_sockets, output=output, pre_load_sockets=pre_load_sockets, db_sockets=db_sockets, engine=engine, concurrency=concurrency, prefilter=prefilter, adaptive=adaptive, rescan=rescan, budget=budget, metrics_port=metrics_port, metrics_json=metrics_json, slp_client=slp_client, port_seed=port_seed, host_rate=host_rate, host_burst=host_burst, negative_ttls=negative_ttls, profile=profile, profile_interval=profile_interval, journal=journal, dedup_mb=dedup_mb, enrich=enrich, enrich_concurrency=enrich_concurrency)
+    if workers > 1:
+        return run_workers(workers, database, shard, **kwargs)
+    main(**kwargs, shard=shard)
 
 if __name__ == '__main__':
     interactive()
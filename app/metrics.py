@@ -0,0 +1,231 @@
+import json
+import math
+import threading
+import time
+import typing
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_HOST, METRICS_JSON_PERIOD, LATENCY_BUCKETS, FLUSH_BUCKETS, metrics_logger
+
+def escape_label(value: str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metric():
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def _label_str(self, values: tuple[str, ...]):
+        pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, values)]
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> typing.Iterator[tuple[str, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        for labels, value in values:
+            yield f'{self.name}{self._label_str(labels)}', value
+
+    def snapshot(self) -> typing.Any:
+        with self._lock:
+            if not self.labels:
+                return self._values.get((), 0)
+            return {','.join(labels): value for labels, value in self._values.items()}
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        Metric.__init__(self, name, help, labels)
+        self._function: typing.Callable[[], float] | None = None
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, function: typing.Callable[[], float] | None):
+        self._function = function
+
+    def _refresh(self):
+        if self._function:
+            self.set(self._function())
+
+    def samples(self):
+        self._refresh()
+        return Metric.samples(self)
+
+    def snapshot(self):
+        self._refresh()
+        return Metric.snapshot(self)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+        Metric.__init__(self, name, help)
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def samples(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative = 0
+        for bound, bucket_count in zip([*self.buckets, math.inf], counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == math.inf else f'{bound:g}'
+            yield f'{self.name}_bucket{{le="{le}"}}', cumulative
+        yield f'{self.name}_sum', total
+        yield f'{self.name}_count', count
+
+    def quantile(self, q: float) -> float | None:
+        with self._lock:
+            counts, count = list(self._counts), self._count
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip([*self.buckets, math.inf], counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        return lower
+
+    def snapshot(self):
+        with self._lock:
+            count, total = self._count, self._sum
+        return {'count': count, 'mean': total / count if count else None, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+class Registry():
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels)) #type: ignore
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels)) #type: ignore
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...]) -> Histogram:
+        return self.register(Histogram(name, help, buckets)) #type: ignore
+
+    def render(self):
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {value:g}' for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+REGISTRY = Registry()
+INFO = REGISTRY.gauge('mscan_info', 'Scan engine and shard of this process', ('engine', 'shard'))
+PROBES = REGISTRY.counter('mscan_probes_total', 'Finished probes by resulting status', ('status', ))
+IN_FLIGHT = REGISTRY.gauge('mscan_probes_in_flight', 'Probes currently waiting on the network')
+CONNECT_LATENCY = REGISTRY.histogram('mscan_connect_seconds', 'Time to establish tcp connections', LATENCY_BUCKETS)
+PROBE_LATENCY = REGISTRY.histogram('mscan_probe_seconds', 'Time of whole status probes, failed ones included', LATENCY_BUCKETS)
+STATUS_LATENCY = REGISTRY.histogram('mscan_status_seconds', 'Time from connection to parsed status response', LATENCY_BUCKETS)
+POOL_BACKLOG = REGISTRY.gauge('mscan_pool_backlog', 'Records waiting in the db pool queue')
+POOL_BLOCKED = REGISTRY.counter('mscan_pool_blocked_seconds_total', 'Time scanners spent blocked on a full db pool queue')
+POOL_RECORDS = REGISTRY.counter('mscan_pool_records_total', 'Records written by the db pool')
+LIMITER_WAIT = REGISTRY.counter('mscan_host_limiter_wait_seconds_total', 'Time probes were delayed by the per-host rate limit')
+ENRICHMENTS = REGISTRY.counter('mscan_enrichments_total', 'Found servers queried again for details by result', ('result', ))
+FLUSH_LATENCY = REGISTRY.histogram('mscan_pool_flush_seconds', 'Duration of db pool flushes', FLUSH_BUCKETS)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port: int, host: str = METRICS_HOST):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    metrics_logger.info(f'serving prometheus metrics on http://{host}:{server.server_port}/metrics')
+    return server
+
+class JsonLinesWriter(threading.Thread):
+    def __init__(self, filepath: str, period: float = METRICS_JSON_PERIOD, **fields: typing.Any):
+        threading.Thread.__init__(self, daemon=True)
+        self.filepath = filepath
+        self.period = period
+        self.fields = fields
+        self._stop_writing = threading.Event()
+        self._last = (time.time(), PROBES.total())
+
+    def write_line(self):
+        from db.schemas import MINECRAFT_SERVER # db.controller imports this module
+        now, probes = time.time(), PROBES.total()
+        last_time, last_probes = self._last
+        self._last = (now, probes)
+        found = PROBES.snapshot().get(MINECRAFT_SERVER, 0)
+        line = {
+            'time': round(now, 3),
+            **self.fields,
+            'probes_per_second': round((probes - last_probes) / (now - last_time), 1) if now > last_time else 0,
+            'success_rate': found / probes if probes else 0,
+            **REGISTRY.snapshot(),
+        }
+        with open(self.filepath, 'at') as f:
+            f.write(json.dumps(line) + '\n')
+
+    def run(self):
+        while not self._stop_writing.wait(self.period):
+            self.write_line()
+        self.write_line()
+
+    def stop(self):
+        self._stop_writing.set()
+        self.join()
@@ -1,61 +1,255 @@
 from mcstatus import JavaServer
-from utils import remove_color_codes, kill_proc
+from mcstatus.address import Address
+from mcstatus.protocol.connection import TCPSocketConnection, TCPAsyncSocketConnection
+from mcstatus.status_response import JavaStatusResponse
+from utils import remove_color_codes, kill_proc, interleave, permuted, LazyIterable
 from threads import run_threaded, craft_function
-from config import scanner_logger
-from typing import Callable
+from async_tasks import run_async
+from resolver import DNS_CACHE
+from rate_limit import HOST_LIMITER
+from slp import query_status, query_status_a
+from adaptive import AdaptiveController
+from metrics import PROBES, IN_FLIGHT, PROBE_LATENCY, CONNECT_LATENCY, STATUS_LATENCY
+from profiling import timed, timed_iter, stop_active as stop_profile, enabled as profiling_enabled
+from config import scanner_logger, NGROK_HOSTS, NGROK_PORTS, SLP_CLIENT
+from typing import Callable, Awaitable, Sequence, Any
 from db.controller import DBPool
-from db.schemas import MServer, Status, Socket, Host
+from db.controller.negative_cache import NegativeCache
+from db.controller.scan_state import shard_ports, host_key
+from db.records import HostRecord, ServerRecord, SocketRecord, status_record, host_record
+from db.schemas import MINECRAFT_SERVER, CONNECTION_REFUSED, TIMEOUT, CONNECTION_RESET, UNREACHABLE, DNS_FAILURE, PROTOCOL_ERROR, OS_ERROR
 import socket
+import errno
 import json
+import time
 
 KNOWN_EXCEPTIONS = (OSError, socket.timeout)
+UNREACHABLE_ERRNOS = (errno.ENETUNREACH, errno.EHOSTUNREACH, errno.EHOSTDOWN, errno.ENETDOWN)
 
-def handle_result(scan_function: Callable[[Socket, int], MServer], socket: Socket, timeout: int, pool: DBPool | None = None):
+_port_seed: int | None = None
+
+def set_port_seed(seed: int | None):
+    global _port_seed
+    _port_seed = seed
+
+def ngrok_ports(host: HostRecord, shard: tuple[int, int]):
+    return shard_ports(host_key(host.name), range(1, NGROK_PORTS + 1), shard)
+
+def host_sockets(host: HostRecord, ports: Sequence[int], seed: int | None = None, negative: NegativeCache | None = None):
+    for port in permuted(ports, seed):
+        if negative and negative.fresh(host.name, port): continue
+        yield SocketRecord(host, port)
+
+def ngrok_sockets(shard: tuple[int, int] = (0, 1), negative: NegativeCache | None = None) -> LazyIterable[SocketRecord]:
+    hosts = [(host, ngrok_ports(host, shard)) for host in map(host_record, NGROK_HOSTS)]
+    seed = _port_seed
+    total = sum(len(ports) - (negative.count(host.name, ports) if negative else 0) for host, ports in hosts)
+    return LazyIterable(total, lambda: interleave(host_sockets(host, ports, seed, negative) for host, ports in hosts))
+
+def craft_probes(handler: Callable[..., Any], scan_function: Callable[..., Any], sockets: Sequence[SocketRecord] | LazyIterable[SocketRecord], timeout: int, adaptive: AdaptiveController | None = None):
+    targets = lambda: timed_iter('targets', sockets) if profiling_enabled() else sockets
+    return LazyIterable(sockets, lambda: (craft_function(handler, scan_function, socket, timeout, adaptive=adaptive) for socket in targets()))
+
+def adaptive_controller(adaptive: bool, timeout: int, workers: int, sockets: Sequence[SocketRecord] | LazyIterable[SocketRecord]):
+    if not adaptive:
+        return None
+    controller = AdaptiveController(timeout, min(workers, len(sockets)))
+    scanner_logger.info(f'adaptive mode: {controller}')
+    return controller
+
+class ResolvedJavaServer(JavaServer):
+    def __init__(self, host: str, port: int, ip: str, timeout: float):
+        JavaServer.__init__(self, host, port, timeout=timeout)
+        self.ip_address = Address(ip, port)
+
+    def status(self, **kwargs) -> JavaStatusResponse:
+        start = time.monotonic()
+        with TCPSocketConnection(self.ip_address, self.timeout) as connection:
+            connected = time.monotonic()
+            CONNECT_LATENCY.observe(connected - start)
+            status = self._retry_status(connection, **kwargs)
+            STATUS_LATENCY.observe(time.monotonic() - connected)
+            return status
+
+    async def async_status(self, **kwargs) -> JavaStatusResponse:
+        start = time.monotonic()
+        async with TCPAsyncSocketConnection(self.ip_address, self.timeout) as connection:
+            connected = time.monotonic()
+            CONNECT_LATENCY.observe(connected - start)
+            status = await self._retry_async_status(connection, tries=1, **kwargs) # a retry reuses the closed connection and asyncio logs every write to it
+            STATUS_LATENCY.observe(time.monotonic() - connected)
+            return status
+
+def status_category(ex: BaseException):
+    if isinstance(ex, TimeoutError):
+        return TIMEOUT
+    if isinstance(ex, ConnectionRefusedError):
+        return CONNECTION_REFUSED
+    if isinstance(ex, (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)):
+        return CONNECTION_RESET
+    if isinstance(ex, (socket.gaierror, socket.herror)):
+        return DNS_FAILURE
+    if isinstance(ex, OSError) and ex.errno in UNREACHABLE_ERRNOS:
+        return UNREACHABLE
+    if isinstance(ex, OSError) and not ex.errno:
+        return PROTOCOL_ERROR
+    return OS_ERROR
+
+def on_server(server: ServerRecord, socket: SocketRecord, pool: DBPool):
+    socket.status = pool.MINECRAFT_SERVER_STATUS
+    PROBES.inc(MINECRAFT_SERVER)
+    pool.add_server(server)
+    return server
+
+async def on_server_a(server: ServerRecord, socket: SocketRecord, pool: DBPool):
+    socket.status = pool.MINECRAFT_SERVER_STATUS
+    PROBES.inc(MINECRAFT_SERVER)
+    await pool.add_server_a(server)
+    return server
+
+def on_known_exception(ex: BaseException, socket: SocketRecord, pool: DBPool):
+    socket.status = status_record(status_category(ex))
+    PROBES.inc(socket.status.name)
+    pool.update_socket(socket)
+
+async def on_known_exception_a(ex: BaseException, socket: SocketRecord, pool: DBPool):
+    socket.status = status_record(status_category(ex))
+    PROBES.inc(socket.status.name)
+    await pool.update_socket_a(socket)
+
+def on_unknown_exception(ex: BaseException, pool: DBPool):
+    scanner_logger.exception(f'UNKNOWN EXCEPTION {ex.__class__.__name__} {ex}')
+    pool.flush()
+    stop_profile()
+    kill_proc()
+
+@timed('probe')
+def handle_result(scan_function: Callable[[SocketRecord, float], ServerRecord], socket: SocketRecord, timeout: float, pool: DBPool | None = None, adaptive: AdaptiveController | None = None):
     if not pool: raise Exception('No pool provided!')
+    HOST_LIMITER.wait(socket.host.name)
+    if adaptive: timeout = adaptive.timeout
+    start = time.monotonic()
+    IN_FLIGHT.inc()
     try:
-        server = scan_function(socket, timeout)
-        socket.status = pool.MINECRAFT_SERVER_STATUS
-        pool.add_server(server)
-        return server
+        try:
+            server = scan_function(socket, timeout)
+        finally:
+            IN_FLIGHT.dec()
+        PROBE_LATENCY.observe(time.monotonic() - start)
+        if adaptive: adaptive.observe_success(time.monotonic() - start)
+        return on_server(server, socket, pool)
     except KNOWN_EXCEPTIONS as ex:
-        status_name = f'{ex.__class__.__name__} {ex}'
-        socket.status = Status(name=status_name)
-        pool.update_socket(socket)
+        PROBE_LATENCY.observe(time.monotonic() - start)
+        if adaptive: adaptive.observe_failure(status_category(ex))
+        on_known_exception(ex, socket, pool)
     except Exception as ex:
-        scanner_logger.exception(f'UNKNOWN EXCEPTION {ex.__class__.__name__} {ex}')
-        kill_proc()
-
-def obtain_server_info(socket: Socket, timeout: int):
-    server = JavaServer(socket.host.name, socket.port, timeout=timeout)
-    status = server.status()
-    description = remove_color_codes(status.description)
-    raw_result = {
-        'socket': socket,
-        'version': status.version.name.strip(),
-        'description': description.strip(),
-        'max_players':status.players.max
-    }
-    result = MServer(**raw_result)
-    raw_result['version'] = raw_result['version'][:15]
-    raw_result['description'] = raw_result['description'][:25]
-    raw_result['socket'] = f"{result.socket.host.name}:{result.socket.port}"
-    log_result = json.dumps(raw_result)
+        on_unknown_exception(ex, pool)
+
+@timed('probe')
+async def handle_result_a(scan_function: Callable[[SocketRecord, float], Awaitable[ServerRecord]], socket: SocketRecord, timeout: float, pool: DBPool | None = None, adaptive: AdaptiveController | None = None):
+    if not pool: raise Exception('No pool provided!')
+    await HOST_LIMITER.wait_a(socket.host.name)
+    if adaptive: timeout = adaptive.timeout
+    start = time.monotonic()
+    IN_FLIGHT.inc()
+    try:
+        try:
+            server = await scan_function(socket, timeout)
+        finally:
+            IN_FLIGHT.dec()
+        PROBE_LATENCY.observe(time.monotonic() - start)
+        if adaptive: adaptive.observe_success(time.monotonic() - start)
+        return await on_server_a(server, socket, pool)
+    except KNOWN_EXCEPTIONS as ex:
+        PROBE_LATENCY.observe(time.monotonic() - start)
+        if adaptive: adaptive.observe_failure(status_category(ex))
+        await on_known_exception_a(ex, socket, pool)
+    except Exception as ex:
+        on_unknown_exception(ex, pool)
+
+def server_info(socket: SocketRecord, version: str, description: str, max_players: int):
+    result = ServerRecord(socket, version.strip(), description.strip(), int(max_players))
+    log_result = json.dumps({
+        'socket': f'{socket.host.name}:{socket.port}',
+        'version': result.version[:15],
+        'description': result.description[:25],
+        'max_players': result.max_players
+    })
     scanner_logger.info(f'server discovered {log_result}')
     return result
 
-def check_ngrok_sockets_t(pool: DBPool, threads: int, timeout: int) -> list[MServer]:
+def parse_server_info(socket: SocketRecord, status: JavaStatusResponse):
+    return server_info(socket, status.version.name, remove_color_codes(status.description), status.players.max)
+
+_slp_client = SLP_CLIENT
+
+def set_slp_client(name: str):
+    global _slp_client
+    _slp_client = name
+
+@timed('status')
+def obtain_server_info(socket: SocketRecord, timeout: float):
+    ip = DNS_CACHE.ip(socket.host.name)
+    if _slp_client == 'mcstatus':
+        return parse_server_info(socket, ResolvedJavaServer(socket.host.name, socket.port, ip, timeout=timeout).status())
+    return server_info(socket, *query_status(ip, socket.host.name, socket.port, timeout))
+
+@timed('status')
+async def obtain_server_info_a(socket: SocketRecord, timeout: float):
+    ip = await DNS_CACHE.ip_a(socket.host.name)
+    if _slp_client == 'mcstatus':
+        return parse_server_info(socket, await ResolvedJavaServer(socket.host.name, socket.port, ip, timeout=timeout).async_status())
+    return server_info(socket, *await query_status_a(ip, socket.host.name, socket.port, timeout))
+
+def check_ngrok_sockets_t(pool: DBPool, threads: int, timeout: int, shard: tuple[int, int] = (0, 1), adaptive: bool = False) -> list[ServerRecord]:
     scanner_logger.info(f'scannig ngrok sockets...')
-    threaded_funcs = [craft_function(handle_result, obtain_server_info, Socket(host=Host(name=f'{i}.tcp.eu.ngrok.io'), port=p), timeout) for i in range(10) for p in range(1, 65_536)]
-    servers = run_threaded(threaded_funcs, thread_count=threads, pool=pool)
+    sockets = ngrok_sockets(shard)
+    controller = adaptive_controller(adaptive, timeout, threads, sockets)
+    threaded_funcs = craft_probes(handle_result, obtain_server_info, sockets, timeout, controller)
+    servers = run_threaded(threaded_funcs, thread_count=threads, pool=pool, adaptive=controller)
+    DNS_CACHE.log_stats()
+    HOST_LIMITER.log_stats()
     scanner_logger.info(f'scanned ngrok sockets. found {len(servers):_} servers')
     return servers
 
-def check_target_sockets_t(sockets: list[Socket], pool: DBPool, threads: int, timeout: int) -> list[MServer]:
+def check_target_sockets_t(sockets: Sequence[SocketRecord] | LazyIterable[SocketRecord], pool: DBPool, threads: int, timeout: int, adaptive: bool = False) -> list[ServerRecord]:
     if not sockets:
         scanner_logger.info('no sockets to scan!')
         return []
     scanner_logger.info(f'{len(sockets):_} sockets to scan')
-    threaded_funcs = [craft_function(handle_result, obtain_server_info, socket, timeout) for socket in sockets]
-    servers = run_threaded(threaded_funcs, thread_count=threads, pool=pool)
+    controller = adaptive_controller(adaptive, timeout, threads, sockets)
+    threaded_funcs = craft_probes(handle_result, obtain_server_info, sockets, timeout, controller)
+    servers = run_threaded(threaded_funcs, thread_count=threads, pool=pool, adaptive=controller)
+    DNS_CACHE.log_stats()
+    HOST_LIMITER.log_stats()
     scanner_logger.info(f'scanned {len(sockets):_} sockets. found {len(servers):_} servers')
     return servers
+
+def check_ngrok_sockets_a(pool: DBPool, concurrency: int, timeout: int, shard: tuple[int, int] = (0, 1), adaptive: bool = False) -> list[ServerRecord]:
+    scanner_logger.info(f'scannig ngrok sockets...')
+    sockets = ngrok_sockets(shard)
+    controller = adaptive_controller(adaptive, timeout, concurrency, sockets)
+    async_funcs = craft_probes(handle_result_a, obtain_server_info_a, sockets, timeout, controller)
+    servers = run_async(async_funcs, concurrency=concurrency, pool=pool, adaptive=controller)
+    DNS_CACHE.log_stats()
+    HOST_LIMITER.log_stats()
+    scanner_logger.info(f'scanned ngrok sockets. found {len(servers):_} servers')
+    return servers
+
+def check_target_sockets_a(sockets: Sequence[SocketRecord] | LazyIterable[SocketRecord], pool: DBPool, concurrency: int, timeout: int, adaptive: bool = False) -> list[ServerRecord]:
+    if not sockets:
+        scanner_logger.info('no sockets to scan!')
+        return []
+    scanner_logger.info(f'{len(sockets):_} sockets to scan')
+    controller = adaptive_controller(adaptive, timeout, concurrency, sockets)
+    async_funcs = craft_probes(handle_result_a, obtain_server_info_a, sockets, timeout, controller)
+    servers = run_async(async_funcs, concurrency=concurrency, pool=pool, adaptive=controller)
+    DNS_CACHE.log_stats()
+    HOST_LIMITER.log_stats()
+    scanner_logger.info(f'scanned {len(sockets):_} sockets. found {len(servers):_} servers')
+    return servers
+
+ENGINES = {
+    'threads': (check_ngrok_sockets_t, check_target_sockets_t),
+    'async': (check_ngrok_sockets_a, check_target_sockets_a),
+}
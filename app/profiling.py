@@ -0,0 +1,213 @@
+import contextlib
+import functools
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+import typing
+from collections import Counter
+from config import PROFILE_INTERVAL, PROFILE_TOP, profile_logger
+
+_enabled = False
+_active: 'Profile | None' = None
+_local = threading.local()
+_stats: list[dict[str, list[float]]] = []
+_stats_lock = threading.Lock()
+_off = contextlib.nullcontext()
+
+def enabled():
+    return _enabled
+
+def _thread_stats() -> dict[str, list[float]]:
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _local.stats = {}
+        with _stats_lock:
+            _stats.append(stats)
+    return stats
+
+def record(name: str, elapsed: float):
+    stats = _thread_stats()
+    entry = stats.get(name)
+    if entry is None:
+        stats[name] = [1, elapsed, elapsed]
+        return
+    entry[0] += 1
+    entry[1] += elapsed
+    if elapsed > entry[2]:
+        entry[2] = elapsed
+
+class Stage():
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+
+def stage(name: str) -> typing.ContextManager:
+    return Stage(name) if _enabled else _off
+
+def timed(name: str):
+    def decorator(func: typing.Callable):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def timed_iter(name: str, iterable: typing.Iterable[typing.Any]) -> typing.Iterator[typing.Any]:
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record(name, time.perf_counter() - start)
+        yield item
+
+def stage_totals() -> dict[str, list[float]]:
+    totals: dict[str, list[float]] = {}
+    with _stats_lock:
+        stats = list(_stats)
+    for thread_stats in stats:
+        for name, (count, total, longest) in list(thread_stats.items()):
+            entry = totals.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+    return totals
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+class Sampler(threading.Thread):
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        threading.Thread.__init__(self, daemon=True, name='profile-sampler')
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter[str] = Counter()
+        self._stop_sampling = threading.Event()
+
+    def sample(self):
+        names = {t.ident: re.sub(r'\d+', 'N', t.name) for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident: continue
+            stack: list[str] = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread'))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self):
+        while not self._stop_sampling.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_sampling.set()
+        self.join()
+
+    def write_folded(self, filepath: str):
+        with open(filepath, 'wt') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def top(self, n: int = PROFILE_TOP) -> tuple[list[tuple[str, int]], list[tuple[str, int]]]:
+        own: Counter[str] = Counter()
+        inclusive: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames: continue
+            own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        return own.most_common(n), inclusive.most_common(n)
+
+class Profile():
+    def __init__(self, name: str, interval: float = 0):
+        self.name = name
+        self.sampler = Sampler(interval) if interval > 0 else None
+        self.started_at = time.time()
+        self.stopped = False
+        self._stop_lock = threading.Lock()
+
+    def start(self):
+        global _enabled, _active
+        _enabled = True
+        _active = self
+        self.started_at = time.time()
+        if self.sampler:
+            self.sampler.start()
+        profile_logger.info(f'profiling stages' + (f' and sampling all threads every {self.sampler.interval * 1000:g} ms' if self.sampler else '') + f', report will be written to {self.name}.txt')
+        return self
+
+    def stage_lines(self) -> list[str]:
+        elapsed = time.time() - self.started_at
+        lines = [f'wall time {elapsed:.2f} seconds, stage totals add up all threads and tasks', f'{"stage":<32} {"calls":>12} {"total s":>12} {"mean ms":>10} {"max ms":>10}']
+        for name, (count, total, longest) in sorted(stage_totals().items(), key=lambda x: -x[1][1]):
+            lines.append(f'{name:<32} {count:>12_.0f} {total:>12.2f} {total / count * 1000:>10.3f} {longest * 1000:>10.1f}')
+        return lines
+
+    def sample_lines(self) -> list[str]:
+        if not self.sampler: return []
+        own, inclusive = self.sampler.top()
+        samples = max(self.sampler.samples, 1)
+        lines = [f'{self.sampler.samples:_} samples of all threads every {self.sampler.interval * 1000:g} ms, flamegraph stacks in {self.name}.folded', '']
+        lines.append(f'{"own samples per sample":>24}  function')
+        lines += [f'{count / samples:>24.2f}  {label}' for label, count in own]
+        lines += ['', f'{"total samples per sample":>24}  function']
+        lines += [f'{count / samples:>24.2f}  {label}' for label, count in inclusive]
+        return lines
+
+    def stop(self):
+        global _enabled, _active
+        with self._stop_lock:
+            if self.stopped: return
+            self.stopped = True
+            self._write()
+        _active = None
+
+    def _write(self):
+        global _enabled
+        if self.sampler:
+            self.sampler.stop()
+            self.sampler.write_folded(f'{self.name}.folded')
+        _enabled = False
+        stage_lines = self.stage_lines()
+        with open(f'{self.name}.txt', 'wt') as f:
+            f.write('\n'.join(stage_lines + [''] + self.sample_lines()) + '\n')
+        [profile_logger.info(line) for line in stage_lines]
+        profile_logger.info(f'profile written to {self.name}.txt' + (f' and {self.name}.folded' if self.sampler else ''))
+
+def stop_active():
+    if _active:
+        _active.stop()
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import time
+from config import HOST_RATE, HOST_BURST, limiter_logger
+from metrics import LIMITER_WAIT
+from profiling import timed
+
+class TokenBucket():
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+class HostRateLimiter():
+    def __init__(self, rate: float = HOST_RATE, burst: float = HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.waited = 0.0
+        self.delayed = 0
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rate: float, burst: float = HOST_BURST):
+        with self._lock:
+            self.rate = rate
+            self.burst = max(burst, 1)
+            self._buckets = {}
+
+    def reserve(self, host: str) -> float:
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.burst, now)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate) - 1
+            bucket.updated = now
+            if bucket.tokens >= 0:
+                return 0
+            delay = -bucket.tokens / self.rate
+            self.waited += delay
+            self.delayed += 1
+        LIMITER_WAIT.inc(amount=delay)
+        return delay
+
+    @timed('limiter.wait')
+    def wait(self, host: str):
+        delay = self.reserve(host)
+        if delay > 0:
+            time.sleep(delay)
+
+    @timed('limiter.wait')
+    async def wait_a(self, host: str):
+        delay = self.reserve(host)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def log_stats(self):
+        if not self.rate: return
+        limiter_logger.info(f'host rate limit {self.rate:g}/s (burst {self.burst:g}): {self.delayed:_} probes delayed by {self.waited:_.1f} seconds in total across {len(self._buckets):_} hosts')
+
+HOST_LIMITER = HostRateLimiter()
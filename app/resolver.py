@@ -0,0 +1,73 @@
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from config import DNS_CACHE_TTL, DNS_NEGATIVE_CACHE_TTL, resolver_logger
+from profiling import timed
+
+class DNSCache():
+    def __init__(self, ttl: float = DNS_CACHE_TTL, negative_ttl: float = DNS_NEGATIVE_CACHE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache: dict[str, tuple[float, tuple[int, str] | socket.gaierror]] = {}
+        self._lock = threading.Lock()
+        self._host_locks: dict[str, threading.Lock] = {}
+
+    def _cached(self, host: str):
+        entry = self._cache.get(host)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        self.hits += 1
+        result = entry[1]
+        if isinstance(result, socket.gaierror):
+            raise socket.gaierror(*result.args)
+        return result
+
+    @timed('dns')
+    def resolve(self, host: str) -> tuple[int, str]:
+        if host[-1].isdigit() or ':' in host:
+            try:
+                ip = ipaddress.ip_address(host)
+            except ValueError:
+                pass
+            else:
+                return (socket.AF_INET6 if ip.version == 6 else socket.AF_INET, host)
+        result = self._cached(host)
+        if result is not None:
+            return result
+        with self._lock:
+            host_lock = self._host_locks.setdefault(host, threading.Lock())
+        with host_lock:
+            result = self._cached(host)
+            if result is not None:
+                return result
+            self.misses += 1
+            try:
+                family, _, _, _, sockaddr = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0]
+            except socket.gaierror as ex:
+                self._cache[host] = (time.monotonic() + self.negative_ttl, ex)
+                raise
+            result = (family, str(sockaddr[0]))
+            self._cache[host] = (time.monotonic() + self.ttl, result)
+            return result
+
+    @timed('dns')
+    async def resolve_a(self, host: str) -> tuple[int, str]:
+        result = self._cached(host)
+        if result is not None:
+            return result
+        return await asyncio.get_running_loop().run_in_executor(None, self.resolve, host)
+
+    def ip(self, host: str):
+        return self.resolve(host)[1]
+
+    async def ip_a(self, host: str):
+        return (await self.resolve_a(host))[1]
+
+    def log_stats(self):
+        resolver_logger.info(f'dns cache: {self.hits:_} hits, {self.misses:_} misses, {len(self._cache):_} hosts cached')
+
+DNS_CACHE = DNSCache()
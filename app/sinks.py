@@ -0,0 +1,114 @@
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+import time
+import typing
+from config import SINK_BUFFER_SIZE, SINK_FLUSH_PERIOD
+from db.records import ServerRecord
+from profiling import timed
+
+CSV_COLUMNS = ('host', 'port', 'version', 'description', 'max_players')
+
+def open_text(path: str) -> typing.TextIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'at', encoding='utf-8') #type: ignore
+    if path.endswith('.zst'):
+        import zstandard
+        writer = zstandard.ZstdCompressor().stream_writer(open(path, 'ab'))
+        return io.TextIOWrapper(writer, encoding='utf-8', write_through=False) #type: ignore
+    return open(path, 'at', encoding='utf-8', buffering=SINK_BUFFER_SIZE)
+
+def output_format(path: str):
+    for suffix in ('.gz', '.zst'):
+        path = path.removesuffix(suffix)
+    return os.path.splitext(path)[1]
+
+class Sink():
+    def __init__(self, path: str):
+        self.path = path
+        self.is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open_text(path)
+
+    def write(self, server: ServerRecord):
+        raise NotImplementedError()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class JsonLinesSink(Sink):
+    def write(self, server: ServerRecord):
+        self.file.write(json.dumps({
+            'socket': f'{server.socket.host.name}:{server.socket.port}',
+            'version': server.version,
+            'description': server.description,
+            'max_players': server.max_players,
+        }) + '\n')
+
+class CsvSink(Sink):
+    def __init__(self, path: str):
+        Sink.__init__(self, path)
+        self.writer = csv.writer(self.file)
+        if self.is_new:
+            self.writer.writerow(CSV_COLUMNS)
+
+    def write(self, server: ServerRecord):
+        self.writer.writerow((server.socket.host.name, server.socket.port, server.version, server.description, server.max_players))
+
+SINKS: dict[str, typing.Type[Sink]] = {
+    '.txt': JsonLinesSink,
+    '.jsonl': JsonLinesSink,
+    '.csv': CsvSink,
+}
+
+def check_output_path(path: str):
+    if output_format(path) not in SINKS:
+        raise ValueError(f'Unsupported output file {path}, expected {", ".join(SINKS)} optionally followed by .gz or .zst')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(f'Writing {path} needs the zstandard package, install it with pip install zstandard')
+
+class Sinks():
+    def __init__(self, paths: list[str]):
+        [check_output_path(path) for path in paths]
+        self.sinks = [SINKS[output_format(path)](path) for path in paths]
+        self.written = 0
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def __bool__(self):
+        return bool(self.sinks)
+
+    @timed('sinks.write')
+    def write(self, server: ServerRecord):
+        with self._lock:
+            for sink in self.sinks:
+                sink.write(server)
+            self.written += 1
+
+    @timed('sinks.flush')
+    def _flush(self):
+        for sink in self.sinks:
+            sink.flush()
+        self._flushed_at = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def flush_due(self):
+        if time.monotonic() - self._flushed_at >= SINK_FLUSH_PERIOD:
+            self.flush()
+
+    def close(self):
+        with self._lock:
+            for sink in self.sinks:
+                sink.close()
+            self.sinks = []
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import socket
+import struct
+import threading
+import time
+import typing
+from config import SLP_PROTOCOL_VERSION, SLP_BUFFER_SIZE, SLP_MAX_RESPONSE
+from metrics import CONNECT_LATENCY, STATUS_LATENCY
+from profiling import stage
+from utils import remove_color_codes
+
+STATUS_REQUEST = b'\x01\x00'
+PING_ID = b'\x01'
+
+_buffers = threading.local()
+
+def varint(n: int) -> bytes:
+    n &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def read_varint(data: typing.Sequence[int], pos: int = 0) -> tuple[int, int]:
+    n = 0
+    for i in range(5):
+        b = data[pos + i]
+        n |= (b & 0x7F) << (7 * i)
+        if not b & 0x80:
+            return n, pos + i + 1
+    raise OSError('Received invalid varint')
+
+def status_request(host: str, port: int) -> bytes:
+    address = host.encode()
+    handshake = b'\x00' + varint(SLP_PROTOCOL_VERSION) + varint(len(address)) + address + struct.pack('>H', port) + b'\x01'
+    return varint(len(handshake)) + handshake + STATUS_REQUEST
+
+def chat_text(component: typing.Any) -> str:
+    if isinstance(component, str):
+        return component
+    if isinstance(component, list):
+        return ''.join(chat_text(c) for c in component)
+    if isinstance(component, dict):
+        text = str(component.get('text', '')) + str(component.get('translate', ''))
+        return text + chat_text(component.get('extra', []))
+    return ''
+
+def ping_request(token: int) -> bytes:
+    return varint(9) + PING_ID + struct.pack('>q', token)
+
+def status_json(payload: memoryview) -> typing.Any:
+    try:
+        packet_id, pos = read_varint(payload)
+        if packet_id != 0:
+            raise OSError('Received invalid status response packet')
+        length, pos = read_varint(payload, pos)
+        return json.loads(str(payload[pos:pos + length], 'utf-8'))
+    except (IndexError, ValueError):
+        raise OSError('Received invalid status response')
+
+def parse_status(payload: memoryview) -> tuple[str, str, int]:
+    raw = status_json(payload)
+    try:
+        return str(raw['version']['name']), remove_color_codes(chat_text(raw['description'])), int(raw['players']['max'])
+    except (ValueError, KeyError, TypeError):
+        raise OSError('Received invalid status response')
+
+def read_buffer(size: int = SLP_BUFFER_SIZE) -> bytearray:
+    buf: bytearray | None = getattr(_buffers, 'buf', None)
+    if buf is None or len(buf) < size:
+        buf = _buffers.buf = bytearray(size)
+    return buf
+
+def recv_packet(sock: socket.socket) -> memoryview:
+    view = memoryview(read_buffer())
+    received = 0
+    length: int | None = None
+    start = 0
+    while True:
+        if length is None and received:
+            try:
+                length, start = read_varint(view, 0) if received >= 5 else read_varint(view[:received], 0)
+            except IndexError:
+                pass
+            else:
+                if length > SLP_MAX_RESPONSE:
+                    raise OSError('Received too large status response')
+                if start + length > len(view):
+                    grown = memoryview(read_buffer(start + length))
+                    grown[:received] = view[:received]
+                    view = grown
+        if length is not None and received >= start + length:
+            return view[start:start + length]
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise OSError('Server did not respond with any information')
+        received += n
+
+def query_status(ip: str, host: str, port: int, timeout: float) -> tuple[str, str, int]:
+    start = time.monotonic()
+    with stage('slp.connect'):
+        sock = socket.create_connection((ip, port), timeout=timeout)
+    with sock:
+        connected = time.monotonic()
+        CONNECT_LATENCY.observe(connected - start)
+        with stage('slp.exchange'):
+            sock.sendall(status_request(host, port))
+            payload = recv_packet(sock)
+        with stage('slp.parse'):
+            status = parse_status(payload)
+        STATUS_LATENCY.observe(time.monotonic() - connected)
+        return status
+
+async def read_packet_a(reader: asyncio.StreamReader) -> bytes:
+    head = bytearray()
+    while True:
+        head += await reader.readexactly(1)
+        if not head[-1] & 0x80:
+            break
+        if len(head) == 5:
+            raise OSError('Received invalid varint')
+    length, _ = read_varint(head)
+    if length > SLP_MAX_RESPONSE:
+        raise OSError('Received too large status response')
+    return await reader.readexactly(length)
+
+async def query_status_a(ip: str, host: str, port: int, timeout: float) -> tuple[str, str, int]:
+    start = time.monotonic()
+    with stage('slp.connect'):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    try:
+        connected = time.monotonic()
+        CONNECT_LATENCY.observe(connected - start)
+        with stage('slp.exchange'):
+            writer.write(status_request(host, port))
+            payload = await asyncio.wait_for(read_packet_a(reader), timeout)
+        with stage('slp.parse'):
+            status = parse_status(memoryview(payload))
+        STATUS_LATENCY.observe(time.monotonic() - connected)
+        return status
+    except asyncio.IncompleteReadError:
+        raise OSError('Server did not respond with any information')
+    finally:
+        writer.close()
+
+async def ping_a(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float) -> float | None:
+    token = time.time_ns() & 0x7FFFFFFFFFFFFFFF
+    sent = time.monotonic()
+    try:
+        writer.write(ping_request(token))
+        pong = await asyncio.wait_for(read_packet_a(reader), timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        return None
+    return time.monotonic() - sent if pong == PING_ID + struct.pack('>q', token) else None
+
+async def query_full_status_a(ip: str, host: str, port: int, timeout: float) -> tuple[typing.Any, float | None]:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    try:
+        writer.write(status_request(host, port))
+        raw = status_json(memoryview(await asyncio.wait_for(read_packet_a(reader), timeout)))
+        return raw, await ping_a(reader, writer, timeout)
+    except asyncio.IncompleteReadError:
+        raise OSError('Server did not respond with any information')
+    finally:
+        writer.close()
@@ -0,0 +1,208 @@
+import gzip
+import ipaddress
+import math
+import os
+import socket
+import typing
+import zlib
+from itertools import islice
+from config import TARGETS_DEDUP_MB, TARGETS_DEDUP_FP_RATE, TARGETS_WINDOW, TARGETS_SAMPLE_BYTES, targets_logger
+from db.records import HostRecord, SocketRecord
+from utils import interleave_by, LazyIterable
+
+Hosts = list[str] | ipaddress.IPv4Network | ipaddress.IPv6Network
+
+def clean_lines(lines: typing.Iterable[str]) -> typing.Iterator[str]:
+    for line in lines:
+        line = line.partition('#')[0].strip()
+        if line:
+            yield line
+
+def open_lines(filepath: str) -> typing.Iterator[str]:
+    opener = gzip.open if filepath.endswith('.gz') else open
+    with opener(filepath, 'rt', encoding='utf-8', errors='replace') as f: #type: ignore
+        yield from clean_lines(f)
+
+def sample_lines(filepath: str, size: int) -> tuple[list[str], float]:
+    file_size = os.path.getsize(filepath)
+    if file_size <= size:
+        return list(open_lines(filepath)), 1.0
+    with open(filepath, 'rb') as f:
+        data = f.read(size)
+    if filepath.endswith('.gz'):
+        data = zlib.decompressobj(wbits=31).decompress(data)
+    return data.decode('utf-8', errors='replace').splitlines()[:-1], size / file_size # the last line may be cut
+
+def target_count(line: str) -> int:
+    host, _, port = line.rpartition(':')
+    if port.isdigit() and host and '/' not in host and 0 < int(port) <= 65535:
+        return 1
+    hosts, ports = parse_target(line)
+    return host_count(hosts) * sum(len(r) for r in ports)
+
+def parse_ports(spec: str) -> list[range]:
+    ports: list[range] = []
+    for part in spec.split(','):
+        start, dash, end = part.partition('-')
+        first, last = int(start), int(end if dash else start)
+        if not 0 < first <= last <= 65535:
+            raise ValueError(f'Invalid port range {part}')
+        ports.append(range(first, last + 1))
+    return ports
+
+def parse_hosts(spec: str) -> Hosts:
+    spec = spec.strip('[]')
+    if '/' in spec:
+        return ipaddress.ip_network(spec, strict=False)
+    if not spec:
+        raise ValueError('Missing host')
+    return [spec]
+
+def parse_target(line: str) -> tuple[Hosts, list[range]]:
+    hosts, colon, ports = line.rpartition(':')
+    if not colon:
+        raise ValueError(f'Missing port in {line}')
+    return parse_hosts(hosts), parse_ports(ports)
+
+def host_count(hosts: Hosts) -> int:
+    if isinstance(hosts, list):
+        return len(hosts)
+    if hosts.num_addresses <= 2:
+        return hosts.num_addresses
+    return hosts.num_addresses - (1 if hosts.version == 6 else 2)
+
+def host_names(network: ipaddress.IPv4Network | ipaddress.IPv6Network) -> typing.Iterator[str]:
+    if network.version == 6:
+        return (str(ip) for ip in network.hosts())
+    first = int(network.network_address)
+    skip = 1 if network.num_addresses > 2 else 0
+    return (socket.inet_ntoa(n.to_bytes(4, 'big')) for n in range(first + skip, first + network.num_addresses - skip))
+
+def expand(hosts: Hosts, ports: list[range]) -> typing.Iterator[SocketRecord]:
+    if isinstance(hosts, list):
+        records = [HostRecord(host) for host in hosts]
+        for port_range in ports:
+            for port in port_range:
+                for host in records:
+                    yield SocketRecord(host, port)
+        return
+    for port_range in ports:
+        for port in port_range:
+            for ip in host_names(hosts):
+                yield SocketRecord(HostRecord(ip), port)
+
+class BloomFilter():
+    def __init__(self, capacity: int | None, max_mb: float = TARGETS_DEDUP_MB, fp_rate: float = TARGETS_DEDUP_FP_RATE):
+        max_size = int(max_mb * 8 * 1024 * 1024)
+        if capacity is None: # unknown, takes the whole budget
+            self.size = max(max_size, 64)
+            self.hashes = max(1, min(8, round(-math.log2(fp_rate))))
+        else:
+            wanted = math.ceil(-max(capacity, 1) * math.log(fp_rate) / math.log(2) ** 2)
+            self.size = max(min(wanted, max_size), 64)
+            self.hashes = max(1, min(8, round(self.size / max(capacity, 1) * math.log(2))))
+        self.added = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key: typing.Hashable) -> bool:
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits, size = self._bits, self.size
+        new = False
+        for i in range(self.hashes):
+            bit = h1 % size
+            h1 += h2
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        self.added += new
+        return new
+
+    def false_positive_rate(self):
+        return (1 - math.exp(-self.hashes * self.added / self.size)) ** self.hashes
+
+def check_target_path(path: str):
+    if not os.path.isfile(path):
+        raise ValueError(f'Target file {path} does not exist')
+
+class TargetFile():
+    def __init__(self, filepath: str, shard: tuple[int, int] = (0, 1), dedup_mb: float = TARGETS_DEDUP_MB, seed: int | None = None):
+        check_target_path(filepath)
+        self.filepath = filepath
+        self.shard = shard
+        self.dedup_mb = dedup_mb
+        self.seed = seed
+
+    def estimate(self) -> tuple[int, bool]:
+        lines, share = sample_lines(self.filepath, TARGETS_SAMPLE_BYTES)
+        total = 0
+        invalid = 0
+        for line in clean_lines(lines):
+            try:
+                total += target_count(line)
+            except ValueError:
+                invalid += 1
+        exact = share >= 1
+        if not exact:
+            total = round(total / share)
+        k, n = self.shard
+        targets_logger.info(f'{self.filepath}: ' + (f'{total:_} targets' if exact else f'about {total:_} targets, estimated from the first {TARGETS_SAMPLE_BYTES / 1024 / 1024:g} MB') + (f', {len(range(k, total, n)):_} in shard {k}/{n}' if n > 1 else '') + (f', {invalid:_} invalid lines skipped' if invalid and exact else '') + (', counted before duplicates are skipped' if self.dedup_mb else ''))
+        return len(range(k, total, n)), exact
+
+    def targets(self) -> typing.Iterator[SocketRecord]:
+        k, n = self.shard
+        invalid = 0
+        index = 0
+        for line_number, line in enumerate(open_lines(self.filepath), 1):
+            host, _, port = line.rpartition(':')
+            if port.isdigit() and host and '/' not in host and 0 < int(port) <= 65535:
+                if index % n == k:
+                    yield SocketRecord(HostRecord(host.strip('[]')), int(port))
+                index += 1
+                continue
+            try:
+                hosts, ports = parse_target(line)
+            except ValueError as ex:
+                if not invalid:
+                    targets_logger.info(f'[warning] {self.filepath}:{line_number} skipped: {ex}')
+                invalid += 1
+                continue
+            size = host_count(hosts) * sum(len(r) for r in ports)
+            start = (k - index) % n
+            index += size
+            if start < size:
+                yield from islice(expand(hosts, ports), start, None, n)
+
+    def tally(self, sockets: typing.Iterable[SocketRecord], expected: int, total: LazyIterable) -> typing.Iterator[SocketRecord]:
+        counted = 0
+        for sock in sockets:
+            counted += 1
+            if counted > expected: total.length += 1
+            yield sock
+        if counted < expected: total.length -= expected - counted
+
+    def unique(self, sockets: typing.Iterable[SocketRecord], capacity: int | None, total: LazyIterable | None = None) -> typing.Iterator[SocketRecord]:
+        seen = BloomFilter(capacity, self.dedup_mb)
+        duplicates = 0
+        for sock in sockets:
+            if seen.add((sock.host.name, sock.port)):
+                yield sock
+            else:
+                duplicates += 1
+                if total is not None: total.length -= 1
+        targets_logger.info(f'{self.filepath}: {seen.added:_} unique targets, {duplicates:_} duplicate targets skipped, dedup filter of {seen.size / 8 / 1024 / 1024:.1f} MB with an estimated {seen.false_positive_rate():.2%} of unique targets skipped by mistake')
+
+    def sockets(self, expected: int, total: LazyIterable | None = None, exact: bool = True) -> typing.Iterator[SocketRecord]:
+        targets = self.targets() if exact or total is None else self.tally(self.targets(), expected, total)
+        sockets = self.unique(targets, expected if exact else None, total) if self.dedup_mb else targets
+        while True:
+            window = list(islice(sockets, TARGETS_WINDOW))
+            if not window: return
+            yield from interleave_by(window, lambda s: s.host.name, self.seed)
+
+def file_sockets(filepath: str, shard: tuple[int, int] = (0, 1), dedup_mb: float = TARGETS_DEDUP_MB, seed: int | None = None) -> LazyIterable[SocketRecord]:
+    target_file = TargetFile(filepath, shard, dedup_mb, seed)
+    count, exact = target_file.estimate()
+    sockets: LazyIterable[SocketRecord] = LazyIterable(count, lambda: target_file.sockets(count, sockets, exact))
+    return sockets
@@ -0,0 +1,164 @@
+import selectors
+import socket
+import errno
+import time
+import typing
+import threading
+import heapq
+import itertools
+from collections import deque
+from config import PREFILTER_THREADS, PREFILTER_IN_FLIGHT, prefilter_logger
+from mine_scanner import on_known_exception, ngrok_sockets
+from threads import WorkQueue, start_pool_thread, stop_pool_thread
+from utils import raise_open_files_limit, LazyIterable
+from resolver import DNS_CACHE
+from rate_limit import HOST_LIMITER
+from metrics import IN_FLIGHT, CONNECT_LATENCY
+from db.controller import DBPool
+from db.records import SocketRecord, ServerRecord
+
+CONNECT_IN_PROGRESS = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035) # 10035 - WSAEWOULDBLOCK
+
+class Stats():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.probed = 0
+        self.open = 0
+
+    def add(self, probed: int, open: int):
+        with self._lock:
+            self.probed += probed
+            self.open += open
+
+class Connector():
+    def __init__(self, queue: typing.Iterator[SocketRecord], pool: DBPool, timeout: float, in_flight: int, stats: Stats):
+        self.queue = queue
+        self.pool = pool
+        self.timeout = timeout
+        self.in_flight = in_flight
+        self.stats = stats
+        self.selector = selectors.DefaultSelector()
+        self.deadlines: deque[tuple[float, socket.socket]] = deque()
+        self.pending: dict[socket.socket, tuple[SocketRecord, float]] = {}
+        self.open_sockets: list[SocketRecord] = []
+        self.delayed: list[tuple[float, int, SocketRecord]] = []
+        self._order = itertools.count()
+        self._exhausted = False
+
+    def fail(self, target: SocketRecord, ex: BaseException):
+        on_known_exception(ex, target, self.pool)
+        self.stats.add(1, 0)
+
+    def connect(self, target: SocketRecord):
+        try:
+            family, ip = DNS_CACHE.resolve(target.host.name)
+        except OSError as ex:
+            return self.fail(target, ex)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        err = sock.connect_ex((ip, target.port))
+        if err not in CONNECT_IN_PROGRESS:
+            sock.close()
+            return self.fail(target, OSError(err, ''))
+        self.selector.register(sock, selectors.EVENT_WRITE)
+        started = time.monotonic()
+        self.pending[sock] = (target, started)
+        self.deadlines.append((started + self.timeout, sock))
+        IN_FLIGHT.inc()
+
+    def finish(self, sock: socket.socket):
+        target, started = self.pending.pop(sock)
+        self.selector.unregister(sock)
+        IN_FLIGHT.dec()
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        sock.close()
+        if err:
+            return self.fail(target, OSError(err, ''))
+        CONNECT_LATENCY.observe(time.monotonic() - started)
+        self.open_sockets.append(target)
+        self.stats.add(1, 1)
+
+    def expire(self):
+        now = time.monotonic()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, sock = self.deadlines.popleft()
+            if sock not in self.pending:
+                continue
+            target, _ = self.pending.pop(sock)
+            self.selector.unregister(sock)
+            IN_FLIGHT.dec()
+            sock.close()
+            self.fail(target, socket.timeout('timed out'))
+
+    def connect_due(self):
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            self.connect(heapq.heappop(self.delayed)[2])
+
+    def fill(self):
+        self.connect_due()
+        while not self._exhausted and len(self.pending) + len(self.delayed) < self.in_flight:
+            try:
+                target = next(self.queue)
+            except StopIteration:
+                self._exhausted = True
+                break
+            delay = HOST_LIMITER.reserve(target.host.name)
+            if delay > 0:
+                heapq.heappush(self.delayed, (time.monotonic() + delay, next(self._order), target))
+                continue
+            self.connect(target)
+
+    def run(self):
+        self.fill()
+        while self.pending or self.delayed:
+            timeout = max(0, min(self.delayed[0][0] - time.monotonic(), 0.1)) if self.delayed else 0.1
+            if not self.pending:
+                time.sleep(timeout)
+            for key, _ in self.selector.select(timeout=timeout) if self.pending else []:
+                self.finish(key.fileobj) #type: ignore
+            self.expire()
+            self.fill()
+        self.selector.close()
+        return self.open_sockets
+
+def prefilter_sockets(
+        sockets: typing.Sequence[SocketRecord] | LazyIterable[SocketRecord],
+        pool: DBPool,
+        timeout: float,
+        threads: int = PREFILTER_THREADS,
+        in_flight: int = PREFILTER_IN_FLIGHT,
+    ) -> list[SocketRecord]:
+    raise_open_files_limit(threads * in_flight + 64)
+    queue = WorkQueue(sockets)
+    stats = Stats()
+    connectors = [Connector(queue, pool, timeout, in_flight, stats) for _ in range(threads)]
+    workers = [threading.Thread(target=c.run) for c in connectors]
+    prefilter_logger.info(f'connecting to {len(sockets):_} sockets with {threads} threads, {in_flight:_} connections in flight each')
+    pool_thread = start_pool_thread(pool)
+    start = time.time()
+    [w.start() for w in workers]
+    [w.join() for w in workers]
+    elapsed = time.time() - start
+    stop_pool_thread(pool, pool_thread, prefilter_logger)
+    DNS_CACHE.log_stats()
+    HOST_LIMITER.log_stats()
+    open_sockets = [s for c in connectors for s in c.open_sockets]
+    rate = stats.probed / elapsed if elapsed > 0 else 0
+    prefilter_logger.info(f'connect stage: {stats.probed:_} sockets in {elapsed:.1f} seconds ({rate:_.0f} sockets/s), {stats.open:_} open')
+    return open_sockets
+
+def prefiltered(check_target_sockets: typing.Callable[..., list[ServerRecord]]):
+    def check_target(sockets: typing.Sequence[SocketRecord] | LazyIterable[SocketRecord], pool: DBPool, workers: int, timeout: int, adaptive: bool = False) -> list[ServerRecord]:
+        open_sockets = prefilter_sockets(sockets, pool, timeout)
+        start = time.time()
+        servers = check_target_sockets(open_sockets, pool, workers, timeout, adaptive)
+        elapsed = time.time() - start
+        rate = len(open_sockets) / elapsed if elapsed > 0 else 0
+        prefilter_logger.info(f'status stage: {len(open_sockets):_} sockets in {elapsed:.1f} seconds ({rate:_.0f} sockets/s), {len(servers):_} servers')
+        return servers
+
+    def check_ngrok(pool: DBPool, workers: int, timeout: int, shard: tuple[int, int] = (0, 1), adaptive: bool = False) -> list[ServerRecord]:
+        return check_target(ngrok_sockets(shard), pool, workers, timeout, adaptive)
+
+    return check_ngrok, check_target
@@ -1,15 +1,16 @@
 import threading
 import typing
-from utils import split_on_n
 from copy import deepcopy
 import time
+from utils import LazyIterable
 from config import THREADS_NOTIFY_PERIOD, THREADS, threads_logger
+from adaptive import AdaptiveController
 from db.controller import DBPool
 
 class Thread(threading.Thread):
     def __init__(
             self, threadID: int, 
-            funcs: list[typing.Callable[..., typing.Any]], 
+            funcs: typing.Iterable[typing.Callable[..., typing.Any]], 
             threaded_result: dict[int, list[typing.Any]],
             threaded_progress: dict[int, int],
             monitor_progress = True,
@@ -18,7 +19,8 @@ class Thread(threading.Thread):
         threading.Thread.__init__(self)
         self.threadID = threadID
         self.funcs = funcs
-        self.completed_funcs = []
+        self.completed_funcs = 0
+        self.finished_at: float | None = None
         self.monitor_progress = monitor_progress
         self.kwargs = kwargs
         self.threaded_result = threaded_result
@@ -28,54 +30,90 @@ class Thread(threading.Thread):
             threaded_result[self.threadID] = []
 
     def run(self):
-        for i, func in enumerate(self.funcs, start=1):
+        for func in self.funcs:
             result = func(**self.kwargs)
             if self.monitor_progress:
-                self.completed_funcs.append(func)
-                self.threaded_progress[self.threadID] = len(self.completed_funcs)
+                self.completed_funcs += 1
+                self.threaded_progress[self.threadID] = self.completed_funcs
                 if result:
                     self.threaded_result[self.threadID].append(result)
+        self.finished_at = time.time()
 
-def watch_progress(total_functions: int, threaded_progress: dict[int, int]):
-    while True:
-        time.sleep(THREADS_NOTIFY_PERIOD)
+class WorkQueue():
+    def __init__(self, funcs: typing.Iterable[typing.Callable[..., typing.Any]]):
+        self._funcs = iter(funcs)
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.drained_at: float | None = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            try:
+                return next(self._funcs)
+            except StopIteration:
+                if self.drained_at is None:
+                    self.drained_at = time.time()
+                raise
+
+def report_tail(queue: WorkQueue, finished_at: float, logger = threads_logger):
+    total = finished_at - queue.started_at
+    drained_at = queue.drained_at or finished_at
+    tail = finished_at - drained_at
+    share = tail / total * 100 if total > 0 else 0
+    logger.info(f'scan took {total:.1f} seconds, queue drained after {drained_at - queue.started_at:.1f} seconds, tail took {tail:.1f} seconds ({share:.1f}% of the scan)')
+
+def watch_progress(funcs: typing.Sized, threaded_progress: dict[int, int], finished: threading.Event, adaptive: AdaptiveController | None = None):
+    while not finished.wait(THREADS_NOTIFY_PERIOD):
         completed_functions = sum(threaded_progress.values())
-        print(f'[threads] completed {completed_functions:_} / {total_functions:_} function calls')
-        if completed_functions >= total_functions:
-            break
+        print(f'[threads] completed {completed_functions:_} / {len(funcs):_} function calls' + (f', {adaptive}' if adaptive else ''))
     threaded_progress = dict()
 
 def run_threaded(
-        funcs: list[typing.Callable[..., typing.Any]],
+        funcs: typing.Sequence[typing.Callable[..., typing.Any]] | LazyIterable[typing.Callable[..., typing.Any]],
         thread_count: int,
         pool: DBPool | None = None,
+        adaptive: AdaptiveController | None = None,
     ):
     threaded_result: dict[int, list[typing.Any]]= dict()
     threaded_progress: dict[int, int] = dict()
-    splitted_funcs = split_on_n(funcs, thread_count)
-    funcs_count = sum([len(funcs) for funcs in splitted_funcs])
-    if funcs_count < thread_count:
-        thread_count = funcs_count
-    pool_thread: Thread | None = None
-    if pool:
-        pool_thread = Thread(-2, [craft_function(pool.release_pool_loop)], threaded_result, threaded_progress, monitor_progress=False)
-    if pool_thread:
-        pool_thread.start()
+    if len(funcs) < thread_count:
+        thread_count = len(funcs)
+    pool_thread = start_pool_thread(pool)
+    queue = WorkQueue(funcs)
     threads: list[Thread] = []
-    for i, _funcs in enumerate(splitted_funcs):
-        threads.append(Thread(i, _funcs, threaded_result, threaded_progress, pool=pool))
-    threads.append(Thread(-1, [craft_function(watch_progress, len(funcs), threaded_progress)], threaded_result, threaded_progress, monitor_progress=False))
+    for i in range(thread_count):
+        threads.append(Thread(i, adaptive.gate(i, queue) if adaptive else queue, threaded_result, threaded_progress, pool=pool))
+    finished = threading.Event()
+    watcher = Thread(-1, [craft_function(watch_progress, funcs, threaded_progress, finished, adaptive)], threaded_result, threaded_progress, monitor_progress=False)
     print(f'[threads] booting up {thread_count}+2 threads...')
-    [t.start() for t in threads]
+    [t.start() for t in [*threads, watcher]]
     [t.join() for t in threads]
-    if pool and pool_thread:
-        pool.stop()
-        threads_logger.info('waiting for last pool release...')
-        pool_thread.join()
+    finished.set()
+    watcher.join()
+    report_tail(queue, max([t.finished_at or time.time() for t in threads], default=time.time()))
+    stop_pool_thread(pool, pool_thread)
     result = deepcopy(threaded_result)
     threaded_result = dict()
     return extract_threads_result(result)
 
+def start_pool_thread(pool: DBPool | None):
+    if not pool:
+        return None
+    pool.resume()
+    pool_thread = Thread(-2, [craft_function(pool.release_pool_loop)], dict(), dict(), monitor_progress=False)
+    pool_thread.start()
+    return pool_thread
+
+def stop_pool_thread(pool: DBPool | None, pool_thread: Thread | None, logger = threads_logger):
+    if not pool or not pool_thread:
+        return
+    pool.stop()
+    logger.info('waiting for last pool release...')
+    pool_thread.join()
+
 def extract_threads_result(threads_result: dict[int, list[typing.Any]]):
     res = []
     for thread_results in threads_result.values():
@@ -1,3 +1,4 @@
+import ipaddress
 import json
 import typing
 import os
@@ -6,6 +7,10 @@ import datetime
 import sys
 import typing
 import string
+import re
+import math
+import random
+from collections import deque
 
 T = typing.TypeVar('T')
 
@@ -24,9 +29,86 @@ def load(filepath: str) -> dict:
     if not os.path.exists(filepath): return dict()
     with open(filepath) as f: return json.load(f)
 
-def split_on_n(lst: list[T], n: int) -> list[list[T]]:
-    k, m = divmod(len(lst), n)
-    return [lst[i*k+min(i, m):(i+1)*k+min(i+1, m)] for i in range(n)]
+def load_lines(filepath: str) -> list[str]:
+    if not os.path.exists(filepath): return []
+    with open(filepath) as f: return [line for line in f.read().splitlines() if line.strip()]
+
+class LazyIterable(typing.Generic[T]):
+    def __init__(self, length: int | typing.Sized, iterable: typing.Callable[[], typing.Iterable[T]]):
+        self.length = length
+        self.iterable = iterable
+
+    def __len__(self):
+        return self.length if isinstance(self.length, int) else len(self.length) # follows a source whose length changes as it is read
+
+    def __iter__(self) -> typing.Iterator[T]:
+        return iter(self.iterable())
+
+def interleave(iterables: typing.Iterable[typing.Iterable[T]]) -> typing.Iterator[T]:
+    iterators = deque(iter(it) for it in iterables)
+    while iterators:
+        it = iterators.popleft()
+        try:
+            yield next(it)
+        except StopIteration:
+            continue
+        iterators.append(it)
+
+def permuted(seq: typing.Sequence[T], seed: int | None = None) -> typing.Iterator[T]:
+    n = len(seq)
+    if seed is None or n < 2:
+        yield from seq
+        return
+    rnd = random.Random(seed)
+    step = rnd.randrange(1, n)
+    while math.gcd(step, n) != 1:
+        step = rnd.randrange(1, n)
+    offset = rnd.randrange(n)
+    for i in range(n):
+        yield seq[(offset + i * step) % n]
+
+def interleave_by(items: typing.Iterable[T], key: typing.Callable[[T], typing.Hashable], seed: int | None = None) -> list[T]:
+    groups: dict[typing.Hashable, list[T]] = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    if all(len(group) == 1 for group in groups.values()):
+        return [group[0] for group in groups.values()]
+    return list(interleave(permuted(group, seed) for group in groups.values()))
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    k, n = [int(x) for x in shard.split('/')]
+    if n < 1 or not 0 <= k < n:
+        raise ValueError(f'Invalid shard {shard}, expected K/N with 0 <= K < N')
+    return k, n
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_duration(duration: str) -> float:
+    if duration and duration[-1] in DURATION_UNITS:
+        seconds = float(duration[:-1]) * DURATION_UNITS[duration[-1]]
+    else:
+        seconds = float(duration)
+    if seconds < 0:
+        raise ValueError(f'Invalid duration {duration}, expected a number of seconds or 30s, 10m, 2h, 1d')
+    return seconds
+
+def parse_budget(budget: str) -> tuple[int | None, float | None]:
+    if not budget:
+        return None, None
+    if budget[-1] in DURATION_UNITS:
+        seconds = parse_duration(budget)
+        if seconds <= 0:
+            raise ValueError(f'Invalid budget {budget}, expected a positive duration')
+        return None, seconds
+    probes = int(budget)
+    if probes < 1:
+        raise ValueError(f'Invalid budget {budget}, expected a positive number of probes')
+    return probes, None
+
+def shard_path(path: str, shard: tuple[int, int]) -> str:
+    directory, name = os.path.split(path)
+    base, dot, extensions = name.partition('.')
+    return os.path.join(directory, f'{base}.shard{shard[0]}of{shard[1]}{dot}{extensions}')
 
 def split_by_n(lst: list[T], n: int) -> list[list[T]]:
     result = [[]]
@@ -42,36 +124,38 @@ def measure_execution_time(func: typing.Callable):
         now = datetime.datetime.now()
         current_time = now.strftime("%H:%M:%S")
         print(f'[timer] ({current_time}) started execution')
-        func(*args, **kwargs)
+        result = func(*args, **kwargs)
         elapsed = time.time() - start
         now = datetime.datetime.now()
         current_time = now.strftime("%H:%M:%S")
         print(f'[timer] ({current_time}) finished execution')
         print(f'[timer] execution took {elapsed/60} minutes')
+        return result
     return wrapper
 
-MC_COLOR_CODES = [
-    f'\u00a7{char}' for char in string.printable
-]
+MC_COLOR_CODES = re.compile('\u00a7[' + re.escape(string.printable) + ']')
 
 def remove_color_codes(s: str):
-    for c_code in MC_COLOR_CODES:
-        if c_code in s:
-            s = s.replace(c_code, '')
-    return s
-
-def ips_from_range(ip_range: str) -> list[str]:
-    if '/' not in ip_range[-3:]: return []
-    ip, mask = ip_range.split('/')
-    ips: list[str] = []
-    if mask == '24':
-        ip = '.'.join(ip.split('.')[:-1])
-        for i in range(1, 256):
-            ips.append(f'{ip}.{i}')
-    return ips
+    return MC_COLOR_CODES.sub('', s)
+
+def ips_from_range(ip_range: str) -> typing.Iterator[str]:
+    if '/' not in ip_range: return iter(())
+    return (str(ip) for ip in ipaddress.ip_network(ip_range, strict=False).hosts())
 
 def kill_proc(pid: int = os.getpid()):
     kill_command = f'kill {pid}'
     if sys.platform.startswith('win32'):
         kill_command = f'taskkill /F /PID {pid}'
     os.system(kill_command)
+
+def raise_open_files_limit(wanted: int) -> int:
+    try:
+        import resource
+    except ImportError:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= wanted:
+        return wanted
+    new_soft = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+    return new_soft
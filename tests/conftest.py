@@ -0,0 +1,12 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+@pytest.fixture
+def db_path(tmp_path):
+    from db.controller import set_db_path
+    path = str(tmp_path / 'mservers.db')
+    set_db_path(path)
+    return path
@@ -0,0 +1,51 @@
+from adaptive import AdaptiveController
+from config import ADAPTIVE_RTT_WINDOW, ADAPTIVE_WINDOW, ADAPTIVE_MIN_TIMEOUT, ADAPTIVE_MIN_CONCURRENCY
+from db.schemas import TIMEOUT, CONNECTION_RESET, CONNECTION_REFUSED
+
+def window(controller: AdaptiveController, rtt: float = 0.1, failures: int = 0, category: str = CONNECTION_REFUSED):
+    for _ in range(ADAPTIVE_WINDOW - failures):
+        controller.observe_success(rtt)
+    for _ in range(failures):
+        controller.observe_failure(category)
+
+def test_timeout_follows_response_times():
+    controller = AdaptiveController(10, 256)
+    window(controller, rtt=1.0)
+    assert controller.timeout == 2.0
+    for _ in range(ADAPTIVE_RTT_WINDOW // ADAPTIVE_WINDOW + 1):
+        window(controller, rtt=0.01)
+    assert controller.timeout == ADAPTIVE_MIN_TIMEOUT
+    window(controller, rtt=30)
+    assert controller.timeout == 10
+
+def test_resets_halve_and_clean_windows_grow_concurrency():
+    controller = AdaptiveController(10, 256)
+    window(controller)
+    assert controller.limit == 256
+    window(controller, failures=ADAPTIVE_WINDOW // 10, category=CONNECTION_RESET)
+    assert controller.limit == 128
+    window(controller)
+    assert controller.limit == 128 + 256 // 16
+    for _ in range(7):
+        window(controller)
+    assert controller.limit == 256
+
+def test_timeout_spike_above_baseline_backs_off():
+    controller = AdaptiveController(10, 256)
+    window(controller, failures=ADAPTIVE_WINDOW // 20, category=TIMEOUT)
+    assert controller.limit == 256
+    window(controller, failures=ADAPTIVE_WINDOW // 4, category=TIMEOUT)
+    assert controller.limit == 128
+
+def test_concurrency_never_drops_below_minimum():
+    controller = AdaptiveController(10, 256)
+    for _ in range(10):
+        window(controller, failures=ADAPTIVE_WINDOW // 2, category=CONNECTION_RESET)
+    assert controller.limit == ADAPTIVE_MIN_CONCURRENCY
+
+def test_gate_stops_workers_above_limit():
+    controller = AdaptiveController(10, 64)
+    window(controller, failures=ADAPTIVE_WINDOW // 2, category=CONNECTION_RESET)
+    assert controller.limit == 32
+    assert list(controller.gate(0, iter(range(3)))) == [0, 1, 2]
+    assert controller._drained
@@ -0,0 +1,46 @@
+from itertools import islice
+from db.controller import DBController, DBPool
+from db.controller.checkpoint import PageCheckpoint
+from db.controller.journal import SOCKET_UPDATE_RECORD
+from db.records import socket_record, status_record
+from db.schemas import CONNECTION_REFUSED
+
+HOST = 'rows.example.com'
+CHECKPOINT = 'db_sockets 0/1'
+
+def test_checkpoint_moves_past_whole_pages_only():
+    checkpoint = PageCheckpoint('test')
+    checkpoint.add_page([1, 2, 3])
+    checkpoint.add_page([5, 8])
+    checkpoint.done([1, 3, 5, 8])
+    assert checkpoint.last_id == 0
+    checkpoint.done([2])
+    assert checkpoint.last_id == 8
+    assert not checkpoint.complete
+    checkpoint.finish()
+    assert checkpoint.complete
+
+def scan(sockets, pool: DBPool):
+    records = []
+    for sock in sockets:
+        sock.status = status_record(CONNECTION_REFUSED)
+        records.append((SOCKET_UPDATE_RECORD, sock, -1))
+    pool.release(records)
+
+def test_db_sockets_resume_after_the_last_finished_page(db_path, monkeypatch):
+    monkeypatch.setattr('db.controller.dbcontoller.DB_PAGE_SIZE', 10)
+    DBController().safe_add_all_sockets([socket_record(HOST, port) for port in range(1, 51)])
+    pool = DBPool()
+    sockets = DBController().get_target_sockets(pool=pool)
+    assert len(sockets) == 50
+    scan(islice(iter(sockets), 25), pool)
+    assert DBController().get_checkpoint(CHECKPOINT).last_id == 20
+
+    pool = DBPool()
+    sockets = DBController().get_target_sockets(pool=pool)
+    assert len(sockets) == 25
+    rest = list(sockets)
+    assert [s.port for s in rest] == list(range(26, 51))
+    scan(rest, pool)
+    assert DBController().get_checkpoint(CHECKPOINT).last_id == 0
+    assert len(DBController().get_target_sockets()) == 0
@@ -0,0 +1,41 @@
+import errno
+import socket
+import pytest
+from sqlalchemy import text
+from db.records import status_record
+from db.controller import DBController
+from db.schemas import STATUS_DESCRIPTIONS, CONNECTION_REFUSED, TIMEOUT, CONNECTION_RESET, UNREACHABLE, DNS_FAILURE, PROTOCOL_ERROR, OS_ERROR
+from mine_scanner import status_category
+from slp import parse_status
+
+@pytest.mark.parametrize('ex, category', [
+    (socket.timeout('timed out'), TIMEOUT),
+    (TimeoutError(), TIMEOUT),
+    (ConnectionRefusedError(errno.ECONNREFUSED, 'Connection refused'), CONNECTION_REFUSED),
+    (ConnectionResetError(errno.ECONNRESET, 'Connection reset by peer'), CONNECTION_RESET),
+    (BrokenPipeError(errno.EPIPE, 'Broken pipe'), CONNECTION_RESET),
+    (socket.gaierror(socket.EAI_NONAME, 'Name or service not known'), DNS_FAILURE),
+    (OSError(errno.EHOSTUNREACH, 'No route to host'), UNREACHABLE),
+    (OSError(errno.ENETUNREACH, 'Network is unreachable'), UNREACHABLE),
+    (OSError('Received invalid status response'), PROTOCOL_ERROR),
+    (OSError(errno.EMFILE, 'Too many open files'), OS_ERROR),
+])
+def test_status_category(ex, category):
+    assert status_category(ex) == category
+
+def test_status_records_are_interned_by_category():
+    assert status_record(TIMEOUT) is status_record(TIMEOUT)
+    assert not hasattr(status_record(TIMEOUT), 'details')
+
+def test_status_ids_are_cached(db_path):
+    db = DBController()
+    ids = dict(db._conn.execute(text('SELECT name, id FROM statuses')).all())
+    assert set(ids) == set(STATUS_DESCRIPTIONS)
+    assert {name: status_record(name).id for name in STATUS_DESCRIPTIONS} == ids
+    assert db.safe_add_all_statuses([status_record(TIMEOUT), status_record(CONNECTION_REFUSED)]) == 0
+
+@pytest.mark.parametrize('payload', [b'', b'\x01\x02{}', b'\x00\x05{"a"', b'\x00\x02{}', b'\x00\x0b"not json"'])
+def test_invalid_status_is_a_protocol_error(payload):
+    with pytest.raises(OSError) as ex:
+        parse_status(memoryview(payload))
+    assert status_category(ex.value) == PROTOCOL_ERROR
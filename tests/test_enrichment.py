@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import threading
+import pytest
+from sqlalchemy import text
+from config import FARM_HOST
+from db.controller import DBController, DBPool
+from db.controller.journal import SERVER_RECORD
+from db.records import ServerRecord, socket_record, status_record
+from db.schemas import MINECRAFT_SERVER
+from enrichment import Enricher, enrichment_record
+from fake_farm import FarmConfig, run_farm, REFUSED
+
+FARM_FIRST_PORT = 32_200
+FARM_PORTS = 12
+
+def test_status_is_parsed_into_an_enrichment():
+    favicon = b'\x89PNG fake'
+    raw = {
+        'version': {'name': '1.20.1', 'protocol': '763'},
+        'players': {'online': 3, 'sample': [{'name': 'alex', 'id': 'a-1'}, {'name': 'no id'}, 'junk']},
+        'favicon': 'data:image/png;base64,' + base64.b64encode(favicon).decode(),
+        'forgeData': {'mods': [{'modId': 'forge', 'modmarker': '47.1'}, {'modId': 'jei', 'modmarker': '15.2'}]},
+    }
+    record = enrichment_record(7, 25565, raw, 0.05)
+    assert (record.host_id, record.port, record.online_players, record.protocol, record.latency) == (7, 25565, 3, 763, 0.05)
+    assert record.players == [('alex', 'a-1')]
+    assert record.favicon_hash == hashlib.sha256(favicon).hexdigest()
+    assert (record.mod_loader, record.mods) == ('forge', [('forge', '47.1'), ('jei', '15.2')])
+
+@pytest.mark.parametrize('raw, loader, mods', [
+    ({'modinfo': {'type': 'FML', 'modList': [{'modid': 'mcp', 'version': '9.42'}]}}, 'fml', [('mcp', '9.42')]),
+    ({'isModded': True}, 'modded', []),
+    ({'players': 'junk', 'version': None, 'favicon': 'data:image/png;base64,%%%'}, None, []),
+])
+def test_mods_and_broken_fields(raw, loader, mods):
+    record = enrichment_record(1, 1, raw, None)
+    assert (record.mod_loader, record.mods) == (loader, mods)
+    assert record.online_players is None and record.favicon_hash is None
+
+def test_invalid_status_fails():
+    with pytest.raises(OSError):
+        enrichment_record(1, 1, ['not', 'a', 'status'], None)
+
+@pytest.fixture(scope='module')
+def farm():
+    config = FarmConfig(FARM_PORTS, FARM_FIRST_PORT, servers=0.75, drop=0, slow=0, garbage=0, latency=0.01, slow_latency=0.01, seed=0)
+    started = threading.Event()
+    threading.Thread(target=run_farm, args=(config, started), daemon=True).start()
+    assert started.wait(10)
+    return config.layout()
+
+def test_found_servers_are_enriched(db_path, farm):
+    records = []
+    for port in farm:
+        sock = socket_record(FARM_HOST, port)
+        sock.status = status_record(MINECRAFT_SERVER)
+        records.append((SERVER_RECORD, ServerRecord(sock, '1.20.1', 'motd', 20), -1))
+    DBPool().release(records)
+    db = DBController()
+    enricher = Enricher(4, timeout=2)
+    enricher.submit(db.get_unenriched_servers(), wait=True)
+    enricher.close()
+    refused = sorted(port for port, kind in farm.items() if kind == REFUSED)
+    assert (enricher.enriched, enricher.failed) == (FARM_PORTS - len(refused), len(refused))
+    assert sorted(port for _, _, port in db.get_unenriched_servers()) == refused
+    rows = db._conn.execute(text('SELECT s.port, e.online_players, e.protocol, e.latency_ms FROM enrichments e JOIN sockets s ON s.id = e.socketId')).all()
+    assert all(online == port % 20 and protocol == 763 and latency is not None for port, online, protocol, latency in rows)
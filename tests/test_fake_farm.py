@@ -0,0 +1,33 @@
+import threading
+import pytest
+from config import FARM_HOST
+from db.controller import DBPool
+from db.records import SocketRecord, host_record
+from db.schemas import MINECRAFT_SERVER, CONNECTION_REFUSED, TIMEOUT, PROTOCOL_ERROR
+from fake_farm import FarmConfig, run_farm, SERVER, DROP, SLOW, GARBAGE, REFUSED
+from metrics import IN_FLIGHT
+from mine_scanner import check_target_sockets_t, check_target_sockets_a
+
+FARM_FIRST_PORT = 32_100
+FARM_PORTS = 60
+
+@pytest.fixture(scope='module')
+def farm():
+    config = FarmConfig(FARM_PORTS, FARM_FIRST_PORT, servers=0.2, drop=0.1, slow=0.1, garbage=0.1, latency=0.01, slow_latency=0.2, seed=0)
+    started = threading.Event()
+    threading.Thread(target=run_farm, args=(config, started), daemon=True).start()
+    assert started.wait(10)
+    return config.layout()
+
+EXPECTED = {SERVER: MINECRAFT_SERVER, SLOW: MINECRAFT_SERVER, DROP: TIMEOUT, GARBAGE: PROTOCOL_ERROR, REFUSED: CONNECTION_REFUSED}
+
+@pytest.mark.parametrize('check_target_sockets', [check_target_sockets_t, check_target_sockets_a])
+def test_fake_farm_probes_are_classified(db_path, farm, check_target_sockets):
+    host = host_record(FARM_HOST)
+    sockets = [SocketRecord(host, port) for port in farm]
+    servers = check_target_sockets(sockets, DBPool(), 16, 1)
+    assert {s.socket.port for s in servers} == {port for port, kind in farm.items() if EXPECTED[kind] == MINECRAFT_SERVER}
+    for sock in sockets:
+        assert sock.status is not None
+        assert sock.status.name == EXPECTED[farm[sock.port]], f'{sock.port} is {farm[sock.port]}'
+    assert IN_FLIGHT.snapshot() == 0
@@ -0,0 +1,56 @@
+import os
+from sqlalchemy import text
+from db.controller import DBController, DBPool
+from db.controller.journal import Journal, JOURNAL_SUFFIX, SERVER_RECORD, SOCKET_UPDATE_RECORD, journal_paths, segment_paths
+from db.records import ServerRecord, socket_record, status_record
+from db.schemas import MINECRAFT_SERVER, CONNECTION_REFUSED
+
+def journal_results(journal: Journal, host: str = '0.tcp.eu.ngrok.io', ports: range = range(1, 101)):
+    for port in ports:
+        sock = socket_record(host, port)
+        if port % 10 == 0:
+            sock.status = status_record(MINECRAFT_SERVER)
+            journal.append(SERVER_RECORD, ServerRecord(sock, '1.20', 'motd "quoted"\n§a', 20))
+        else:
+            sock.status = status_record(CONNECTION_REFUSED)
+            journal.append(SOCKET_UPDATE_RECORD, sock)
+
+def rows(db: DBController, query: str):
+    return db._conn.execute(text(query)).all()
+
+def test_applied_segments_are_deleted(tmp_path):
+    journal = Journal(str(tmp_path / 'j'))
+    first = journal.append(SOCKET_UPDATE_RECORD, socket_record('a', 1))
+    journal.rotate()
+    second = journal.append(SOCKET_UPDATE_RECORD, socket_record('a', 2))
+    journal.flush()
+    assert len(segment_paths(journal.path)) == 2
+    journal.applied([first])
+    assert segment_paths(journal.path) == [journal.segment_path(second)]
+    journal.applied([second])
+    journal.close()
+    assert segment_paths(journal.path) == []
+
+def test_crashed_journal_is_replayed(db_path):
+    journal = Journal(db_path + JOURNAL_SUFFIX)
+    journal_results(journal)
+    journal.flush()
+    with open(journal.segment_path(0), 'ab') as f:
+        f.write(b'[1,"torn')
+    paths = journal_paths(db_path)
+    assert paths == [journal.segment_path(0)]
+    DBPool().replay(paths)
+    assert journal_paths(db_path) == []
+    db = DBController()
+    assert rows(db, 'SELECT count(*) FROM mservers') == [(10, )]
+    assert rows(db, 'SELECT st.name, count(*) FROM sockets s JOIN statuses st ON st.id = s.statusId GROUP BY 1 ORDER BY 1') == [(CONNECTION_REFUSED, 90), (MINECRAFT_SERVER, 10)]
+    assert rows(db, 'SELECT description FROM mservers LIMIT 1') == [('motd "quoted"\n§a', )]
+
+def test_pool_replays_its_own_journal(db_path):
+    journal_path = db_path + JOURNAL_SUFFIX
+    journal = Journal(journal_path)
+    journal_results(journal, ports=range(1, 21))
+    journal.flush()
+    DBPool(journal_path=journal_path)
+    assert not os.path.exists(journal.segment_path(0))
+    assert rows(DBController(), 'SELECT count(*) FROM mservers') == [(2, )]
@@ -0,0 +1,80 @@
+import time
+from itertools import islice
+from array import array
+import pytest
+from config import NGROK_HOSTS, NGROK_PORTS
+from db.controller import DBController, DBPool
+from db.controller import scan_state
+from db.controller.journal import SERVER_RECORD, SOCKET_UPDATE_RECORD
+from db.controller.negative_cache import parse_ttls
+from db.controller.scan_state import encode_ports, decode_times, decode_ports
+from db.records import ServerRecord, socket_record, status_record
+from db.schemas import CONNECTION_REFUSED, TIMEOUT, MINECRAFT_SERVER
+from targets import file_sockets
+from utils import LazyIterable
+from mine_scanner import craft_probes, ngrok_sockets
+
+HOST = 'scan.example.com'
+
+def fail(ports: range, status: str = CONNECTION_REFUSED, host: str = HOST):
+    records = []
+    for port in ports:
+        sock = socket_record(host, port)
+        sock.status = status_record(status)
+        records.append((SOCKET_UPDATE_RECORD, sock, -1) if status != MINECRAFT_SERVER else (SERVER_RECORD, ServerRecord(sock, '1.20', 'motd', 20), -1))
+    DBPool().release(records)
+
+def test_parse_ttls():
+    assert parse_ttls(None)[CONNECTION_REFUSED] == 6 * 3600
+    assert set(parse_ttls('1h').values()) == {3600}
+    ttls = parse_ttls('refused=1d,timeout=0')
+    assert ttls[CONNECTION_REFUSED] == 86400 and TIMEOUT not in ttls
+    with pytest.raises(ValueError):
+        parse_ttls('closed=1h')
+    with pytest.raises(ValueError):
+        parse_ttls('refused=-1')
+
+def test_fresh_failures_are_skipped_and_expired_ones_evicted(db_path):
+    db = DBController()
+    db.track_hosts([HOST])
+    fail(range(1, 4))
+    fail(range(4, 6), TIMEOUT)
+    fail(range(6, 7), MINECRAFT_SERVER)
+    ttls = {CONNECTION_REFUSED: 3600, TIMEOUT: 60, MINECRAFT_SERVER: 3600}
+    negative = db.get_negative_cache(ttls)
+    assert [port for port in range(1, 8) if negative.fresh(HOST, port)] == [1, 2, 3, 4, 5]
+    negative = db.get_negative_cache(ttls, now=time.time() + 600)
+    assert [port for port in range(1, 8) if negative.fresh(HOST, port)] == [1, 2, 3]
+    assert [port for port in range(1, 8) if db.get_negative_cache({TIMEOUT: 3600}).fresh(HOST, port)] == []
+
+def test_ngrok_totals_leave_out_fresh_failures(db_path):
+    db = DBController()
+    db.track_hosts(NGROK_HOSTS)
+    fail(range(1, 6), host=NGROK_HOSTS[0])
+    negative = db.get_negative_cache({CONNECTION_REFUSED: 3600})
+    sockets = ngrok_sockets((0, 1), negative)
+    assert len(sockets) == len(NGROK_HOSTS) * NGROK_PORTS - 5
+    assert not any(s.host.name == NGROK_HOSTS[0] and s.port < 6 for s in islice(iter(sockets), 100))
+
+def test_big_endian_times_keep_their_width(monkeypatch):
+    monkeypatch.setattr(scan_state.sys, 'byteorder', 'big')
+    times = array('I', [0, 70_000, int(time.time())])
+    assert decode_times(encode_ports(times)) == times
+    ports = array('H', [0, 1, 65_535])
+    assert decode_ports(encode_ports(ports)) == ports
+
+def test_load_length_follows_skips_and_duplicates(db_path, tmp_path):
+    db = DBController()
+    db.track_hosts([HOST])
+    fail(range(1, 6))
+    path = tmp_path / 't.txt'
+    path.write_text(f'{HOST}:1-10\n{HOST}:1-3\nuntracked.example.com:1-2\n')
+    loaded = file_sockets(str(path))
+    negative = db.get_negative_cache({CONNECTION_REFUSED: 3600})
+    assert negative.tracked == {HOST}
+    sockets = LazyIterable(loaded, lambda: negative.skip_fresh(loaded, loaded))
+    probes = craft_probes(lambda **kwargs: None, lambda **kwargs: None, sockets, 1)
+    assert len(probes) == 15
+    scanned = [(s.host.name, s.port) for s in sockets]
+    assert sorted(scanned) == [(HOST, port) for port in range(6, 11)] + [('untracked.example.com', 1), ('untracked.example.com', 2)]
+    assert len(sockets) == len(probes) == 7
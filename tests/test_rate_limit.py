@@ -0,0 +1,54 @@
+import pytest
+import rate_limit
+from rate_limit import HostRateLimiter
+from utils import interleave_by, permuted
+
+class Clock():
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    return clock
+
+def test_bursts_pass_and_the_rest_is_spaced_by_rate(clock):
+    limiter = HostRateLimiter(10, 3)
+    assert [limiter.reserve('a') for _ in range(3)] == [0, 0, 0]
+    assert [limiter.reserve('a') for _ in range(2)] == pytest.approx([0.1, 0.2])
+    assert limiter.reserve('b') == 0
+    assert limiter.delayed == 2 and limiter.waited == pytest.approx(0.3)
+
+def test_tokens_refill_up_to_the_burst(clock):
+    limiter = HostRateLimiter(8, 2)
+    limiter.reserve('a'), limiter.reserve('a')
+    clock.now += 0.125
+    assert limiter.reserve('a') == 0
+    assert limiter.reserve('a') == 0.125
+    clock.now += 60
+    assert [limiter.reserve('a') for _ in range(3)] == [0, 0, 0.125]
+
+def test_no_rate_means_no_limit(clock):
+    limiter = HostRateLimiter(0, 1)
+    assert all(limiter.reserve('a') == 0 for _ in range(100))
+    limiter.configure(1, 0)
+    assert limiter.burst == 1
+    assert limiter.reserve('a') == 0 and limiter.reserve('a') == pytest.approx(1)
+
+def test_targets_are_interleaved_across_hosts():
+    items = [('a', 1), ('a', 2), ('a', 3), ('b', 1), ('c', 1), ('c', 2)]
+    assert interleave_by(items, lambda item: item[0]) == [('a', 1), ('b', 1), ('c', 1), ('a', 2), ('c', 2), ('a', 3)]
+
+@pytest.mark.parametrize('n', [1, 2, 10, 65_535])
+def test_seeded_port_orders_are_stable_permutations(n):
+    ports = range(1, n + 1)
+    order = list(permuted(ports, 7))
+    assert sorted(order) == list(ports)
+    assert order == list(permuted(ports, 7))
+    assert list(permuted(ports)) == list(ports)
+    if n > 2:
+        assert order != list(ports)
@@ -0,0 +1,55 @@
+from db.controller import DBController, DBPool
+from db.controller.journal import SERVER_RECORD, SOCKET_UPDATE_RECORD
+from db.controller.rescan import rank_buckets
+from db.controller.scan_state import HostState, PORTS
+from db.records import ServerRecord, socket_record, status_record
+from db.schemas import CONNECTION_REFUSED, MINECRAFT_SERVER
+
+HOST = 'scan.example.com'
+SERVERS = [300, 310]
+
+def scan_results(host: str, ports: range, servers: list[int]):
+    records = []
+    for port in ports:
+        sock = socket_record(host, port)
+        if port in servers:
+            sock.status = status_record(MINECRAFT_SERVER)
+            records.append((SERVER_RECORD, ServerRecord(sock, '1.20', 'motd', 20), -1))
+        else:
+            sock.status = status_record(CONNECTION_REFUSED)
+            records.append((SOCKET_UPDATE_RECORD, sock, -1))
+    DBPool().release(records)
+
+def scanned_db() -> DBController:
+    db = DBController()
+    db.track_hosts([HOST])
+    scan_results(HOST, range(1, 2049), SERVERS)
+    scan_results('rows.example.com', range(25565, 25566), [25565])
+    return db
+
+def pairs(sockets):
+    return [(s.host.name, s.port) for s in sockets]
+
+def test_buckets_with_hits_rank_before_unscanned_and_cold_ones():
+    state = HostState(1, HOST)
+    for port in range(1, 513):
+        state.mark(port, 1)
+    buckets = rank_buckets([state], {1: [300]}, bucket_size=256)
+    assert [b.start for b in buckets[:2]] == [257, 513]
+    assert buckets[-1].start == 1 and buckets[-1].hits == 0 and buckets[-1].scanned == 256
+
+def test_rescan_order(db_path):
+    sockets = scanned_db().get_rescan_sockets()
+    order = pairs(sockets)
+    assert order[:3] == [(HOST, 300), (HOST, 310), ('rows.example.com', 25565)]
+    assert sorted(order[3:257]) == [(HOST, port) for port in range(257, 513) if port not in SERVERS]
+    assert order[257] == (HOST, 2049)
+    assert 1 <= order[-1][1] <= 2048
+    assert len(order) == len(set(order)) == len(sockets) == PORTS
+
+def test_rescan_budget_and_shards(db_path):
+    db = scanned_db()
+    assert pairs(db.get_rescan_sockets(probes=10))[:3] == [(HOST, 300), (HOST, 310), ('rows.example.com', 25565)]
+    assert len(db.get_rescan_sockets(probes=10)) == len(list(db.get_rescan_sockets(probes=10))) == 10
+    shards = [pairs(db.get_rescan_sockets((k, 3))) for k in range(3)]
+    assert sum(len(shard) for shard in shards) == len(set().union(*shards)) == PORTS
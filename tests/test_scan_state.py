@@ -0,0 +1,93 @@
+import itertools
+import pytest
+from sqlalchemy import text
+from config import NGROK_HOSTS, NGROK_PORTS
+from db.controller import DBController, DBPool, set_db_path
+from db.controller.journal import SERVER_RECORD, SOCKET_UPDATE_RECORD
+from db.controller.scan_state import in_shard, shard_ports, host_key
+from db.records import ServerRecord, host_record, socket_record, status_record
+from db.schemas import MINECRAFT_SERVER, CONNECTION_REFUSED, TIMEOUT
+from mine_scanner import ngrok_sockets
+
+HOST = 'scan.example.com'
+
+def scan_results(results: dict[int, str]):
+    records = []
+    for port, status in results.items():
+        sock = socket_record(HOST, port)
+        sock.status = status_record(status)
+        records.append((SERVER_RECORD, ServerRecord(sock, '1.20', 'motd', 20), -1) if status == MINECRAFT_SERVER else (SOCKET_UPDATE_RECORD, sock, -1))
+    DBPool().release(records)
+
+def port_statuses(db: DBController, ports: list[int]) -> dict[int, str]:
+    names = dict(db._conn.execute(text('SELECT id, name FROM statuses')).all())
+    state = db.get_scan_states().get(HOST)
+    assert state is not None
+    return {port: names.get(state.status(port), '') for port in ports}
+
+@pytest.mark.parametrize('key, n', [(1, 3), (7, 4), (host_key(HOST), 7)])
+def test_shard_ports_match_in_shard(key, n):
+    ports = range(1, 1000)
+    for k in range(n):
+        assert list(shard_ports(key, ports, (k, n))) == [p for p in ports if in_shard(key, p, (k, n))]
+
+def test_pool_marks_tracked_hosts(db_path):
+    db = DBController()
+    db.track_hosts([HOST])
+    scan_results({100: CONNECTION_REFUSED, 200: MINECRAFT_SERVER, 300: TIMEOUT})
+    assert port_statuses(db, [100, 200, 300, 400]) == {100: CONNECTION_REFUSED, 200: MINECRAFT_SERVER, 300: TIMEOUT, 400: ''}
+    assert db._conn.execute(text('SELECT s.port FROM sockets s JOIN mservers m ON m.socketId = s.id')).all() == [(200, )]
+    assert db.get_scan_states().get(HOST).unscanned_count() == NGROK_PORTS - 3
+
+def test_merge_combines_shard_states(tmp_path):
+    shards = {'a.db': {100: CONNECTION_REFUSED, 200: MINECRAFT_SERVER}, 'b.db': {300: TIMEOUT}}
+    for name, results in shards.items():
+        set_db_path(str(tmp_path / name))
+        DBController().track_hosts([HOST])
+        scan_results(results)
+    set_db_path(str(tmp_path / 'merged.db'))
+    db = DBController()
+    [db.merge_db(str(tmp_path / name)) for name in shards]
+    assert port_statuses(db, [100, 200, 300, 400]) == {100: CONNECTION_REFUSED, 200: MINECRAFT_SERVER, 300: TIMEOUT, 400: ''}
+    assert db._conn.execute(text('SELECT count(*) FROM mservers')).scalar() == 1
+
+def test_tracking_keeps_legacy_rows(db_path):
+    db = DBController()
+    host = socket_record(HOST, 1).host
+    db.safe_add_all_hosts([host])
+    db._conn.execute(text("INSERT INTO statuses (name) VALUES ('ConnectionRefusedError [Errno 111] Connection refused')"))
+    legacy = db._conn.execute(text("SELECT id FROM statuses WHERE name LIKE 'ConnectionRefusedError%'")).scalar()
+    refused = db._conn.execute(text('SELECT id FROM statuses WHERE name = :name'), {'name': CONNECTION_REFUSED}).scalar()
+    db._conn.execute(text('INSERT INTO sockets (hostId, port, statusId) VALUES (:h, 100, :legacy), (:h, 101, :refused), (:h, 102, NULL)'), {'h': host.id, 'legacy': legacy, 'refused': refused})
+    db._conn.commit()
+    db.track_hosts([HOST])
+    assert db._conn.execute(text('SELECT port FROM sockets')).all() == [(100, )]
+    assert port_statuses(db, [100, 101, 102])[101] == CONNECTION_REFUSED
+
+def test_ngrok_shards_match_db_shards():
+    n = 3
+    shards = [ngrok_sockets((k, n)) for k in range(n)]
+    assert sum(len(shard) for shard in shards) == len(NGROK_HOSTS) * NGROK_PORTS
+    for k, shard in enumerate(shards):
+        assert all(in_shard(host_key(s.host.name), s.port, (k, n)) for s in itertools.islice(iter(shard), 5000))
+
+def test_shards_do_not_depend_on_host_ids(tmp_path):
+    n = 3
+    shards = {}
+    for name, other_hosts in {'a.db': [], 'b.db': ['other.example.com', 'another.example.com']}.items():
+        set_db_path(str(tmp_path / name))
+        db = DBController()
+        db.safe_add_all_hosts([host_record(host) for host in other_hosts])
+        db.track_hosts([HOST])
+        db.safe_add_all_sockets([socket_record('rows.example.com', port) for port in range(1, 301)])
+        shards[name] = [{(s.host.name, s.port) for s in db.get_target_sockets((k, n))} for k in range(n)]
+    assert shards['a.db'] == shards['b.db']
+    everything = set().union(*shards['a.db'])
+    assert sum(len(shard) for shard in shards['a.db']) == len(everything) == NGROK_PORTS + 300
+
+def test_tracking_after_another_controller(db_path):
+    DBController()
+    db = DBController()
+    db.track_hosts([HOST])
+    assert HOST in db.get_scan_states()
+    db.merge_scan_states({}, [])
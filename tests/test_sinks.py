@@ -0,0 +1,73 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+import zstandard
+import main
+from db.records import ServerRecord, socket_record
+from sinks import Sinks, check_output_path
+
+def server(port: int, description: str = 'motd') -> ServerRecord:
+    return ServerRecord(socket_record('play.example.com', port), '1.20', description, 20)
+
+def read_text(path: str) -> str:
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return f.read()
+    if path.endswith('.zst'):
+        with open(path, 'rb') as f:
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True), encoding='utf-8').read()
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+@pytest.mark.parametrize('name', ['servers.jsonl', 'servers.txt', 'servers.jsonl.gz', 'servers.jsonl.zst'])
+def test_json_lines_are_appended_across_runs(tmp_path, name):
+    path = str(tmp_path / name)
+    for port in (1, 2):
+        sinks = Sinks([path])
+        sinks.write(server(port, 'quoted "motd"\n§a'))
+        sinks.close()
+    lines = [json.loads(line) for line in read_text(path).splitlines()]
+    assert [line['socket'] for line in lines] == ['play.example.com:1', 'play.example.com:2']
+    assert lines[0] == {'socket': 'play.example.com:1', 'version': '1.20', 'description': 'quoted "motd"\n§a', 'max_players': 20}
+
+@pytest.mark.parametrize('name', ['servers.csv', 'servers.csv.gz'])
+def test_csv_header_is_written_once(tmp_path, name):
+    path = str(tmp_path / name)
+    for port in (1, 2):
+        sinks = Sinks([path])
+        sinks.write(server(port, 'a, "b"\nc'))
+        sinks.close()
+    rows = list(csv.reader(io.StringIO(read_text(path))))
+    assert rows == [['host', 'port', 'version', 'description', 'max_players'], ['play.example.com', '1', '1.20', 'a, "b"\nc', '20'], ['play.example.com', '2', '1.20', 'a, "b"\nc', '20']]
+
+def test_flush_makes_servers_readable_before_close(tmp_path):
+    path = str(tmp_path / 'servers.jsonl')
+    sinks = Sinks([path])
+    sinks.write(server(1))
+    sinks.flush()
+    assert read_text(path).count('\n') == 1
+    sinks.close()
+    sinks.write(server(2))
+    assert read_text(path).count('\n') == 1
+
+@pytest.mark.parametrize('name', ['servers.json', 'servers.gz', 'servers.jsonl.bz2'])
+def test_unsupported_outputs_are_rejected(name):
+    with pytest.raises(ValueError):
+        check_output_path(name)
+
+def test_interrupted_scan_closes_compressed_sinks(db_path, tmp_path, monkeypatch):
+    pools = [] # a running scan keeps the pool alive, so its files are not closed by garbage collection
+    def interrupted(sockets, pool, workers, timeout, adaptive):
+        pools.append(pool)
+        pool.add_server(server(25565))
+        raise KeyboardInterrupt()
+    monkeypatch.setitem(main.ENGINES, 'threads', (None, interrupted))
+    targets = tmp_path / 't.txt'
+    targets.write_text('play.example.com:25565\n')
+    output = str(tmp_path / 'servers.jsonl.gz')
+    with pytest.raises(KeyboardInterrupt):
+        main.main(threads=1, load_from=str(targets), timeout=1, gen_sockets=False, output=[output], pre_load_sockets=False, db_sockets=False, engine='threads')
+    with gzip.open(output, 'rt') as f:
+        assert [json.loads(line)['socket'] for line in f] == ['play.example.com:25565']
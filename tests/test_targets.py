@@ -0,0 +1,97 @@
+import gzip
+import ipaddress
+import pytest
+from targets import BloomFilter, TargetFile, file_sockets, sample_lines, host_count, host_names, parse_ports, parse_target
+
+def write_targets(path, lines, compress=False):
+    text = '\n'.join(lines) + '\n'
+    if compress:
+        with gzip.open(path, 'wt') as f:
+            f.write(text)
+    else:
+        path.write_text(text)
+    return str(path)
+
+def pairs(sockets):
+    return [(s.host.name, s.port) for s in sockets]
+
+def test_parse_ports():
+    assert [list(r) for r in parse_ports('25565,30000-30002')] == [[25565], [30000, 30001, 30002]]
+
+@pytest.mark.parametrize('spec', ['0', '65536', '5-3', 'x', '1-'])
+def test_parse_invalid_ports(spec):
+    with pytest.raises(ValueError):
+        parse_ports(spec)
+
+def test_parse_target():
+    hosts, ports = parse_target('10.0.0.0/30:25565-25566')
+    assert hosts == ipaddress.ip_network('10.0.0.0/30')
+    assert sum(len(r) for r in ports) == 2
+    assert parse_target('[::1]:25565')[0] == ['::1']
+    assert parse_target('play.example.com:25565')[0] == ['play.example.com']
+    with pytest.raises(ValueError):
+        parse_target('play.example.com')
+
+@pytest.mark.parametrize('spec', ['10.0.0.0/30', '10.0.0.0/31', '10.0.0.1/32', '10.0.0.0/24', '2001:db8::/126', '2001:db8::/127', '2001:db8::/128', '2001:db8::/120'])
+def test_host_count_matches_hosts(spec):
+    network = ipaddress.ip_network(spec)
+    hosts = [str(ip) for ip in network.hosts()]
+    assert host_count(network) == len(hosts)
+    assert list(host_names(network)) == hosts
+
+def test_bloom_filter():
+    seen = BloomFilter(1000, 1)
+    assert seen.add(('a', 1))
+    assert not seen.add(('a', 1))
+    assert seen.add(('a', 2))
+    assert seen.added == 2
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_target_file_expands_ranges_and_cidr(tmp_path, compress):
+    lines = ['# comment', 'play.example.com:25565 # trailing comment', '10.0.0.0/30:25565-25566', 'not a target', '[2001:db8::1]:25565', '']
+    path = write_targets(tmp_path / ('t.txt.gz' if compress else 't.txt'), lines, compress)
+    target_file = TargetFile(path, dedup_mb=0)
+    assert target_file.estimate() == (6, True)
+    assert sorted(pairs(target_file.targets())) == sorted([
+        ('play.example.com', 25565),
+        ('10.0.0.1', 25565), ('10.0.0.2', 25565), ('10.0.0.1', 25566), ('10.0.0.2', 25566),
+        ('2001:db8::1', 25565),
+    ])
+
+def test_shards_split_targets_exactly_once(tmp_path):
+    path = write_targets(tmp_path / 't.txt', ['a.example.com:1-7', '10.0.0.0/29:100,200', 'b.example.com:5', '10.1.0.0/30:1-3'])
+    everything = pairs(TargetFile(path, dedup_mb=0).targets())
+    n = 4
+    shards = [pairs(TargetFile(path, (k, n), dedup_mb=0).targets()) for k in range(n)]
+    assert sorted(sum(shards, [])) == sorted(everything)
+    for k in range(n):
+        assert TargetFile(path, (k, n), dedup_mb=0).estimate() == (len(shards[k]), True)
+
+def test_duplicates_are_skipped(tmp_path):
+    lines = [f'127.0.0.1:{port}' for port in range(40000, 40300)] + [f'127.0.0.1:{port}' for port in range(40000, 40011)] + ['127.0.0.0/30:40000']
+    path = write_targets(tmp_path / 'dup.txt', lines)
+    sockets = file_sockets(path)
+    assert len(sockets) == 313
+    scanned = pairs(sockets)
+    assert len(scanned) == len(set(scanned)) == 301
+    assert len(sockets) == 301
+    assert len(pairs(file_sockets(path, dedup_mb=0))) == 313
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_large_files_are_estimated_from_a_sample(tmp_path, compress, monkeypatch):
+    lines = [f'10.{i // 250}.{i % 250}.1:{25565 + i % 7}' for i in range(20_000)]
+    path = write_targets(tmp_path / ('t.txt.gz' if compress else 't.txt'), lines, compress)
+    monkeypatch.setattr('targets.TARGETS_SAMPLE_BYTES', 4096)
+    lines_read, share = sample_lines(path, 4096)
+    assert 0 < share < 1 and len(lines_read) < len(lines)
+    sockets = file_sockets(path, dedup_mb=0)
+    assert 0.5 * len(lines) < len(sockets) < 2 * len(lines)
+    assert len(pairs(sockets)) == len(sockets) == len(lines)
+
+def test_estimate_is_corrected_while_reading(tmp_path, monkeypatch):
+    lines = ['a.example.com:1'] * 500 + ['10.0.0.0/24:1-100']
+    path = write_targets(tmp_path / 't.txt', lines)
+    monkeypatch.setattr('targets.TARGETS_SAMPLE_BYTES', 1024)
+    sockets = file_sockets(path)
+    assert len(sockets) < 1000
+    assert len(pairs(sockets)) == len(sockets) == 1 + 254 * 100